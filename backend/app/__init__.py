@@ -1,11 +1,50 @@
-from flask import Flask
+import logging
+import os
+import time
+from io import BytesIO
+
+from flask import Flask, Request, g, jsonify, request
 from flask_cors import CORS
 
+# Uploads up to this size stay in memory; larger ones (videos, archives) spool to a temp file
+IN_MEMORY_UPLOAD_BYTES = 32 * 1024 * 1024
+
+class InMemoryRequest(Request):
+    """Keep uploaded images in memory instead of spooling them to a temp file"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= IN_MEMORY_UPLOAD_BYTES:
+            return BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
 def create_app():
+    # LOG_LEVEL=DEBUG logs every prediction; the default keeps the hot path quiet
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     app = Flask(__name__)
+    app.request_class = InMemoryRequest
     CORS(app)
     
     from .routes import main
+    from metrics import observe_request
+    from serving import MAX_UPLOAD_BYTES
     app.register_blueprint(main)
+    # Request bodies above MAX_UPLOAD_MB are rejected with 413 while they are read
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+    
+    @app.errorhandler(413)
+    def upload_too_large(error):
+        return jsonify({'error': 'Upload is too large'}), 413
+    
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+    
+    @app.after_request
+    def record_request_metrics(response):
+        # Label by route template, not raw path, to keep the label set bounded
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        started = g.get('request_started', time.perf_counter())
+        observe_request(endpoint, request.method, response.status_code, time.perf_counter() - started)
+        return response
     
     return app 
\ No newline at end of file
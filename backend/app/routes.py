@@ -1,33 +1,44 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, send_file
+import logging
 import os
-from werkzeug.utils import secure_filename
 import sys
-import os
+import time
 
-# Add the parent directory to the Python path
+# Add the backend directory (serving.py) and its parent to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from deepfake_detector import DeepfakeDetector
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from extract_frames import VIDEO_EXTENSIONS, VideoOpenError
+from metrics import StageTimer, observe_prediction, render
+from uploads import IMAGE_EXTENSIONS, UnsupportedUpload, UploadTooLarge, read_image_upload
+from serving import (MAX_IMAGE_UPLOAD_BYTES, close_uploads, jobs, load_model, model_ready, models, readiness,
+                     score_upload, score_video, spool_upload, stream_batch)
 
 main = Blueprint('main', __name__)
+logger = logging.getLogger(__name__)
 
-# Set up model path
-MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
-MODEL_PATH = os.path.join(MODEL_DIR, 'deepfake_model.h5')
-
-# Initialize the detector
-detector = DeepfakeDetector(model_path=MODEL_PATH)
-
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# Model configuration, loading and scoring live in serving.py, shared with the FastAPI backend.
+# The Flask app loads and warms up the model before it serves its first request; later
+# versions are swapped in by the registry poller
+load_model()
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# The formats read_image_upload accepts
+ALLOWED_EXTENSIONS = {ext.lstrip('.') for ext in IMAGE_EXTENSIONS}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def not_ready():
+    """503 for requests that need a model while none could be loaded"""
+    response = jsonify({'error': 'Model is not loaded'})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
 @main.route('/api/predict', methods=['POST'])
 def predict():
+    # A declared oversized body is refused before it is parsed. Chunked bodies are capped
+    # by MAX_CONTENT_LENGTH while they are read, and the image itself by read_image_upload.
+    if request.content_length is not None and request.content_length > MAX_IMAGE_UPLOAD_BYTES:
+        return jsonify({'error': f"Upload is larger than {MAX_IMAGE_UPLOAD_BYTES} bytes"}), 413
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
@@ -36,40 +47,246 @@ def predict():
         return jsonify({'error': 'No file selected'}), 400
     
     if file and allowed_file(file.filename):
+        if not model_ready.is_set():
+            return not_ready()
+        timer = StageTimer('/api/predict')
         try:
-            # Create a temporary file
-            temp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'temp')
-            if not os.path.exists(temp_dir):
-                os.makedirs(temp_dir)
-                
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(temp_dir, filename)
-            
-            # Save the file
-            file.save(filepath)
-            
-            # Get prediction
-            result = detector.predict(filepath)
-            
-            # Clean up the temporary file
+            started = time.perf_counter()
+            # Decode straight from the request body; nothing is written to disk
+            # The body has been parsed by now; check the file's signature and size
+            with timer.stage('read'):
+                try:
+                    content = read_image_upload(file.stream, MAX_IMAGE_UPLOAD_BYTES)
+                except UnsupportedUpload as e:
+                    return jsonify({'error': str(e)}), 415
+                except UploadTooLarge as e:
+                    return jsonify({'error': str(e)}), 413
             try:
-                os.remove(filepath)
-            except Exception as e:
-                print(f"Warning: Could not remove temporary file: {str(e)}")
-            
+                result, cached = score_upload(content, timer)
+            except ConnectionError:
+                # MODEL_RUNTIME=remote and the inference server is down, restarting or saturated
+                response = jsonify({'error': 'Inference server unavailable'})
+                response.headers['Retry-After'] = '5'
+                return response, 503
             if result is None:
-                return jsonify({'error': 'Error processing image'}), 500
+                return jsonify({'error': 'Could not decode image'}), 400
+            observe_prediction('/api/predict', result, cached)
+            logger.debug("Prediction result: %s", result)
             
-            return jsonify({
-                'is_fake': result['is_fake'],
-                'confidence': result['confidence'],
-                'raw_score': result['raw_score']
-            })
+            with timer.stage('serialize'):
+                response = jsonify({
+                    'is_fake': result['is_fake'],
+                    'confidence': result['confidence'],
+                    'raw_score': result['raw_score'],
+                    'stage': result['stage']
+                })
+            timer.timings['total'] = time.perf_counter() - started
+            response.headers['Server-Timing'] = timer.server_timing()
+            return response
         except Exception as e:
+            logger.exception("Error processing request: %s", e)
             return jsonify({'error': str(e)}), 500
     
     return jsonify({'error': 'Invalid file type'}), 400
 
+def video_params():
+    """Video sampling options from the query string, or an error message"""
+    params = {
+        'sampling': request.args.get('sampling', 'uniform'),
+        'max_frames': request.args.get('max_frames', 64, type=int),
+        'frame_rate': request.args.get('frame_rate', None, type=int),
+        'early_exit_confidence': request.args.get('early_exit_confidence', None, type=float),
+    }
+    if params['sampling'] not in ('uniform', 'scene'):
+        return None, 'sampling must be uniform or scene'
+    if not 1 <= params['max_frames'] <= 1024:
+        return None, 'max_frames must be between 1 and 1024'
+    if params['frame_rate'] is not None and params['frame_rate'] < 1:
+        return None, 'frame_rate must be at least 1'
+    if params['early_exit_confidence'] is not None and not 0.5 < params['early_exit_confidence'] <= 1.0:
+        return None, 'early_exit_confidence must be above 0.5 and at most 1'
+    return params, None
+
+@main.route('/api/predict_video', methods=['POST'])
+def predict_video():
+    """Score an uploaded video synchronously; see /api/jobs/video for long videos"""
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file provided'}), 400
+    suffix = os.path.splitext(file.filename)[1].lower()
+    if not (file.content_type or '').startswith('video/') and suffix not in VIDEO_EXTENSIONS:
+        return jsonify({'error': 'File must be a video'}), 400
+    params, error = video_params()
+    if error:
+        return jsonify({'error': error}), 400
+    if not model_ready.is_set():
+        return not_ready()
+    
+    timer = StageTimer('/api/predict_video')
+    started = time.perf_counter()
+    try:
+        result = score_video(file.stream, suffix or '.mp4', params, timer)
+    except VideoOpenError:
+        return jsonify({'error': 'Could not open video'}), 400
+    except ConnectionError:
+        # MODEL_RUNTIME=remote and the inference server is down, restarting or saturated
+        response = jsonify({'error': 'Inference server unavailable'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    except Exception as e:
+        logger.exception("Error processing video: %s", e)
+        return jsonify({'error': str(e)}), 500
+    if result is None:
+        return jsonify({'error': 'No frames could be decoded from the video'}), 400
+    observe_prediction('/api/predict_video', result)
+    
+    with timer.stage('serialize'):
+        response = jsonify(result)
+    timer.timings['total'] = time.perf_counter() - started
+    response.headers['Server-Timing'] = timer.server_timing()
+    return response
+
+@main.route('/api/predict_batch', methods=['POST'])
+def predict_batch():
+    """Score images and/or zip archives of images; rows stream back in upload order"""
+    if not model_ready.is_set():
+        return not_ready()
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in ('jsonl', 'csv'):
+        return jsonify({'error': 'format must be jsonl or csv'}), 400
+    
+    # The request's files are closed when the view returns, before the rows stream
+    uploads = []
+    try:
+        for index, file in enumerate(files):
+            uploads.append((file.filename or f"file_{index}", spool_upload(file.stream)))
+    except Exception:
+        close_uploads(uploads)
+        raise
+    
+    def rows():
+        try:
+            yield from stream_batch(uploads, fmt)
+        finally:
+            close_uploads(uploads)
+    
+    response = Response(rows(), mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    # Also closes them if the body is never streamed (client gone)
+    response.call_on_close(lambda: close_uploads(uploads))
+    return response
+
 @main.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy'}) 
\ No newline at end of file
+    return jsonify({'status': 'healthy'})
+
+@main.route('/api/ready', methods=['GET'])
+def readiness_check():
+    # Separate from /api/health: only ready once the warmed-up model can serve requests
+    ready, body = readiness()
+    return jsonify(body), 200 if ready else 503
+
+@main.route('/api/models', methods=['GET'])
+def model_versions():
+    """Served, shadow and draining model versions, and the registry pointers"""
+    if not model_ready.is_set():
+        return not_ready()
+    return jsonify(models.describe())
+
+@main.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    if not model_ready.is_set():
+        return not_ready()
+    cache = models.active.detector.cache
+    if cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **cache.stats()})
+
+@main.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    body, content_type = render()
+    return Response(body, content_type=content_type)
+
+@main.route('/api/batch_stats', methods=['GET'])
+def batch_stats():
+    if not model_ready.is_set():
+        return not_ready()
+    return jsonify(models.active.batcher.stats())
+
+def job_accepted(job_id):
+    response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f"/api/jobs/{job_id}"})
+    response.headers['Location'] = f"/api/jobs/{job_id}"
+    return response, 202
+
+@main.route('/api/jobs/video', methods=['POST'])
+def create_video_job():
+    """Queue a video for scoring; poll GET /api/jobs/<job_id> for progress and the result"""
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file provided'}), 400
+    suffix = os.path.splitext(file.filename)[1].lower()
+    if not (file.content_type or '').startswith('video/') and suffix not in VIDEO_EXTENSIONS:
+        return jsonify({'error': 'File must be a video'}), 400
+    
+    params, error = video_params()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    job_id, input_dir = jobs.create()
+    filename = 'video' + (suffix or '.mp4')
+    try:
+        file.save(os.path.join(input_dir, filename))
+    except Exception:
+        jobs.discard(job_id)
+        raise
+    jobs.submit(job_id, 'video', {'filename': filename, 'params': params})
+    return job_accepted(job_id)
+
+@main.route('/api/jobs/batch', methods=['POST'])
+def create_batch_job():
+    """Queue images and/or zip archives of images; results are fetched from /api/jobs/<job_id>/results"""
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in ('jsonl', 'csv'):
+        return jsonify({'error': 'format must be jsonl or csv'}), 400
+    
+    job_id, input_dir = jobs.create()
+    stored_files = []
+    try:
+        for index, file in enumerate(files):
+            name = file.filename or f"file_{index}"
+            stored = f"{index:05d}_{os.path.basename(name)}"
+            file.save(os.path.join(input_dir, stored))
+            stored_files.append([stored, name])
+    except Exception:
+        jobs.discard(job_id)
+        raise
+    jobs.submit(job_id, 'batch', {'files': stored_files, 'format': fmt})
+    return job_accepted(job_id)
+
+@main.route('/api/jobs', methods=['GET'])
+def job_stats():
+    return jsonify(jobs.stats())
+
+@main.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job['kind'] == 'batch' and job['status'] == 'done':
+        job['results_url'] = f"/api/jobs/{job_id}/results"
+    return jsonify(job)
+
+@main.route('/api/jobs/<job_id>/results', methods=['GET'])
+def get_job_results(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    path = jobs.results_file(job_id) if job['status'] == 'done' else None
+    if path is None:
+        return jsonify({'error': f"Job has no results file (status: {job['status']})"}), 409
+    return send_file(path, mimetype='text/csv' if path.endswith('.csv') else 'application/x-ndjson')
@@ -1,14 +1,32 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import logging
 import os
+import shutil
 import sys
-from typing import Optional
+import threading
+import time
+from typing import List, Optional
 import uvicorn
 
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from deepfake_detector import DeepfakeDetector
+from bounded_executor import BoundedExecutor, ExecutorSaturated
+from extract_frames import VIDEO_EXTENSIONS, VideoOpenError
+from metrics import StageTimer, observe_request, observe_prediction, register_stats, render
+from live_stream import LatestFrame, ScoreSmoother, StreamStats, TokenBucket
+from uploads import UnsupportedUpload, UploadLimitMiddleware, UploadTooLarge, read_image_upload, sniff_image
+from serving import (BATCH_MAX_SIZE, MAX_IMAGE_UPLOAD_BYTES, MAX_UPLOAD_BYTES, close_uploads, jobs, load_model,
+                     model_ready, models, readiness, score_upload, score_video, spool_upload, stream_batch)
+
+# LOG_LEVEL=DEBUG logs every request and raw score; the default keeps the hot path quiet
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="DeepFake Detection API",
@@ -16,7 +34,13 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Request bodies are capped before they are parsed (MAX_IMAGE_UPLOAD_MB for /api/predict,
+# MAX_UPLOAD_MB for everything else); non-images sent to /api/predict are rejected from their first bytes.
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES,
+                   limits={'/api/predict': MAX_IMAGE_UPLOAD_BYTES}, image_paths=['/api/predict'])
+
 # Configure CORS - use "*" to allow all origins during troubleshooting
+# (added last so it wraps the upload limit and 413s carry CORS headers too)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all origins while debugging
@@ -26,16 +50,41 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
-# Set up model path
-MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
-MODEL_PATH = os.path.join(MODEL_DIR, 'deepfake_model.h5')
+# Model configuration, loading and scoring live in serving.py, shared with the Flask backend.
+# The model is loaded and warmed up in the background after the server starts listening,
+# so /api/health answers immediately and /api/ready flips once inference is possible
+
+@app.on_event("startup")
+async def start_model_loading():
+    threading.Thread(target=load_model, name='model-loader', daemon=True).start()
+
+def require_ready():
+    if not model_ready.is_set():
+        raise HTTPException(status_code=503, detail="Model is still loading", headers={"Retry-After": "5"})
 
-# Initialize the detector
-detector = DeepfakeDetector(model_path=MODEL_PATH)
+# Decode, preprocess and inference run on a bounded pool so the event loop never blocks.
+# Requests beyond INFERENCE_CONCURRENCY + INFERENCE_QUEUE_SIZE are rejected with 503.
+INFERENCE_CONCURRENCY = int(os.environ.get('INFERENCE_CONCURRENCY', str(BATCH_MAX_SIZE)))
+INFERENCE_QUEUE_SIZE = int(os.environ.get('INFERENCE_QUEUE_SIZE', str(4 * INFERENCE_CONCURRENCY)))
+executor = BoundedExecutor(max_workers=INFERENCE_CONCURRENCY, max_pending=INFERENCE_QUEUE_SIZE)
 
-# Create temp directory if it doesn't exist
-TEMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp')
-os.makedirs(TEMP_DIR, exist_ok=True)
+register_stats('deepfake_executor', executor.stats)
+
+def run_inference(content, timer, submitted):
+    """serving.score_upload, executed on the inference pool"""
+    timer.record('queue', time.perf_counter() - submitted)
+    return score_upload(content, timer)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template, not raw path, to keep the label set bounded. Streaming
+    # responses are counted when their headers are sent.
+    route = request.scope.get('route')
+    endpoint = getattr(route, 'path', 'unmatched')
+    observe_request(endpoint, request.method, response.status_code, time.perf_counter() - started)
+    return response
 
 @app.get("/")
 async def root():
@@ -45,6 +94,36 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/api/ready")
+async def readiness_check():
+    # Separate from /api/health: only ready once the warmed-up model can serve requests
+    ready, body = readiness()
+    return body if ready else JSONResponse(status_code=503, content=body)
+
+@app.get("/api/models")
+async def model_versions():
+    """Served, shadow and draining model versions, and the registry pointers"""
+    require_ready()
+    return models.describe()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/api/batch_stats")
+async def batch_stats():
+    require_ready()
+    return {**models.active.batcher.stats(), 'executor': executor.stats()}
+
+@app.get("/api/cache_stats")
+async def cache_stats():
+    require_ready()
+    cache = models.active.detector.cache
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
 # Add OPTIONS method for CORS preflight requests
 @app.options("/api/predict")
 async def options_predict():
@@ -52,47 +131,339 @@ async def options_predict():
 
 @app.post("/api/predict")
 async def predict(file: UploadFile = File(...)):
-    # Print debug information
-    print(f"Received file: {file.filename}, Content-Type: {file.content_type}")
+    logger.debug("Received file: %s, Content-Type: %s", file.filename, file.content_type)
     
     # Check file type
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
+    require_ready()
     
+    timer = StageTimer('/api/predict')
     try:
-        # Save the uploaded file temporarily
-        file_path = os.path.join(TEMP_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Decode straight from the request body; nothing is written to disk
+        started = time.perf_counter()
+        # The middleware already turned away non-images from their first bytes; this checks
+        # the parsed upload (e.g. a body the middleware could not sniff) and its size
+        with timer.stage('read'):
+            try:
+                content = await run_in_threadpool(read_image_upload, file.file, MAX_IMAGE_UPLOAD_BYTES)
+            except UnsupportedUpload as e:
+                raise HTTPException(status_code=415, detail=str(e))
+            except UploadTooLarge as e:
+                raise HTTPException(status_code=413, detail=str(e))
         
-        print(f"File saved at: {file_path}")
+        # Get prediction (batched together with other in-flight requests)
+        try:
+            result, cached = await executor.run(run_inference, content, timer, time.perf_counter())
+        except ExecutorSaturated:
+            raise HTTPException(status_code=503, detail="Server is busy, please retry",
+                                headers={"Retry-After": "1"})
+        except ConnectionError:
+            # MODEL_RUNTIME=remote and the inference server is down, restarting or saturated
+            raise HTTPException(status_code=503, detail="Inference server unavailable",
+                                headers={"Retry-After": "5"})
+        if result is None:
+            raise HTTPException(status_code=400, detail="Could not decode image")
+        observe_prediction('/api/predict', result, cached)
+        logger.debug("Prediction result: %s", result)
         
-        # Get prediction
-        result = detector.predict(file_path)
-        print(f"Prediction result: {result}")
+        with timer.stage('serialize'):
+            response = JSONResponse(content={
+                "is_fake": result['is_fake'],
+                "confidence": result['confidence'],
+                "raw_score": result['raw_score'],
+                "stage": result['stage']
+            })
+        timer.timings['total'] = time.perf_counter() - started
+        response.headers["Server-Timing"] = timer.server_timing()
+        return response
         
-        # Clean up the temporary file
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error processing request: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.options("/api/predict_video")
+async def options_predict_video():
+    return {}
+
+@app.post("/api/predict_video")
+async def predict_video(
+    file: UploadFile = File(...),
+    sampling: str = Query("uniform", regex="^(uniform|scene)$"),
+    max_frames: int = Query(64, ge=1, le=1024),
+    frame_rate: Optional[int] = Query(None, ge=1),
+    early_exit_confidence: Optional[float] = Query(None, gt=0.5, le=1.0),
+):
+    logger.debug("Received video: %s, Content-Type: %s", file.filename, file.content_type)
+    
+    suffix = os.path.splitext(file.filename or '')[1].lower()
+    if not (file.content_type or '').startswith('video/') and suffix not in VIDEO_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="File must be a video")
+    require_ready()
+    
+    options = {
+        'sampling': sampling,
+        'max_frames': max_frames,
+        'frame_rate': frame_rate,
+        'early_exit_confidence': early_exit_confidence,
+    }
+    timer = StageTimer('/api/predict_video')
+    started = time.perf_counter()
+    try:
         try:
-            os.remove(file_path)
-        except Exception as e:
-            print(f"Warning: Could not remove temporary file: {str(e)}")
-        
+            result = await executor.run(score_video, file.file, suffix or '.mp4', options, timer)
+        except ExecutorSaturated:
+            raise HTTPException(status_code=503, detail="Server is busy, please retry",
+                                headers={"Retry-After": "1"})
+        except VideoOpenError:
+            raise HTTPException(status_code=400, detail="Could not open video")
+        except ConnectionError:
+            # MODEL_RUNTIME=remote and the inference server is down, restarting or saturated
+            raise HTTPException(status_code=503, detail="Inference server unavailable",
+                                headers={"Retry-After": "5"})
         if result is None:
-            raise HTTPException(status_code=500, detail="Error processing image")
+            raise HTTPException(status_code=400, detail="No frames could be decoded from the video")
         
-        return {
-            "is_fake": result['is_fake'],
-            "confidence": result['confidence'],
-            "raw_score": result['raw_score']
-        }
+        observe_prediction('/api/predict_video', result)
         
+        with timer.stage('serialize'):
+            response = JSONResponse(content=result)
+        timer.timings['total'] = time.perf_counter() - started
+        response.headers["Server-Timing"] = timer.server_timing()
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error processing request: {str(e)}")
-        # Clean up in case of error
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
+        logger.exception("Error processing video: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+def stream_batch_results(spooled_files, fmt, slot):
+    """Response body generator; starlette iterates it on a worker thread, off the event loop"""
+    try:
+        yield from stream_batch(spooled_files, fmt)
+    finally:
+        close_spooled(spooled_files, slot)
+
+def close_spooled(spooled_files, slot):
+    close_uploads(spooled_files)
+    slot.release()
+
+@app.options("/api/predict_batch")
+async def options_predict_batch():
+    return {}
+
+@app.post("/api/predict_batch")
+async def predict_batch(
+    files: List[UploadFile] = File(...),
+    format: str = Query("jsonl", regex="^(jsonl|csv)$"),
+):
+    require_ready()
+    # The streamed batch counts against the inference pool's limits like any other request
+    try:
+        slot = executor.reserve()
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry", headers={"Retry-After": "1"})
+    
+    spooled_files = []
+    try:
+        for upload in files:
+            spooled = await run_in_threadpool(spool_upload, upload.file)
+            spooled_files.append((upload.filename or f"file_{len(spooled_files)}", spooled))
+    except Exception:
+        close_spooled(spooled_files, slot)
+        raise
+    
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    # The background task frees the slot even if the body is never streamed (client gone)
+    return StreamingResponse(stream_batch_results(spooled_files, format, slot), media_type=media_type,
+                             background=BackgroundTask(close_spooled, spooled_files, slot))
+
+# Live camera streams over a WebSocket. Each stream is limited to STREAM_MAX_FPS frames per
+# second, keeps at most one frame waiting (newer frames replace it) and skips frames that
+# waited longer than STREAM_MAX_LAG_MS, so latency stays bounded under load
+STREAM_MAX_CONNECTIONS = int(os.environ.get('STREAM_MAX_CONNECTIONS', '64'))
+STREAM_MAX_FPS = float(os.environ.get('STREAM_MAX_FPS', '10'))
+STREAM_MAX_LAG_MS = float(os.environ.get('STREAM_MAX_LAG_MS', '500'))
+STREAM_HALF_LIFE_SECONDS = float(os.environ.get('STREAM_HALF_LIFE_SECONDS', '1.0'))
+stream_stats = StreamStats(STREAM_MAX_CONNECTIONS)
+register_stats('deepfake_streams', stream_stats.stats)
+
+@app.websocket("/api/stream")
+async def live_stream(websocket: WebSocket, fps: Optional[float] = None, half_life: Optional[float] = None):
+    """
+    Score a live camera stream. The client sends each frame as a binary message holding
+    an encoded image (JPEG, PNG, WebP or BMP). Every scored frame is answered with a JSON
+    message: its raw score, the time-smoothed score (which is_fake and confidence use),
+    the stage that decided it and how many frames this stream has had dropped so far.
+    fps lowers the stream's rate limit; half_life sets the smoothing in seconds.
+    """
+    await websocket.accept()
+    if not model_ready.is_set():
+        await websocket.close(code=1013, reason="Model is still loading")
+        return
+    if not stream_stats.open():
+        await websocket.close(code=1013, reason="Too many streams")
+        return
+
+    rate = min(fps, STREAM_MAX_FPS) if fps and fps > 0 else STREAM_MAX_FPS
+    bucket = TokenBucket(rate)
+    smoother = ScoreSmoother(STREAM_HALF_LIFE_SECONDS if half_life is None else half_life)
+    latest = LatestFrame()
+    counts = {'received': 0, 'dropped': 0}
+    max_lag = STREAM_MAX_LAG_MS / 1000.0
+
+    def drop(reason):
+        counts['dropped'] += 1
+        stream_stats.dropped(reason)
+
+    async def read_frames():
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            data = message.get('bytes')
+            now = time.monotonic()
+            counts['received'] += 1
+            stream_stats.received()
+            if data is None or len(data) > MAX_IMAGE_UPLOAD_BYTES or sniff_image(data) is None:
+                drop('invalid')
+                await websocket.send_json({"frame": counts['received'],
+                                           "error": "Frames must be binary messages holding one encoded image"})
+                continue
+            if not bucket.take(now):
+                drop('rate')
+                continue
+            if latest.put((counts['received'], data, now)):
+                drop('replaced')
+
+    async def score_frames():
+        while True:
+            frame, data, arrived = await latest.take()
+            if time.monotonic() - arrived > max_lag:
+                drop('stale')
+                continue
+            timer = StageTimer('/api/stream')
+            try:
+                result, cached = await executor.run(run_inference, data, timer, time.perf_counter())
+            except ExecutorSaturated:
+                drop('busy')
+                continue
+            except ConnectionError:
+                drop('busy')
+                await websocket.send_json({"frame": frame, "error": "Inference server unavailable"})
+                continue
+            if result is None:
+                drop('invalid')
+                await websocket.send_json({"frame": frame, "error": "Could not decode image"})
+                continue
+            stream_stats.scored()
+            observe_prediction('/api/stream', result, cached)
+            smoothed = models.active.detector.format_result(smoother.update(result['raw_score']))
+            await websocket.send_json({
+                "frame": frame,
+                "is_fake": smoothed['is_fake'],
+                "confidence": smoothed['confidence'],
+                "score": smoothed['raw_score'],
+                "raw_score": result['raw_score'],
+                "stage": result['stage'],
+                "latency_ms": (time.monotonic() - arrived) * 1000,
+                "dropped": counts['dropped'],
+            })
+
+    tasks = [asyncio.create_task(read_frames()), asyncio.create_task(score_frames())]
+    try:
+        # Either side ending (client gone, send failed) ends the stream
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None and not isinstance(task.exception(), WebSocketDisconnect):
+                logger.warning("Live stream failed: %s", task.exception())
+    finally:
+        for task in tasks:
+            task.cancel()
+        stream_stats.close()
+
+def save_upload(upload, path):
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(upload, f, 1024 * 1024)
+
+def job_accepted(job_id):
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued",
+                                                  "status_url": f"/api/jobs/{job_id}"},
+                        headers={"Location": f"/api/jobs/{job_id}"})
+
+@app.post("/api/jobs/video")
+async def create_video_job(
+    file: UploadFile = File(...),
+    sampling: str = Query("uniform", regex="^(uniform|scene)$"),
+    max_frames: int = Query(64, ge=1, le=1024),
+    frame_rate: Optional[int] = Query(None, ge=1),
+    early_exit_confidence: Optional[float] = Query(None, gt=0.5, le=1.0),
+):
+    """Queue a video for scoring; poll GET /api/jobs/{job_id} for progress and the result"""
+    suffix = os.path.splitext(file.filename or '')[1].lower()
+    if not (file.content_type or '').startswith('video/') and suffix not in VIDEO_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="File must be a video")
+    
+    job_id, input_dir = jobs.create()
+    filename = 'video' + (suffix or '.mp4')
+    try:
+        await run_in_threadpool(save_upload, file.file, os.path.join(input_dir, filename))
+    except Exception:
+        jobs.discard(job_id)
+        raise
+    jobs.submit(job_id, 'video', {'filename': filename, 'params': {
+        'sampling': sampling,
+        'max_frames': max_frames,
+        'frame_rate': frame_rate,
+        'early_exit_confidence': early_exit_confidence,
+    }})
+    return job_accepted(job_id)
+
+@app.post("/api/jobs/batch")
+async def create_batch_job(
+    files: List[UploadFile] = File(...),
+    format: str = Query("jsonl", regex="^(jsonl|csv)$"),
+):
+    """Queue images and/or zip archives of images; results are fetched from /api/jobs/{job_id}/results"""
+    job_id, input_dir = jobs.create()
+    stored_files = []
+    try:
+        for index, upload in enumerate(files):
+            name = upload.filename or f"file_{index}"
+            stored = f"{index:05d}_{os.path.basename(name)}"
+            await run_in_threadpool(save_upload, upload.file, os.path.join(input_dir, stored))
+            stored_files.append([stored, name])
+    except Exception:
+        jobs.discard(job_id)
+        raise
+    jobs.submit(job_id, 'batch', {'files': stored_files, 'format': format})
+    return job_accepted(job_id)
+
+@app.get("/api/jobs")
+async def job_stats():
+    return jobs.stats()
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if job['kind'] == 'batch' and job['status'] == 'done':
+        job['results_url'] = f"/api/jobs/{job_id}/results"
+    return job
+
+@app.get("/api/jobs/{job_id}/results")
+async def get_job_results(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    path = jobs.results_file(job_id) if job['status'] == 'done' else None
+    if path is None:
+        raise HTTPException(status_code=409, detail=f"Job has no results file (status: {job['status']})")
+    media_type = "text/csv" if path.endswith('.csv') else "application/x-ndjson"
+    return FileResponse(path, media_type=media_type)
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=5000, reload=True) 
\ No newline at end of file
@@ -0,0 +1,244 @@
+"""
+Model loading, configuration and scoring shared by the FastAPI (main.py) and Flask
+(app/routes.py) backends.
+
+Importing this module reads the serving environment variables and creates the model
+manager and the job queue. load_model() then loads and warms up the model and starts the
+job workers: FastAPI calls it on a background thread once the server is listening, Flask
+before it serves its first request. model_ready is set once inference is possible.
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from deepfake_detector import DeepfakeDetector, iter_result_lines, iter_zip_images
+from batching import BatchScheduler
+from job_queue import JobQueue, job_handlers
+from metrics import register_stats
+from model_registry import ModelManager, ModelRegistry, ServedModel
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Set up model path
+MODEL_DIR = os.path.join(BACKEND_DIR, 'models')
+# MODEL_PATH can point at any Keras model, e.g. a distilled student (deepfake_detector.py --distill);
+# frames are resized to the model's own input size
+MODEL_PATH = os.environ.get('MODEL_PATH', os.path.join(MODEL_DIR, 'deepfake_model.h5'))
+
+# MODEL_RUNTIME=tflite serves the (quantized) TFLite export instead of the Keras model,
+# MODEL_RUNTIME=remote sends frames to a shared-memory inference server
+MODEL_RUNTIME = os.environ.get('MODEL_RUNTIME', 'keras')
+if MODEL_RUNTIME == 'tflite':
+    MODEL_PATH = os.environ.get('TFLITE_MODEL_PATH', os.path.join(MODEL_DIR, 'deepfake_model_dynamic.tflite'))
+elif MODEL_RUNTIME == 'remote':
+    # The model lives in a separate inference_server.py process shared by all workers
+    MODEL_PATH = os.environ.get('INFERENCE_SOCKET', '/tmp/deepfake-inference.sock')
+TFLITE_NUM_THREADS = int(os.environ['TFLITE_NUM_THREADS']) if os.environ.get('TFLITE_NUM_THREADS') else None
+
+# MODEL_REGISTRY serves versioned models from a registry directory (see model_registry.py)
+# instead of MODEL_PATH: the version its CURRENT pointer names is loaded and warmed up in the
+# background and swapped in without a restart, and the version SHADOW names scores
+# SHADOW_SAMPLE_RATE of requests for comparison. The pointers are checked every MODEL_POLL_SECONDS.
+MODEL_REGISTRY = os.environ.get('MODEL_REGISTRY')
+MODEL_POLL_SECONDS = float(os.environ.get('MODEL_POLL_SECONDS', '10'))
+SHADOW_SAMPLE_RATE = float(os.environ.get('SHADOW_SAMPLE_RATE', '0.1'))
+if MODEL_REGISTRY and MODEL_RUNTIME == 'remote':
+    # The inference server owns the model; restart it to change versions
+    logger.warning("MODEL_REGISTRY is ignored with MODEL_RUNTIME=remote")
+    MODEL_REGISTRY = None
+
+# FACE_CROP=1 crops each image to the detected face before resizing (must match how the model was trained)
+FACE_CROP = os.environ.get('FACE_CROP', '0') == '1'
+
+# Optional content-addressed cache of preprocessed frames and scores
+FRAME_CACHE_DIR = os.environ.get('FRAME_CACHE_DIR')
+
+# Cascade: TRIAGE_MODEL (fitted with cascade.py) answers confident images before the CNN;
+# TRIAGE_LOW/TRIAGE_HIGH override its calibrated thresholds
+TRIAGE_MODEL = os.environ.get('TRIAGE_MODEL')
+TRIAGE_LOW = float(os.environ['TRIAGE_LOW']) if os.environ.get('TRIAGE_LOW') else None
+TRIAGE_HIGH = float(os.environ['TRIAGE_HIGH']) if os.environ.get('TRIAGE_HIGH') else None
+
+# Micro-batch concurrent requests into a single forward pass
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '16'))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', '5'))
+
+# Request bodies are capped before they are parsed: MAX_IMAGE_UPLOAD_MB for /api/predict,
+# MAX_UPLOAD_MB for everything else (videos, batches, jobs)
+MAX_IMAGE_UPLOAD_BYTES = int(float(os.environ.get('MAX_IMAGE_UPLOAD_MB', '20')) * 1024 * 1024)
+MAX_UPLOAD_BYTES = int(float(os.environ.get('MAX_UPLOAD_MB', '512')) * 1024 * 1024)
+
+# Long-running video and batch scoring runs as persistent jobs (SQLite + files in JOB_DIR).
+# Jobs can be submitted while the model loads; the workers start once it is ready.
+JOB_DIR = os.environ.get('JOB_DIR', os.path.join(BACKEND_DIR, 'jobs'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_TTL_HOURS = float(os.environ.get('JOB_TTL_HOURS', '24'))
+jobs = JobQueue(JOB_DIR, workers=JOB_WORKERS, ttl_seconds=JOB_TTL_HOURS * 3600)
+
+model_ready = threading.Event()
+model_status = {'state': 'loading', 'load_seconds': None, 'error': None}
+frame_caches = {}  # input size -> FrameCache shared by every version with that input size
+
+def load_version(version, model_path):
+    """Load, configure and warm up one model version, ready to be swapped in"""
+    if MODEL_RUNTIME != 'remote' and not os.path.exists(model_path):
+        logger.warning("No model found at %s; serving an untrained model", model_path)
+    # Registry versions may be Keras or TFLite files; the runtime follows the file extension
+    loaded = DeepfakeDetector(model_path=model_path, runtime=MODEL_RUNTIME if version == 'default' else None,
+                              num_threads=TFLITE_NUM_THREADS, pretrained=False, face_crop=FACE_CROP)
+    loaded.model_version = version
+    if FRAME_CACHE_DIR:
+        # Versions with the same input size share frames; scores are kept per version
+        shape = tuple(loaded.input_size)
+        if shape in frame_caches:
+            loaded.cache = frame_caches[shape]
+        else:
+            frame_caches[shape] = loaded.enable_cache(FRAME_CACHE_DIR,
+                                                      capacity=int(os.environ.get('FRAME_CACHE_CAPACITY', '20000')),
+                                                      memory_items=int(os.environ.get('FRAME_CACHE_MEMORY_ITEMS', '1024')))
+    if TRIAGE_MODEL:
+        try:
+            loaded.enable_triage(TRIAGE_MODEL, low=TRIAGE_LOW, high=TRIAGE_HIGH)
+        except ValueError as e:
+            # Triage is fitted at one input size; other versions are served without it
+            logger.warning("Model version %s is served without triage: %s", version, e)
+    if MODEL_RUNTIME == 'remote':
+        # The inference server warms up and batches across all workers itself
+        return ServedModel(version, loaded, loaded.model, path=model_path)
+    # Warm up both the single-image and the full micro-batch shapes
+    loaded.warmup(batch_sizes=sorted({1, BATCH_MAX_SIZE}))
+    batcher = BatchScheduler(loaded.score_batch, max_batch_size=BATCH_MAX_SIZE,
+                             max_wait_ms=BATCH_MAX_WAIT_MS).start()
+    return ServedModel(version, loaded, batcher, path=model_path, close=batcher.stop)
+
+# Requests and jobs use whichever version is active when they start (see model_registry.py)
+models = ModelManager(load_version, registry=ModelRegistry(MODEL_REGISTRY) if MODEL_REGISTRY else None,
+                      poll_seconds=MODEL_POLL_SECONDS, shadow_rate=SHADOW_SAMPLE_RATE)
+
+register_stats('deepfake_batcher', lambda: models.active.batcher.stats() if models.active is not None else None)
+register_stats('deepfake_jobs', jobs.stats)
+register_stats('deepfake_frame_cache',
+               lambda: models.active.detector.cache.stats()
+               if models.active is not None and models.active.detector.cache is not None else None)
+register_stats('deepfake_models', models.stats)
+
+def load_model():
+    """Load and warm up the served version, start the job workers, then follow the registry"""
+    started = time.perf_counter()
+    try:
+        version = models.registry.current() if models.registry is not None else None
+        if version:
+            models.load(version, models.registry.model_path(version))
+        else:
+            if models.registry is not None:
+                logger.warning("Model registry %s has no current version; serving %s until one is activated",
+                               MODEL_REGISTRY, MODEL_PATH)
+            models.load('default', MODEL_PATH)
+        # Job frames go through the same batcher as live requests
+        jobs.start(job_handlers(models, batch_size=BATCH_MAX_SIZE))
+    except Exception as e:
+        model_status.update(state='failed', error=str(e))
+        logger.exception("Error loading model: %s", e)
+        return
+    model_status.update(state='ready', load_seconds=time.perf_counter() - started)
+    model_ready.set()
+    logger.info("Model loaded and warmed up in %.2fs", model_status['load_seconds'])
+    # Load the shadow version (if any), then follow the registry pointers
+    models.sync()
+    models.start()
+
+def readiness():
+    """(ready, body) for /api/ready: not ready until the warmed-up model can serve requests"""
+    if not model_ready.is_set():
+        return False, {'status': model_status['state'], 'error': model_status['error']}
+    return True, {'status': 'ready', 'runtime': MODEL_RUNTIME, 'model_version': models.active.version,
+                  'load_seconds': model_status['load_seconds']}
+
+def score_upload(content, timer):
+    """
+    Blocking decode -> resize -> batched inference of encoded image bytes.
+    Returns (result or None if undecodable, whether the score came from the cache).
+    The result's stage says whether the cache, the triage stage or the model decided.
+    """
+    # The request finishes on the version it started on, even if a new one is swapped in
+    with models.use() as served:
+        detector = served.detector
+        # Identical uploads are answered straight from the cache
+        with timer.stage('cache'):
+            key = detector.cache_key(content)
+            score = detector.cached_score(key)
+            frame = detector.cached_frame(key) if score is None else None
+        if score is not None:
+            return detector.format_result(score, stage='cache'), True
+
+        if frame is None:
+            with timer.stage('decode'):
+                img = detector.decode_image(content)
+            if img is None:
+                return None, False
+            with timer.stage('resize'):
+                frame = detector.resize_frame(detector.crop_face(img))
+            detector.remember_frame(key, frame)
+
+        # Confident images are answered by the triage stage; the rest are
+        # batched together with other in-flight requests
+        processed_img = detector.normalize_frame(frame)
+        score = None
+        if detector.triage is not None:
+            with timer.stage('triage'):
+                score = detector.triage_score(processed_img)
+        stage = 'triage' if score is not None else 'model'
+        if score is None:
+            with timer.stage('inference'):
+                score = served.batcher.predict(processed_img)
+            # A sample of model-scored frames is also scored by the shadow version, in the background
+            models.compare_shadow(frame, score)
+        detector.remember_score(key, score)
+        return detector.format_result(score, stage=stage), False
+
+def score_video(upload, suffix, options, timer):
+    """Spool a video upload to a private temp file (OpenCV needs a path), then stream-score it"""
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+        with timer.stage('read'):
+            shutil.copyfileobj(upload, tmp, 1024 * 1024)
+            tmp.flush()
+        with timer.stage('inference'), models.use() as served:
+            return served.detector.predict_video(tmp.name, score_fn=served.batcher.predict_many,
+                                                 batch_size=BATCH_MAX_SIZE, **options)
+
+def spool_upload(upload):
+    """Copy an upload into a file owned by the response (the request's own may close before streaming ends)"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    shutil.copyfileobj(upload, spooled, 1024 * 1024)
+    spooled.seek(0)
+    return spooled
+
+def close_uploads(uploads):
+    for _, upload in uploads:
+        upload.close()
+
+def iter_batch_items(uploads):
+    """Turn uploads, (name, file object) pairs of images or zip archives of images, into (name, read_fn) items"""
+    for name, upload in uploads:
+        if name.lower().endswith('.zip'):
+            yield from iter_zip_images(upload)
+        else:
+            yield name, upload.read
+
+def stream_batch(uploads, fmt):
+    """
+    Result lines (JSON Lines or CSV) for a batch of uploads, in upload order, one per image
+    and each naming its file. The whole batch is scored by the version active when it starts.
+    """
+    with models.use() as served:
+        results = served.detector.predict_stream(iter_batch_items(uploads), batch_size=BATCH_MAX_SIZE,
+                                                 score_fn=served.batcher.predict_many)
+        yield from iter_result_lines(results, fmt)
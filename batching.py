@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class SchedulerStopped(RuntimeError):
+    """The scheduler was stopped before the image could be scored"""
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching in front of the model.
+
+    Requests are queued one image at a time; a single worker thread gathers
+    them until either max_batch_size images are waiting or max_wait_ms has
+    passed since the first one arrived, runs one forward pass, and hands
+    each caller its own score through a Future.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5):
+        # predict_fn takes an (N, H, W, 3) array and returns N scores
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = False
+
+        # Metrics
+        self._batches = 0
+        self._requests = 0
+        self._errors = 0
+        self._last_batch_size = 0
+        self._batch_sizes = {}
+        self._wait_total = 0.0
+        self._infer_total = 0.0
+
+    def start(self):
+        """Start the worker thread (idempotent)"""
+        with self._lock:
+            self._stopped = False
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker after the requests already queued have been served. Images
+        submitted afterwards fail with SchedulerStopped instead of waiting forever.
+        """
+        with self._lock:
+            self._stopped = True
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+            if thread.is_alive():
+                # Still finishing a batch; it serves the rest of the queue before exiting
+                return
+        # Never started: nothing will serve what is queued
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(SchedulerStopped("Batch scheduler stopped"))
+
+    def submit(self, image):
+        """Queue a single preprocessed image (H, W, 3) and return a Future for its score"""
+        future = Future()
+        # Checked under the lock so nothing is queued behind stop()'s sentinel
+        with self._lock:
+            if not self._stopped:
+                self._queue.put((image, future, time.monotonic()))
+                return future
+        future.set_exception(SchedulerStopped("Batch scheduler stopped"))
+        return future
+
+    def predict(self, image, timeout=None):
+        """Blocking helper for synchronous callers such as the Flask routes"""
+        return self.submit(image).result(timeout)
+
+    def predict_many(self, images, timeout=None):
+        """Queue several images at once (e.g. sampled video frames) and wait for all scores"""
+        futures = [self.submit(image) for image in images]
+        return [future.result(timeout) for future in futures]
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            # Collect more requests until the batch is full or the wait expires
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            stopping = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self._queue.get(timeout=remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._run_batch(batch)
+            if stopping:
+                break
+
+    def _run_batch(self, batch):
+        # Drop requests whose callers have already given up
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        started = time.monotonic()
+        try:
+            images = np.stack([entry[0] for entry in batch])
+            scores = np.asarray(self.predict_fn(images)).reshape(-1)
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finished = time.monotonic()
+
+        for (_, future, _), score in zip(batch, scores):
+            future.set_result(float(score))
+
+        with self._lock:
+            size = len(batch)
+            self._batches += 1
+            self._requests += size
+            self._last_batch_size = size
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._wait_total += sum(started - queued_at for _, _, queued_at in batch)
+            self._infer_total += finished - started
+
+    def stats(self):
+        """Queue depth and batch-size metrics for tuning max_batch_size / max_wait_ms"""
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches': self._batches,
+                'requests': self._requests,
+                'errors': self._errors,
+                'last_batch_size': self._last_batch_size,
+                'avg_batch_size': self._requests / self._batches if self._batches else 0.0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+                'avg_queue_wait_ms': 1000.0 * self._wait_total / self._requests if self._requests else 0.0,
+                'avg_inference_ms': 1000.0 * self._infer_total / self._batches if self._batches else 0.0,
+            }
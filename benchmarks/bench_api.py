@@ -0,0 +1,113 @@
+"""
+End-to-end latency of POST /api/predict under concurrent load.
+
+Starts the FastAPI backend with uvicorn (or targets --url), waits for /api/ready,
+then sends synthetic JPEG uploads from a pool of client threads at each
+concurrency level and reports p50/p95/p99 latency, throughput and status codes.
+Every request uses distinct image bytes so the frame cache cannot short-circuit it.
+
+Usage:
+    python benchmarks/bench_api.py --concurrency 1 8 32 --requests 200 --output bench_api.json
+"""
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from common import synthetic_frame, encode_jpeg, latency_stats, wait_for, start_server, stop_server, write_results
+
+def multipart_body(data, filename='frame.jpg', content_type='image/jpeg'):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: {content_type}\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+def post_image(url, data, timeout=60):
+    """Send one upload; returns (seconds, HTTP status)"""
+    body, content_type = multipart_body(data)
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method='POST')
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return time.perf_counter() - started, status
+
+def run_level(url, payloads, concurrency, requests):
+    def worker(i):
+        return post_image(url, payloads[i])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    stats = latency_stats([seconds for seconds, status in results if status == 200])
+    stats.update({
+        'concurrency': concurrency,
+        'requests': requests,
+        'seconds': elapsed,
+        'requests_per_sec': requests / elapsed,
+        'status_codes': statuses,
+    })
+    return stats
+
+def fetch_json(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.load(response)
+    except (urllib.error.URLError, OSError, ValueError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /api/predict latency under concurrent load')
+    parser.add_argument('--url', help='Base URL of a running server (default: start one locally)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200, help='Requests per concurrency level')
+    parser.add_argument('--warmup', type=int, default=20, help='Untimed requests before the first level')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds to wait for the server to become ready')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    payloads = [encode_jpeg(synthetic_frame(rng)) for _ in range(args.warmup + args.requests * len(args.concurrency))]
+
+    server = None
+    base = args.url
+    if base is None:
+        server, base = start_server()
+    try:
+        if not wait_for(f"{base}/api/ready", time.perf_counter() + args.timeout):
+            raise RuntimeError(f"{base} never became ready")
+        url = f"{base}/api/predict"
+        for i in range(args.warmup):
+            post_image(url, payloads[i])
+
+        results = {'url': url, 'levels': {}}
+        offset = args.warmup
+        for concurrency in args.concurrency:
+            level_payloads = payloads[offset:offset + args.requests]
+            offset += args.requests
+            results['levels'][str(concurrency)] = run_level(url, level_payloads, concurrency, args.requests)
+        results['batch_stats'] = fetch_json(f"{base}/api/batch_stats")
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    write_results('api', results, args.output)
+
+if __name__ == '__main__':
+    main()
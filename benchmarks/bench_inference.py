@@ -0,0 +1,65 @@
+"""
+CPU inference benchmark on synthetic images.
+
+  preprocess_image: read + decode + resize + normalize latency per image
+  predict:          end-to-end single-image latency (preprocess + forward pass)
+  score_batch:      forward-pass latency and images/sec at several batch sizes
+
+Usage:
+    python benchmarks/bench_inference.py --iterations 200 --output bench_inference.json
+    python benchmarks/bench_inference.py --model backend/models/deepfake_model_dynamic.tflite
+"""
+import argparse
+import tempfile
+
+import numpy as np
+
+from common import DEFAULT_MODEL, make_images, latency_stats, timed, write_results
+
+from deepfake_detector import DeepfakeDetector
+
+def bench_preprocess(detector, paths, iterations):
+    return latency_stats([timed(detector.preprocess_image, paths[i % len(paths)])[0] for i in range(iterations)])
+
+def bench_predict(detector, paths, iterations):
+    detector.predict(paths[0])
+    return latency_stats([timed(detector.predict, paths[i % len(paths)])[0] for i in range(iterations)])
+
+def bench_batches(detector, batch_sizes, iterations):
+    width, height = detector.input_size
+    results = {}
+    for batch_size in batch_sizes:
+        batch = np.random.default_rng(0).random((batch_size, height, width, 3), dtype='float32')
+        detector.score_batch(batch)  # warm-up / graph tracing for this shape
+        # Keep the total work per batch size roughly constant
+        runs = max(3, iterations // batch_size)
+        stats = latency_stats([timed(detector.score_batch, batch)[0] for _ in range(runs)])
+        stats['images_per_sec'] = batch_size * 1000.0 / stats['mean_ms']
+        results[str(batch_size)] = stats
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark preprocessing and CPU inference')
+    parser.add_argument('--model', default=DEFAULT_MODEL, help='Keras (.h5) or TFLite (.tflite) model')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 16, 32, 64])
+    parser.add_argument('--num-threads', type=int, default=None, help='TFLite interpreter threads')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    # Falls back to an untrained model when the file is missing; the timings are the same
+    detector = DeepfakeDetector(model_path=args.model, num_threads=args.num_threads, pretrained=False)
+    with tempfile.TemporaryDirectory(prefix='bench_inference_') as work_dir:
+        paths = make_images(work_dir, 64)
+        results = {
+            'model': args.model,
+            'runtime': detector.runtime,
+            'preprocess_image': bench_preprocess(detector, paths, args.iterations),
+            'predict': bench_predict(detector, paths, args.iterations),
+            'score_batch': bench_batches(detector, args.batch_sizes, args.iterations),
+        }
+
+    write_results('inference', results, args.output)
+
+if __name__ == '__main__':
+    main()
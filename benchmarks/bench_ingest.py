@@ -0,0 +1,82 @@
+"""
+Training-ingest benchmark on synthetic data generated in a temporary directory.
+
+  load_dataset:  in-memory loader, images/sec
+  build_dataset: streaming tf.data pipeline, images/sec for one pass (batched, normalized)
+  write_shards / load_shards: one-off shard build and streaming from the shards, images/sec
+  extract_frames: frames/sec written from a synthetic video, at several frame rates
+
+Usage:
+    python benchmarks/bench_ingest.py --images 512 --output bench_ingest.json
+"""
+import argparse
+import os
+import tempfile
+
+from common import make_images, make_video, timed, write_results
+
+from deepfake_detector import DeepfakeDetector
+from extract_frames import extract_frames
+
+def drain(ds):
+    """Iterate a dataset once and return the number of images it produced"""
+    return sum(int(x.shape[0]) for x, _ in ds)
+
+def bench_datasets(detector, real_dir, fake_dir, batch_size):
+    results = {}
+    elapsed, (X, _) = timed(detector.load_dataset, real_dir, fake_dir)
+    results['load_dataset'] = {'images': len(X), 'seconds': elapsed, 'images_per_sec': len(X) / elapsed}
+
+    paths, labels = detector.list_images(real_dir, fake_dir)
+    # The first pass includes tracing the pipeline; report the second
+    drain(detector.build_dataset(paths, labels, batch_size))
+    elapsed, count = timed(drain, detector.build_dataset(paths, labels, batch_size, shuffle=True))
+    results['build_dataset'] = {'images': count, 'seconds': elapsed, 'images_per_sec': count / elapsed}
+
+    shard_dir = os.path.join(os.path.dirname(real_dir), 'shards')
+    elapsed, _ = timed(detector.write_shards, paths, labels, shard_dir)
+    results['write_shards'] = {'images': len(paths), 'seconds': elapsed, 'images_per_sec': len(paths) / elapsed}
+    drain(detector.load_shards(shard_dir, batch_size))
+    elapsed, count = timed(drain, detector.load_shards(shard_dir, batch_size, shuffle=True))
+    results['load_shards'] = {'images': count, 'seconds': elapsed, 'images_per_sec': count / elapsed}
+    return results
+
+def bench_extract(work_dir, video_frames, frame_rates):
+    video_path = make_video(os.path.join(work_dir, 'synthetic.avi'), video_frames)
+    results = {}
+    for frame_rate in frame_rates:
+        out_dir = os.path.join(work_dir, f"frames_every_{frame_rate}")
+        elapsed, written = timed(extract_frames, video_path, out_dir, frame_rate, show_progress=False)
+        results[f"frame_rate_{frame_rate}"] = {
+            'frames_written': written,
+            'seconds': elapsed,
+            'frames_written_per_sec': written / elapsed,
+            'video_frames_per_sec': video_frames / elapsed,
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dataset loading and frame extraction')
+    parser.add_argument('--images', type=int, default=512, help='Synthetic images per class')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--video-frames', type=int, default=500, help='Length of the synthetic video')
+    parser.add_argument('--frame-rates', type=int, nargs='+', default=[1, 5])
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_ingest_') as work_dir:
+        real_dir = os.path.join(work_dir, 'real')
+        fake_dir = os.path.join(work_dir, 'fake')
+        make_images(real_dir, args.images, seed=0)
+        make_images(fake_dir, args.images, seed=1)
+
+        # Ingest does not depend on the weights, so skip loading or downloading any
+        detector = DeepfakeDetector(pretrained=False)
+        results = {'images_per_class': args.images, 'batch_size': args.batch_size}
+        results.update(bench_datasets(detector, real_dir, fake_dir, args.batch_size))
+        results['extract_frames'] = bench_extract(work_dir, args.video_frames, args.frame_rates)
+
+    write_results('ingest', results, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Cold-start benchmark for the API server.
+
+Each measurement runs in a fresh interpreter so nothing is already imported:
+  in-process: time to import deepfake_detector, construct the detector, warm it up
+              and serve the first prediction
+  server:     time from launching uvicorn until /api/health answers (live) and
+              until /api/ready answers (model loaded and warmed up)
+
+Usage:
+    python benchmarks/bench_startup.py --runs 3 --output bench_startup.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from common import ROOT, DEFAULT_MODEL, wait_for, start_server, stop_server, summarize, write_results
+
+IN_PROCESS_SNIPPET = '''
+import json, sys, time
+t0 = time.perf_counter()
+from deepfake_detector import DeepfakeDetector
+t1 = time.perf_counter()
+detector = DeepfakeDetector(model_path=sys.argv[1], pretrained=False)
+t2 = time.perf_counter()
+detector.warmup()
+t3 = time.perf_counter()
+import numpy as np
+width, height = detector.input_size
+detector.score_batch(np.zeros((1, height, width, 3), dtype='float32'))
+t4 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'construct': t2 - t1, 'warmup': t3 - t2, 'first_predict': t4 - t3}))
+'''
+
+def measure_in_process(model_path):
+    output = subprocess.run([sys.executable, '-c', IN_PROCESS_SNIPPET, model_path], cwd=ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    # The timings are the last line; TensorFlow may log above it
+    return json.loads(output.strip().splitlines()[-1])
+
+def measure_server(env=None, timeout=300):
+    started = time.perf_counter()
+    server, base = start_server(env)
+    try:
+        deadline = started + timeout
+        if not wait_for(f"{base}/api/health", deadline):
+            raise RuntimeError("server never became live")
+        live = time.perf_counter() - started
+        if not wait_for(f"{base}/api/ready", deadline):
+            raise RuntimeError("server never became ready")
+        ready = time.perf_counter() - started
+        return {'live': live, 'ready': ready}
+    finally:
+        stop_server(server)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure API cold-start time')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--model', default=DEFAULT_MODEL, help='Model used for the in-process measurement')
+    parser.add_argument('--skip-server', action='store_true', help='Only run the in-process measurement')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {'in_process': summarize([measure_in_process(args.model) for _ in range(args.runs)])}
+    if not args.skip_server:
+        results['server'] = summarize([measure_server() for _ in range(args.runs)])
+
+    write_results('startup', results, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Training epoch-time benchmark on synthetic images.
+
+Each configuration runs in a fresh interpreter (the mixed-precision policy and
+XLA caches are process-wide) and trains for a few epochs; the first epoch pays
+for tracing and compilation, so the median of the remaining epochs is reported.
+
+  baseline: float32, no XLA
+  mixed:    mixed precision (bfloat16 on CPU)
+  xla:      jit_compile
+  mixed_xla: both
+  embeddings: frozen phase trained on cached MobileNetV2 embeddings (the one-off
+              embedding pass is included in total_seconds, not in epoch_seconds)
+
+Usage:
+    python benchmarks/bench_train.py --images 512 --epochs 3 --output bench_train.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT, make_images, write_results
+
+CONFIGS = {
+    'baseline': {},
+    'mixed': {'mixed_precision': True},
+    'xla': {'jit_compile': True},
+    'mixed_xla': {'mixed_precision': True, 'jit_compile': True},
+    'embeddings': {'embeddings': True},
+}
+
+TRAIN_SNIPPET = '''
+import json, statistics, sys, tempfile, time
+from deepfake_detector import DeepfakeDetector, tf
+
+data_dir, epochs, batch_size, options = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), json.loads(sys.argv[4])
+times = []
+if options.pop('embeddings', False):
+    options['embedding_dir'] = tempfile.mkdtemp(prefix='bench_embeddings_')
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    def on_epoch_begin(self, epoch, logs=None):
+        self.started = time.perf_counter()
+    def on_epoch_end(self, epoch, logs=None):
+        times.append(time.perf_counter() - self.started)
+
+detector = DeepfakeDetector(pretrained=False)
+started = time.perf_counter()
+detector.train(data_dir + '/real', data_dir + '/fake', epochs=epochs, fine_tune_epochs=0, batch_size=batch_size,
+               callbacks=[EpochTimer()], **options)
+steady = times[1:] or times
+print(json.dumps({'total_seconds': time.perf_counter() - started, 'first_epoch_seconds': times[0],
+                  'epoch_seconds': statistics.median(steady), 'epochs_timed': len(steady)}))
+'''
+
+def run_config(data_dir, epochs, batch_size, options):
+    completed = subprocess.run([sys.executable, '-c', TRAIN_SNIPPET, data_dir, str(epochs), str(batch_size),
+                                json.dumps(options)], cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed'}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark training epoch time per precision/compilation option')
+    parser.add_argument('--images', type=int, default=512, help='Synthetic images per class')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--configs', nargs='+', choices=sorted(CONFIGS), default=list(CONFIGS))
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_train_') as data_dir:
+        make_images(os.path.join(data_dir, 'real'), args.images, seed=0)
+        make_images(os.path.join(data_dir, 'fake'), args.images, seed=1)
+        results = {'images_per_class': args.images, 'batch_size': args.batch_size, 'configs': {}}
+        for name in args.configs:
+            print(f"Training with {name}...", file=sys.stderr)
+            results['configs'][name] = dict(run_config(data_dir, args.epochs, args.batch_size, CONFIGS[name]),
+                                            options=CONFIGS[name])
+
+    write_results('train', results, args.output)
+
+if __name__ == '__main__':
+    main()
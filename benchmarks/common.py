@@ -0,0 +1,141 @@
+"""
+Shared helpers for the benchmark scripts: synthetic data, timing statistics,
+result files and a throwaway API server.
+"""
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT, 'backend')
+DEFAULT_MODEL = os.path.join(BACKEND_DIR, 'models', 'deepfake_model.h5')
+
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+def synthetic_frame(rng, width=320, height=240):
+    """A face-sized blob on a noisy background, so JPEG sizes and decode cost resemble real frames"""
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    frame = cv2.GaussianBlur(frame, (7, 7), 0)
+    center = (int(rng.integers(width // 3, 2 * width // 3)), int(rng.integers(height // 3, 2 * height // 3)))
+    axes = (width // 6, height // 4)
+    color = tuple(int(c) for c in rng.integers(80, 220, 3))
+    cv2.ellipse(frame, center, axes, 0, 0, 360, color, -1)
+    return frame
+
+def make_images(directory, count, width=320, height=240, seed=0):
+    """Write count synthetic JPEGs to directory and return their paths"""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"img_{i:05d}.jpg")
+        cv2.imwrite(path, synthetic_frame(rng, width, height))
+        paths.append(path)
+    return paths
+
+def make_video(path, frames, width=320, height=240, fps=25, seed=0):
+    """Write a synthetic MJPG .avi of slowly moving frames (readable by every OpenCV build)"""
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Could not create video {path}")
+    base = synthetic_frame(rng, width, height)
+    for i in range(frames):
+        writer.write(np.roll(base, i % width, axis=1))
+    writer.release()
+    return path
+
+def encode_jpeg(frame, quality=95):
+    ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("JPEG encoding failed")
+    return buf.tobytes()
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+def latency_stats(seconds):
+    """Summary of a list of latencies, in milliseconds"""
+    ms = np.asarray(seconds, dtype='float64') * 1000.0
+    if ms.size == 0:
+        return {'count': 0}
+    return {
+        'count': int(ms.size),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+    }
+
+def summarize(runs):
+    """Median/min/max of each key over repeated runs"""
+    keys = runs[0].keys()
+    return {key: {'median': statistics.median(run[key] for run in runs),
+                  'min': min(run[key] for run in runs),
+                  'max': max(run[key] for run in runs)} for key in keys}
+
+def environment():
+    """What the numbers were measured on, stored with every result file"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def write_results(name, results, output=None):
+    """Print the results and optionally save them (with the environment) as JSON"""
+    report = {'benchmark': name, 'environment': environment(), 'results': results}
+    print(json.dumps(report, indent=2))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.05)
+    return False
+
+def start_server(env=None):
+    """Launch the FastAPI backend with uvicorn on a free port; returns (process, base_url)"""
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port)],
+                              cwd=BACKEND_DIR, env=dict(os.environ, **(env or {})),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return server, f"http://127.0.0.1:{port}"
+
+def stop_server(server):
+    server.terminate()
+    server.wait()
@@ -0,0 +1,79 @@
+"""
+Compare two benchmark reports and flag regressions.
+
+Works on the output of any single benchmark or of run_all.py. Latencies and
+durations (keys ending in _ms or _seconds, named seconds, or median/min/max
+under the startup timings) are better when lower; rates (keys ending in _per_sec) are
+better when higher. Exits with status 1 when any metric regressed by more
+than --threshold.
+
+Usage:
+    python benchmarks/compare.py results/baseline.json results/new.json --threshold 0.10
+"""
+import argparse
+import json
+import sys
+
+SKIP_KEYS = ('environment', 'batch_stats')
+
+def flatten(value, prefix=''):
+    """{'a': {'b': 1.0}} -> {'a.b': 1.0}, numeric leaves only"""
+    if isinstance(value, dict):
+        items = {}
+        for key, child in value.items():
+            if key in SKIP_KEYS:
+                continue
+            items.update(flatten(child, f"{prefix}.{key}" if prefix else str(key)))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: float(value)}
+    return {}
+
+def direction(metric):
+    """+1 if higher is better, -1 if lower is better, 0 if the metric is not a performance number"""
+    leaf = metric.rsplit('.', 1)[-1]
+    if leaf.endswith('_per_sec'):
+        return 1
+    if leaf.endswith('_ms') or leaf == 'seconds' or leaf.endswith('_seconds'):
+        return -1
+    if '.in_process.' in f".{metric}" or '.server.' in f".{metric}":
+        # Startup timings: {'import': {'median': ..., 'min': ..., 'max': ...}}
+        return -1 if leaf in ('median', 'min', 'max') else 0
+    return 0
+
+def compare(baseline, current, threshold):
+    base = flatten(baseline)
+    new = flatten(current)
+    rows = []
+    for metric in sorted(base.keys() & new.keys()):
+        sign = direction(metric)
+        if sign == 0 or base[metric] == 0:
+            continue
+        change = (new[metric] - base[metric]) / abs(base[metric])
+        regressed = sign * change < -threshold
+        rows.append((metric, base[metric], new[metric], change, regressed))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark JSON reports')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative change counted as a regression')
+    parser.add_argument('--all', action='store_true', help='Show every metric, not only regressions')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows = compare(baseline, current, args.threshold)
+    regressions = [row for row in rows if row[4]]
+    for metric, old, new, change, regressed in (rows if args.all else regressions):
+        flag = 'REGRESSION' if regressed else ''
+        print(f"{metric:70s} {old:12.3f} -> {new:12.3f} {change:+8.1%} {flag}")
+    print(f"{len(rows)} metrics compared, {len(regressions)} regressed by more than {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Run every benchmark and merge the results into one JSON report.
+
+Each benchmark runs in its own interpreter so TensorFlow state and caches from
+one do not skew another.
+
+Usage:
+    python benchmarks/run_all.py --output results/baseline.json
+    python benchmarks/run_all.py --quick --skip api startup
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import environment
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (script, arguments for a full run, arguments for --quick)
+BENCHMARKS = {
+    'ingest': ('bench_ingest.py', [], ['--images', '64', '--video-frames', '100']),
+    'inference': ('bench_inference.py', [], ['--iterations', '30', '--batch-sizes', '1', '16']),
+    'api': ('bench_api.py', [], ['--requests', '40', '--concurrency', '1', '8']),
+    'startup': ('bench_startup.py', [], ['--runs', '1']),
+    'train': ('bench_train.py', [], ['--images', '64', '--epochs', '2', '--configs', 'baseline', 'mixed']),
+}
+
+def run_benchmark(name, quick=False):
+    script, full_args, quick_args = BENCHMARKS[name]
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, f"{name}.json")
+        command = [sys.executable, os.path.join(BENCH_DIR, script), '--output', output]
+        command += quick_args if quick else full_args
+        print(f"Running {name}: {' '.join(command[1:])}", file=sys.stderr)
+        completed = subprocess.run(command, stdout=subprocess.DEVNULL)
+        if completed.returncode != 0 or not os.path.exists(output):
+            return {'error': f"exited with status {completed.returncode}"}
+        with open(output) as f:
+            return json.load(f)['results']
+
+def main():
+    parser = argparse.ArgumentParser(description='Run all benchmarks and write one JSON report')
+    parser.add_argument('--output', help='Write the merged report to this file')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='Run only these benchmarks')
+    parser.add_argument('--skip', nargs='+', choices=sorted(BENCHMARKS), default=[], help='Benchmarks to leave out')
+    parser.add_argument('--quick', action='store_true', help='Smaller workloads, for a fast sanity check')
+    args = parser.parse_args()
+
+    names = [name for name in (args.only or BENCHMARKS) if name not in args.skip]
+    report = {'environment': environment(), 'quick': args.quick,
+              'benchmarks': {name: run_benchmark(name, args.quick) for name in names}}
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
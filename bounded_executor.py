@@ -0,0 +1,100 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExecutorSaturated(Exception):
+    """Raised when the executor already holds as much work as it is allowed to"""
+
+
+class Reservation:
+    """A slot taken with BoundedExecutor.reserve; release() may be called more than once"""
+
+    def __init__(self, executor):
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._released = False
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._executor._release(self)
+
+
+class BoundedExecutor:
+    """
+    Thread pool with a hard cap on in-flight work.
+
+    At most max_workers jobs run at once and at most max_pending more wait
+    for a thread; anything beyond that is rejected immediately with
+    ExecutorSaturated so the caller can shed load instead of queueing
+    without bound. TensorFlow and OpenCV release the GIL during the heavy
+    work, so threads are enough to keep the event loop free.
+    """
+
+    def __init__(self, max_workers=4, max_pending=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = self.max_workers * 4 if max_pending is None else max(0, int(max_pending))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='inference')
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs) or raise ExecutorSaturated if the pool is full"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise ExecutorSaturated()
+
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def reserve(self):
+        """
+        Take a slot for work that runs outside the pool (e.g. a streaming response
+        body) so it counts against the same limits. Raises ExecutorSaturated if the
+        pool is full; call release() on the result when the work is done.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise ExecutorSaturated()
+        with self._lock:
+            self._in_flight += 1
+        return Reservation(self)
+
+    async def run(self, fn, *args, **kwargs):
+        """Awaitable wrapper around submit for use inside async handlers"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            if future is not None:
+                self._completed += 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'in_flight': self._in_flight,
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,297 @@
+"""
+Two-stage cascade: a cheap triage model in front of the CNN.
+
+The triage stage is a logistic regression over a handful of hand-crafted
+frequency and compression-artifact features (radial FFT band energies,
+Laplacian and gradient energy, 8x8 blockiness, colour statistics), computed
+with vectorized NumPy on the already resized frame. Frames it scores at or below
+`low` are answered as real and at or above `high` as fake; everything in between
+goes on to the CNN.
+
+Fitting holds out a speaker-disjoint validation split and picks the widest
+thresholds whose decided frames still reach --target-accuracy on it. With
+--model the report also shows the accuracy of the whole cascade against the CNN
+alone and how much of the CNN work the triage stage saves.
+
+Usage:
+    python cascade.py dataset/processed/real dataset/processed/fake --output triage.json --model deepfake_model.h5
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from functools import lru_cache
+
+import numpy as np
+
+SPECTRUM_BANDS = 6
+BLOCK_SIZE = 8  # JPEG block size
+
+FEATURE_NAMES = ([f'spectrum_band_{i}' for i in range(SPECTRUM_BANDS)] +
+                 ['laplacian_var', 'gradient_mean', 'blockiness', 'saturation_mean',
+                  'channel_std_0', 'channel_std_1', 'channel_std_2'])
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=8)
+def _band_matrix(height, width, bands):
+    """One-hot (rfft2 bins, bands) matrix assigning each frequency bin to a radial band"""
+    fy = np.fft.fftfreq(height)[:, None]
+    fx = np.fft.rfftfreq(width)[None, :]
+    radius = np.sqrt(fy ** 2 + fx ** 2) / np.sqrt(0.5)  # 0 (DC) .. 1 (corner)
+    band = np.minimum((radius * bands).astype(int), bands - 1).ravel()
+    return np.eye(bands, dtype='float32')[band]
+
+def artifact_features(frames):
+    """(N, len(FEATURE_NAMES)) float32 features for a batch of float frames in [0, 1] (or a single frame)"""
+    frames = np.asarray(frames, dtype='float32')
+    if frames.ndim == 3:
+        frames = frames[None]
+    eps = 1e-8
+    gray = frames.mean(axis=3)
+    n, height, width = gray.shape
+
+    # Share of spectral energy per radial band: upsampling and GAN decoders leave
+    # too little (or periodic) energy in the highest bands
+    power = np.abs(np.fft.rfft2(gray - gray.mean(axis=(1, 2), keepdims=True))) ** 2
+    energy = power.reshape(n, -1).astype('float32') @ _band_matrix(height, width, SPECTRUM_BANDS)
+    spectrum = np.log(energy / (energy.sum(axis=1, keepdims=True) + eps) + eps)
+
+    laplacian = (gray[:, :-2, 1:-1] + gray[:, 2:, 1:-1] + gray[:, 1:-1, :-2] + gray[:, 1:-1, 2:]
+                 - 4 * gray[:, 1:-1, 1:-1])
+    dx = np.abs(np.diff(gray, axis=2))
+    dy = np.abs(np.diff(gray, axis=1))
+
+    # Edges on the JPEG block grid relative to edges elsewhere
+    col_edge = (np.arange(width - 1) % BLOCK_SIZE) == BLOCK_SIZE - 1
+    row_edge = (np.arange(height - 1) % BLOCK_SIZE) == BLOCK_SIZE - 1
+    blockiness = 0.5 * (np.log((dx[:, :, col_edge].mean(axis=(1, 2)) + eps) / (dx[:, :, ~col_edge].mean(axis=(1, 2)) + eps)) +
+                        np.log((dy[:, row_edge].mean(axis=(1, 2)) + eps) / (dy[:, ~row_edge].mean(axis=(1, 2)) + eps)))
+
+    return np.column_stack([
+        spectrum,
+        np.log(laplacian.var(axis=(1, 2)) + eps),
+        np.log(dx.mean(axis=(1, 2)) + dy.mean(axis=(1, 2)) + eps),
+        blockiness,
+        (frames.max(axis=3) - frames.min(axis=3)).mean(axis=(1, 2)),
+        frames.std(axis=(1, 2)),
+    ]).astype('float32')
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-np.clip(x, -30, 30)))
+
+def fit_logistic(features, labels, l2=1e-2, iterations=50):
+    """
+    Class-balanced L2 logistic regression fitted with Newton's method (IRLS).
+    Returns (weights, bias, mean, std), the features being standardized with mean/std.
+    """
+    features = np.asarray(features, dtype='float64')
+    labels = np.asarray(labels, dtype='float64')
+    mean = features.mean(axis=0)
+    std = features.std(axis=0) + 1e-6
+    x = np.column_stack([(features - mean) / std, np.ones(len(features))])
+    positives = max(labels.sum(), 1.0)
+    negatives = max(len(labels) - labels.sum(), 1.0)
+    sample_weight = np.where(labels > 0, len(labels) / (2 * positives), len(labels) / (2 * negatives))
+    penalty = np.full(x.shape[1], l2)
+    penalty[-1] = 0.0  # Leave the bias unregularized
+
+    w = np.zeros(x.shape[1])
+    for _ in range(iterations):
+        p = _sigmoid(x @ w)
+        grad = x.T @ (sample_weight * (p - labels)) + penalty * w
+        hessian = (x * (sample_weight * p * (1 - p))[:, None]).T @ x + np.diag(penalty + 1e-9)
+        step = np.linalg.solve(hessian, grad)
+        w -= step
+        if np.abs(step).max() < 1e-6:
+            break
+    return w[:-1], float(w[-1]), mean, std
+
+def calibrate_thresholds(scores, labels, target_accuracy=0.98):
+    """
+    (low, high): the widest thresholds whose decided frames (score <= low called real,
+    score >= high called fake) are each at least target_accuracy correct. A side that
+    cannot reach the target gets a threshold outside [0, 1], so it never decides.
+    """
+    scores = np.asarray(scores, dtype='float64')
+    labels = np.asarray(labels)
+
+    def widest(order_scores, correct, side):
+        # Only cut between distinct scores so ties are decided together
+        hits = np.cumsum(correct) / np.arange(1, len(correct) + 1)
+        last_of_tie = np.append(order_scores[1:] != order_scores[:-1], True)
+        ok = np.flatnonzero((hits >= target_accuracy) & last_of_tie & side)
+        return float(order_scores[ok[-1]]) if ok.size else None
+
+    order = np.argsort(-scores, kind='stable')
+    high = widest(scores[order], labels[order] == 1, scores[order] > 0.5)
+    order = np.argsort(scores, kind='stable')
+    low = widest(scores[order], labels[order] == 0, scores[order] < 0.5)
+    return (-1.0 if low is None else low), (2.0 if high is None else high)
+
+
+class TriageModel:
+    """Logistic regression over artifact_features that decides confident frames before the CNN"""
+
+    def __init__(self, weights, bias, mean, std, low=0.05, high=0.95, input_size=(128, 128), report=None):
+        self.weights = np.asarray(weights, dtype='float32')
+        self.bias = float(bias)
+        self.mean = np.asarray(mean, dtype='float32')
+        self.std = np.asarray(std, dtype='float32')
+        self.low = float(low)
+        self.high = float(high)
+        self.input_size = tuple(input_size)  # (width, height) the features were fitted at
+        self.report = report or {}
+
+    @classmethod
+    def load(cls, path, low=None, high=None):
+        """Load a triage model; low/high override the calibrated thresholds"""
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('features') != FEATURE_NAMES:
+            raise ValueError(f"{path} was fitted on different features; refit it with cascade.py")
+        model = cls(data['weights'], data['bias'], data['mean'], data['std'], data['low'], data['high'],
+                    input_size=data['input_size'], report=data.get('report'))
+        if low is not None:
+            model.low = float(low)
+        if high is not None:
+            model.high = float(high)
+        return model
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'features': FEATURE_NAMES,
+                'weights': self.weights.tolist(),
+                'bias': self.bias,
+                'mean': self.mean.tolist(),
+                'std': self.std.tolist(),
+                'low': self.low,
+                'high': self.high,
+                'input_size': list(self.input_size),
+                'report': self.report,
+            }, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def scores(self, frames):
+        """Triage fake probability for a batch of normalized frames (or a single frame)"""
+        x = (artifact_features(frames) - self.mean) / self.std
+        return _sigmoid(x @ self.weights + self.bias).astype('float32')
+
+    def decide(self, scores):
+        """Mask of the scores confident enough to skip the CNN"""
+        scores = np.asarray(scores)
+        return (scores <= self.low) | (scores >= self.high)
+
+
+def iter_frame_batches(detector, paths, batch_size=64):
+    """
+    Yield (normalized frames, indices into paths) batches, preprocessed exactly as at
+    serving time; unreadable files are dropped. Only one batch is held in memory.
+    """
+    frames = []
+    kept = []
+    for i, path in enumerate(paths):
+        frame = detector.load_frame_file(path)
+        if frame is None:
+            continue
+        frames.append(detector.normalize_frame(frame))
+        kept.append(i)
+        if len(frames) == batch_size:
+            yield np.stack(frames), kept
+            frames, kept = [], []
+    if frames:
+        yield np.stack(frames), kept
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit the cascade triage model and report its accuracy/cost trade-off')
+    parser.add_argument('real_dir')
+    parser.add_argument('fake_dir')
+    parser.add_argument('--output', default='triage.json', help='Where the triage model is written')
+    parser.add_argument('--target-accuracy', type=float, default=0.98,
+                        help='Accuracy the triage stage must reach on the frames it decides')
+    parser.add_argument('--model', help='CNN to evaluate the full cascade against (optional)')
+    parser.add_argument('--face-crop', action='store_true', help='Crop frames to the face, as the servers do with FACE_CROP=1')
+    parser.add_argument('--split-by', choices=['speaker', 'video', 'frame'], default='speaker',
+                        help='Keep each speaker (or video) entirely in the fit or the validation split')
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    from deepfake_detector import DeepfakeDetector
+    detector = DeepfakeDetector(model_path=args.model, pretrained=False, face_crop=args.face_crop)
+    paths, labels = detector.list_images(args.real_dir, args.fake_dir)
+    if not paths:
+        parser.error("No images found")
+    train_idx, val_idx, _ = detector.split_dataset(paths, labels, args.validation_split, split_by=args.split_by)
+    train_labels_all = np.asarray(labels)[train_idx]
+    val_labels_all = np.asarray(labels)[val_idx]
+
+    # Keep only the small feature rows and scores; frames are decoded one batch at a time
+    features = []
+    train_labels = []
+    for frames, kept in iter_frame_batches(detector, [paths[i] for i in train_idx], args.batch_size):
+        features.append(artifact_features(frames))
+        train_labels.append(train_labels_all[kept])
+    if not features:
+        parser.error("No readable training images")
+    features = np.concatenate(features)
+    train_labels = np.concatenate(train_labels)
+    weights, bias, mean, std = fit_logistic(features, train_labels)
+    triage = TriageModel(weights, bias, mean, std, input_size=detector.input_size)
+
+    val_scores = []
+    model_scores = []
+    val_labels = []
+    triage_seconds = model_seconds = 0.0
+    for frames, kept in iter_frame_batches(detector, [paths[i] for i in val_idx], args.batch_size):
+        started = time.perf_counter()
+        val_scores.append(triage.scores(frames))
+        triage_seconds += time.perf_counter() - started
+        if args.model:
+            started = time.perf_counter()
+            model_scores.append(detector.score_batch(frames))
+            model_seconds += time.perf_counter() - started
+        val_labels.append(val_labels_all[kept])
+    if not val_scores:
+        parser.error("No readable validation images")
+    val_scores = np.concatenate(val_scores)
+    val_labels = np.concatenate(val_labels)
+    triage_ms = triage_seconds * 1000 / len(val_scores)
+    triage.low, triage.high = calibrate_thresholds(val_scores, val_labels, args.target_accuracy)
+    decided = triage.decide(val_scores)
+
+    report = {
+        'train_frames': len(features),
+        'val_frames': len(val_scores),
+        'triage_accuracy': float(((val_scores > 0.5) == val_labels).mean()),
+        'decided_fraction': float(decided.mean()),
+        'decided_accuracy': float(((val_scores[decided] > 0.5) == val_labels[decided]).mean()) if decided.any() else None,
+        'triage_ms_per_frame': triage_ms,
+    }
+    if args.model:
+        model_scores = np.concatenate(model_scores)
+        model_ms = model_seconds * 1000 / len(val_scores)
+        cascade_scores = np.where(decided, val_scores, model_scores)
+        report.update({
+            'model_accuracy': float(((model_scores > 0.5) == val_labels).mean()),
+            'cascade_accuracy': float(((cascade_scores > 0.5) == val_labels).mean()),
+            'model_ms_per_frame': model_ms,
+            # Every frame pays for triage; only the undecided ones pay for the CNN
+            'cascade_ms_per_frame': triage_ms + (1 - decided.mean()) * model_ms,
+        })
+    triage.report = report
+    triage.save(args.output)
+
+    print(f"Thresholds: real <= {triage.low:.4f}, fake >= {triage.high:.4f}")
+    for key, value in report.items():
+        print(f"  {key}: {value:.4f}" if isinstance(value, float) else f"  {key}: {value}")
+    print(f"Triage model saved to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,191 @@
-import tensorflow as tf
-from tensorflow.keras import layers, models
 import numpy as np
 import cv2
-from PIL import Image
 import os
-from sklearn.model_selection import train_test_split
+import sys
 import glob
+import io
+import csv
+import json
+import hashlib
+import random
+import re
+import logging
+import argparse
+import threading
+import time
+import tarfile
+import zipfile
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from cascade import TriageModel
+from frame_cache import FrameCache
+from inference_server import InferenceClient
+from face_crop import FaceCropper, FaceTracker, load_boxes, detect_directory, FACES_FILE
+from extract_frames import iter_frames, video_info
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# JPEGs much larger than the model input are decoded at 1/8, 1/4 or 1/2 scale by libjpeg,
+# keeping the shorter side at least this many times the input size (more with face
+# cropping, since the face is only part of the frame)
+REDUCED_DECODE_MARGIN = 2
+REDUCED_DECODE_MARGIN_FACE = 4
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# TIMIT speaker ids (fadg0, mrjo0, ...) as they appear in DeepfakeTIMIT/VidTIMIT paths
+SPEAKER_ID = re.compile(r'(?<![a-z0-9])[fm][a-z]{3}[0-9](?![a-z0-9])')
+# Train/validation split groupings, coarsest first; see DeepfakeDetector.split_dataset
+SPLIT_GROUPINGS = ('speaker', 'video', 'frame')
+
+logger = logging.getLogger(__name__)
+
+class _LazyImport:
+    """Module stand-in that performs the real import on first attribute access"""
+    def __init__(self, loader):
+        self._loader = loader
+        self._module = None
+
+    def __getattr__(self, name):
+        if self._module is None:
+            self._module = self._loader()
+        return getattr(self._module, name)
+
+def _import_tensorflow():
+    import tensorflow
+    return tensorflow
+
+# TensorFlow takes seconds to import; defer it until a model is actually built or loaded
+# (serving through tflite_runtime never imports it at all)
+tf = _LazyImport(_import_tensorflow)
+layers = _LazyImport(lambda: tf.keras.layers)
+models = _LazyImport(lambda: tf.keras.models)
+
+class TFLiteModel:
+    """
+    Serves a .tflite model through the TFLite interpreter.
+
+    Exposes predict_on_batch like a Keras model, so the rest of the detector does
+    not care which runtime is behind it. Uses the standalone tflite_runtime
+    package when it is installed and falls back to tf.lite otherwise.
+    """
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+        # The interpreter is not thread-safe
+        self._lock = threading.Lock()
+
+    @property
+    def input_shape(self):
+        return tuple(int(d) for d in self._input['shape'][1:])
+
+    def _quantize(self, batch):
+        scale, zero_point = self._input['quantization']
+        if self._input['dtype'] == np.float32 or not scale:
+            return batch.astype(self._input['dtype'])
+        info = np.iinfo(self._input['dtype'])
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(self._input['dtype'])
+
+    def _dequantize(self, output):
+        scale, zero_point = self._output['quantization']
+        if self._output['dtype'] == np.float32 or not scale:
+            return output.astype('float32')
+        return (output.astype('float32') - zero_point) * scale
+
+    def predict_on_batch(self, batch):
+        batch = np.asarray(batch, dtype='float32')
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self._input['index'], self._quantize(batch))
+            self.interpreter.invoke()
+            return self._dequantize(self.interpreter.get_tensor(self._output['index']))
 
 class DeepfakeDetector:
-    def __init__(self, model_path=None):
-        if model_path and os.path.exists(model_path):
+    def __init__(self, model_path=None, runtime=None, num_threads=None, pretrained=True, face_crop=False):
+        # runtime: 'keras' or 'tflite'; inferred from the file extension when not given.
+        #          'remote' scores through a shared-memory inference server whose
+        #          socket is model_path (see inference_server.py)
+        # pretrained: start a new model from ImageNet weights (downloaded on first use);
+        #             servers pass False so a missing model file never triggers a download
+        # face_crop: crop frames to the detected face before resizing to the model input
+        if runtime is None:
+            runtime = 'tflite' if model_path and model_path.endswith('.tflite') else 'keras'
+        self.runtime = runtime
+        if runtime == 'remote':
+            self.model = InferenceClient(model_path)
+        elif runtime == 'tflite':
+            if not model_path or not os.path.exists(model_path):
+                raise FileNotFoundError(f"TFLite model not found at {model_path}")
+            self.model = TFLiteModel(model_path, num_threads=num_threads)
+        elif model_path and os.path.exists(model_path):
             self.model = tf.keras.models.load_model(model_path)
         else:
-            self.model = self._build_model()
-        self.input_size = (128, 128)  # Input size for the model
-        self.data_augmentation = tf.keras.Sequential([
-            layers.RandomFlip("horizontal"),
-            layers.RandomRotation(0.2),
-            layers.RandomZoom(0.2),
-            layers.RandomContrast(0.2),
-        ])
+            self.model = self._build_model(weights='imagenet' if pretrained else None)
+        # (width, height) frames are resized to, taken from the model so compact students
+        # (see distill) are served at their own resolution; remote models report theirs
+        shape = tuple(self.model.input_shape)
+        height, width = (shape[1:] if len(shape) == 4 else shape)[:2]
+        self.input_size = (int(width), int(height)) if height and width else (128, 128)
+        self.cache = None  # Optional FrameCache, see enable_cache
+        self.model_version = None  # Registry version being served; cached scores are kept per version
+        self.triage = None  # Optional cascade.TriageModel, see enable_triage
+        self.face_cropper = FaceCropper() if face_crop else None
+        self._face_boxes = {}  # frame directory -> boxes loaded from its faces.json
+        self._data_augmentation = None
+        self._strategy = None  # tf.distribute strategy used while training, see train()
+        self._jit_compile = False
+
+    @property
+    def data_augmentation(self):
+        """Training-only augmentation pipeline, built on first use so serving never pays for it"""
+        if self._data_augmentation is None:
+            # Always float32: it runs in the input pipeline, not under the mixed-precision policy
+            self._data_augmentation = tf.keras.Sequential([
+                layers.RandomFlip("horizontal", dtype='float32'),
+                layers.RandomRotation(0.2, dtype='float32'),
+                layers.RandomZoom(0.2, dtype='float32'),
+                layers.RandomContrast(0.2, dtype='float32'),
+            ])
+        return self._data_augmentation
+
+    def warmup(self, batch_sizes=(1,)):
+        """Run dummy batches through the model so the first real request does not pay for graph tracing and allocation"""
+        width, height = self.input_size
+        for batch_size in batch_sizes:
+            self.score_batch(np.zeros((batch_size, height, width, 3), dtype='float32'))
     
-    def _build_model(self):
+    def enable_cache(self, cache_dir, capacity=20000, memory_items=1024):
+        """Cache preprocessed frames (and serving scores) by content hash under cache_dir"""
+        width, height = self.input_size
+        self.cache = FrameCache(cache_dir, frame_shape=(height, width, 3), capacity=capacity,
+                                memory_items=memory_items, variant='face' if self.face_cropper else None)
+        return self.cache
+
+    def enable_triage(self, triage_path, low=None, high=None):
+        """Let a cheap artifact-feature model (see cascade.py) answer confident frames before the CNN"""
+        triage = TriageModel.load(triage_path, low=low, high=high)
+        if triage.input_size != tuple(self.input_size):
+            raise ValueError(f"Triage model was fitted on {triage.input_size} frames, the model takes {self.input_size}")
+        self.triage = triage
+        return triage
+
+    def _build_model(self, weights='imagenet'):
         base_model = tf.keras.applications.MobileNetV2(
             input_shape=(128, 128, 3),
             include_top=False,
-            weights='imagenet'
+            weights=weights
         )
         base_model.trainable = False  # Freeze base model
 
@@ -34,7 +194,8 @@ class DeepfakeDetector:
             layers.GlobalAveragePooling2D(),
             layers.Dense(128, activation='relu', kernel_regularizer=tf.keras.regularizers.l2(0.01)),
             layers.Dropout(0.5),
-            layers.Dense(1, activation='sigmoid')
+            # float32 output keeps the sigmoid and the loss numerically stable under mixed precision
+            layers.Dense(1, activation='sigmoid', dtype='float32')
         ])
 
         model.compile(optimizer='adam',
@@ -42,8 +203,88 @@ class DeepfakeDetector:
                       metrics=['accuracy'])
         return model
 
+    def _build_student_model(self, input_size=(96, 96), width=0.35, weights='imagenet'):
+        """Compact student for distill: a narrow MobileNetV2 at a lower resolution with a single sigmoid unit"""
+        base_model = tf.keras.applications.MobileNetV2(
+            input_shape=(input_size[1], input_size[0], 3),
+            alpha=width,
+            include_top=False,
+            weights=weights
+        )
+        return models.Sequential([
+            base_model,
+            layers.GlobalAveragePooling2D(),
+            layers.Dropout(0.2),
+            layers.Dense(1, activation='sigmoid', dtype='float32')
+        ])
+
+    def _compile(self, learning_rate=None):
+        """(Re)compile for training inside the active distribution strategy, with XLA if requested"""
+        with self._strategy.scope() if self._strategy is not None else nullcontext():
+            optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate) if learning_rate else 'adam'
+            self.model.compile(optimizer=optimizer,
+                               loss='binary_crossentropy',
+                               metrics=['accuracy'],
+                               jit_compile=self._jit_compile)
+
+    def _rebuild_model(self):
+        """
+        Rebuild the model under the current dtype policy and strategy, keeping its weights.
+        The architecture is cloned from the model itself (teacher, distilled student or
+        any loaded model); every layer takes the global policy except the output layer,
+        which stays float32 as the builders make it.
+        """
+        weights = self.model.get_weights()
+        output_layer = self.model.layers[-1]
+
+        def clone_layer(layer):
+            if isinstance(layer, tf.keras.Model):
+                clone = tf.keras.models.clone_model(layer, clone_function=clone_layer)
+                if not layer.trainable:
+                    # Freezing a model freezes every layer in it; a trainable one keeps its layers' own flags
+                    clone.trainable = False
+                return clone
+            config = layer.get_config()
+            if layer is not output_layer and not isinstance(layer, tf.keras.layers.InputLayer):
+                config['dtype'] = tf.keras.mixed_precision.global_policy().name
+            clone = layer.__class__.from_config(config)
+            clone.trainable = layer.trainable
+            return clone
+
+        with self._strategy.scope() if self._strategy is not None else nullcontext():
+            self.model = clone_layer(self.model)
+            self.model.set_weights(weights)
+
+    def _make_strategy(self, strategy):
+        """
+        None/'default': single device. 'mirrored': all local GPUs (or the CPU).
+        'multi_worker': synchronous data-parallel training across processes/machines
+        described by the TF_CONFIG environment variable, e.g. several CPU boxes.
+        """
+        if strategy in (None, 'default'):
+            return None
+        if strategy == 'mirrored':
+            return tf.distribute.MirroredStrategy()
+        if strategy == 'multi_worker':
+            return tf.distribute.MultiWorkerMirroredStrategy()
+        if isinstance(strategy, str):
+            raise ValueError(f"Unknown distribution strategy {strategy!r}")
+        return strategy
+
+    def _worker_shard(self):
+        """(number of workers, this worker's index) under a multi-worker strategy, else (1, 0)"""
+        resolver = getattr(self._strategy, 'cluster_resolver', None)
+        if resolver is None or not resolver.cluster_spec().as_dict():
+            return 1, 0
+        return resolver.cluster_spec().num_tasks('worker'), resolver.task_id or 0
+
     def load_dataset(self, real_dir, fake_dir):
-        """Load and preprocess the dataset, recursively including images in all subfolders."""
+        """
+        Load and preprocess the dataset, recursively including images in all subfolders.
+
+        This materializes the whole corpus as one float32 array, so it only suits
+        small datasets; train() streams from file lists via build_dataset instead.
+        """
         real_images = []
         fake_images = []
 
@@ -53,10 +294,8 @@ class DeepfakeDetector:
                 if file.lower().endswith(('.jpg', '.jpeg', '.png')):
                     img_path = os.path.join(root, file)
                     try:
-                        img = cv2.imread(img_path)
+                        img = self.load_frame_file(img_path)
                         if img is not None:
-                            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                            img = cv2.resize(img, self.input_size)
                             real_images.append(img)
                     except Exception as e:
                         print(f"Error loading image {img_path}: {str(e)}")
@@ -67,10 +306,8 @@ class DeepfakeDetector:
                 if file.lower().endswith(('.jpg', '.jpeg', '.png')):
                     img_path = os.path.join(root, file)
                     try:
-                        img = cv2.imread(img_path)
+                        img = self.load_frame_file(img_path)
                         if img is not None:
-                            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                            img = cv2.resize(img, self.input_size)
                             fake_images.append(img)
                     except Exception as e:
                         print(f"Error loading image {img_path}: {str(e)}")
@@ -92,16 +329,14 @@ class DeepfakeDetector:
 
         return X, y
     
-    def fine_tune(self, train_ds, val_ds, initial_epochs=10, fine_tune_epochs=5):
+    def fine_tune(self, train_ds, val_ds, initial_epochs=10, fine_tune_epochs=5, callbacks=None):
         # Unfreeze the last 20 layers of the base model for fine-tuning
         base_model = self.model.layers[0]
         base_model.trainable = True
         for layer in base_model.layers[:-20]:
             layer.trainable = False
         # Recompile with a lower learning rate
-        self.model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=1e-5),
-                           loss='binary_crossentropy',
-                           metrics=['accuracy'])
+        self._compile(learning_rate=1e-5)
         history_fine = self.model.fit(
             train_ds,
             epochs=initial_epochs + fine_tune_epochs,
@@ -113,41 +348,481 @@ class DeepfakeDetector:
                     patience=3,
                     restore_best_weights=True
                 )
-            ]
+            ] + (callbacks or [])
         )
         return history_fine
 
-    def train(self, real_dir, fake_dir, epochs=10, batch_size=32, validation_split=0.2, fine_tune_epochs=5):
-        print("Loading dataset...")
-        X, y = self.load_dataset(real_dir, fake_dir)
-        X_train, X_val, y_train, y_val = train_test_split(
-            X, y, test_size=validation_split, random_state=42
-        )
-        print(f"Training on {len(X_train)} images, validating on {len(X_val)} images")
+    def list_images(self, real_dir, fake_dir):
+        """Collect image paths and labels (0 = real, 1 = fake) recursively, without decoding anything"""
+        paths = []
+        labels = []
+        for label, directory in ((0, real_dir), (1, fake_dir)):
+            for root, dirs, files in os.walk(directory):
+                dirs.sort()
+                for file in sorted(files):
+                    if file.lower().endswith(IMAGE_EXTENSIONS):
+                        paths.append(os.path.join(root, file))
+                        labels.append(label)
+        return paths, labels
+
+    def _load_frame(self, path, label):
+        """Read, decode and resize one image inside the tf.data graph; stays uint8 until batching"""
+        img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        img = tf.image.resize(img, (self.input_size[1], self.input_size[0]))
+        img = tf.cast(tf.clip_by_value(tf.round(img), 0, 255), tf.uint8)
+        return img, label
+
+    def _load_face_frame(self, path, box, label):
+        """Like _load_frame, but crops to a normalized [y1, x1, y2, x2] face box while resizing"""
+        img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        img = tf.image.crop_and_resize(tf.expand_dims(tf.cast(img, tf.float32), 0), tf.expand_dims(box, 0), [0],
+                                       (self.input_size[1], self.input_size[0]))[0]
+        img = tf.cast(tf.clip_by_value(tf.round(img), 0, 255), tf.uint8)
+        return img, label
+
+    def _load_frame_cached(self, path, label):
+        """Like _load_frame, but goes through the frame cache so later epochs and runs skip decoding"""
+        def load(path):
+            img = self.load_frame_file(path.decode())
+            if img is None:
+                raise ValueError(f"Could not read image at {path.decode()}")
+            return img
+        img = tf.numpy_function(load, [path], tf.uint8)
+        img.set_shape((self.input_size[1], self.input_size[0], 3))
+        return img, label
+
+    def face_boxes(self, paths):
+        """
+        Stored face boxes for a list of frame files, in [y1, x1, y2, x2] order for tf.image.
+        Directories without a faces.json are detected once and the boxes persisted, so
+        later runs never re-detect; frames without a face keep the full frame.
+        """
+        boxes = []
+        for path in paths:
+            box = self.stored_face_box(path, detect_missing=True)
+            boxes.append([box[1], box[0], box[3], box[2]] if box else [0.0, 0.0, 1.0, 1.0])
+        return np.asarray(boxes, dtype='float32').reshape(-1, 4)
+
+    def stored_face_box(self, image_path, detect_missing=False):
+        """Face box of a frame file from the faces.json next to it, or None"""
+        frame_dir = os.path.dirname(os.path.abspath(image_path))
+        boxes = self._face_boxes.get(frame_dir)
+        if boxes is None:
+            if detect_missing and not os.path.exists(os.path.join(frame_dir, FACES_FILE)):
+                logger.info("Detecting faces in %s", frame_dir)
+                detect_directory(frame_dir, self.face_cropper)
+            boxes = self._face_boxes[frame_dir] = load_boxes(frame_dir)
+        return boxes.get(os.path.basename(image_path))
+
+    def _frame_dataset(self, paths, labels, shuffle=False, seed=42):
+        """Dataset of (uint8 frame, label) pairs decoded from image files"""
+        labels = np.asarray(labels, dtype='float32')
+        # Looking the boxes up front also detects (and persists) any that are missing
+        boxes = self.face_boxes(paths) if self.face_cropper is not None else None
+        if self.cache is not None:
+            slices, load = (list(paths), labels), self._load_frame_cached
+        elif boxes is not None:
+            slices, load = (list(paths), boxes, labels), self._load_face_frame
+        else:
+            slices, load = (list(paths), labels), self._load_frame
+        ds = tf.data.Dataset.from_tensor_slices(slices)
+        num_workers, worker_index = self._worker_shard()
+        if num_workers > 1:
+            # Split file names between workers before anything is decoded
+            ds = ds.shard(num_workers, worker_index)
+            options = tf.data.Options()
+            options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+            ds = ds.with_options(options)
+        if shuffle:
+            # Shuffling file names is cheap, so shuffle the whole list every epoch
+            ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+        return ds.apply(tf.data.experimental.ignore_errors())
+
+    def _finish_dataset(self, ds, batch_size, augment):
+        """Batch uint8 frames, then normalize (and optionally augment) whole batches"""
+        ds = ds.batch(batch_size)
+        ds = ds.map(lambda x, y: (tf.cast(x, tf.float32) / 255.0, y), num_parallel_calls=tf.data.AUTOTUNE)
+        if augment:
+            # Vectorized over whole batches, in parallel; training=True keeps the random layers active
+            ds = ds.map(lambda x, y: (self.data_augmentation(x, training=True), y),
+                        num_parallel_calls=tf.data.AUTOTUNE)
+        return ds.prefetch(tf.data.AUTOTUNE)
+
+    def build_dataset(self, paths, labels, batch_size=32, shuffle=False, augment=False, seed=42):
+        """
+        Streaming tf.data pipeline over a list of image files.
+
+        Only the file names live in memory; images are read, decoded and resized
+        in parallel as batches are consumed, so peak memory does not grow with
+        the size of the dataset.
+        """
+        ds = self._frame_dataset(paths, labels, shuffle=shuffle, seed=seed)
+        return self._finish_dataset(ds, batch_size, augment)
 
-        def augment(x, y):
-            return self.data_augmentation(x), y
+    def write_shards(self, paths, labels, shard_dir, images_per_shard=2048):
+        """Decode and resize each image once and store the uint8 frames in TFRecord shards"""
+        os.makedirs(shard_dir, exist_ok=True)
+        # Clear an older shard set (e.g. from a different split) so none of its files get mixed in
+        for stale in glob.glob(os.path.join(shard_dir, 'shard-*.tfrecord')) + [os.path.join(shard_dir, 'index.json')]:
+            if os.path.exists(stale):
+                os.remove(stale)
+        ds = self._frame_dataset(paths, labels)
 
-        train_ds = tf.data.Dataset.from_tensor_slices((X_train, y_train))
-        train_ds = train_ds.shuffle(buffer_size=100).map(augment).batch(batch_size).prefetch(tf.data.AUTOTUNE)
-        val_ds = tf.data.Dataset.from_tensor_slices((X_val, y_val)).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+        shards = []
+        writer = None
+        count = 0
+        for img, label in ds.as_numpy_iterator():
+            if count % images_per_shard == 0:
+                if writer is not None:
+                    writer.close()
+                shards.append(f"shard-{len(shards):05d}.tfrecord")
+                writer = tf.io.TFRecordWriter(os.path.join(shard_dir, shards[-1]))
+            example = tf.train.Example(features=tf.train.Features(feature={
+                'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[img.tobytes()])),
+                'label': tf.train.Feature(float_list=tf.train.FloatList(value=[float(label)])),
+            }))
+            writer.write(example.SerializeToString())
+            count += 1
+        if writer is not None:
+            writer.close()
+
+        # The index marks the shard set as complete and records the frame size it was built for
+        with open(os.path.join(shard_dir, 'index.json'), 'w') as f:
+            json.dump({'count': count, 'input_size': list(self.input_size), 'face_crop': self.face_cropper is not None,
+                       'files': self.files_digest(paths), 'shards': shards}, f, indent=2)
+        print(f"Wrote {count} images to {len(shards)} shards in {shard_dir}")
+        return shards
+
+    def files_digest(self, paths):
+        """Short digest of a file list, to tell whether stored shards hold the same split"""
+        digest = hashlib.sha1()
+        for path in paths:
+            digest.update(path.encode() + b'\0')
+        return digest.hexdigest()
+
+    def has_shards(self, shard_dir, paths=None):
+        """
+        True if shard_dir holds a complete shard set built for the current input size and
+        cropping, and, when paths is given, from exactly those files
+        """
+        index_path = os.path.join(shard_dir, 'index.json')
+        if not os.path.exists(index_path):
+            return False
+        with open(index_path) as f:
+            index = json.load(f)
+        return (tuple(index.get('input_size', ())) == tuple(self.input_size)
+                and index.get('face_crop', False) == (self.face_cropper is not None)
+                and (paths is None or index.get('files') == self.files_digest(paths)))
+
+    def load_shards(self, shard_dir, batch_size=32, shuffle=False, augment=False, shuffle_buffer=1024, seed=42):
+        """Streaming pipeline over TFRecord shards written by write_shards"""
+        width, height = self.input_size
+        files = sorted(glob.glob(os.path.join(shard_dir, 'shard-*.tfrecord')))
+        features = {
+            'image': tf.io.FixedLenFeature([], tf.string),
+            'label': tf.io.FixedLenFeature([], tf.float32),
+        }
+
+        def parse(record):
+            example = tf.io.parse_single_example(record, features)
+            img = tf.reshape(tf.io.decode_raw(example['image'], tf.uint8), (height, width, 3))
+            return img, example['label']
+
+        ds = tf.data.Dataset.from_tensor_slices(files)
+        if shuffle:
+            ds = ds.shuffle(len(files), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.interleave(tf.data.TFRecordDataset, cycle_length=min(len(files), 4) or 1,
+                           num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+        if shuffle:
+            # Bounded buffer of uint8 frames, independent of the dataset size
+            ds = ds.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+        ds = ds.map(parse, num_parallel_calls=tf.data.AUTOTUNE)
+        return self._finish_dataset(ds, batch_size, augment)
+
+    def _feature_extractor(self):
+        """Frozen MobileNetV2 base plus pooling, sharing the weights of self.model"""
+        width, height = self.input_size
+        return models.Sequential([layers.Input(shape=(height, width, 3)), self.model.layers[0], self.model.layers[1]])
+
+    def _head_model(self):
+        """The Dense head of self.model on its own, taking pooled embeddings; weights are shared"""
+        with self._strategy.scope() if self._strategy is not None else nullcontext():
+            head = models.Sequential([layers.Input(shape=(self.model.layers[0].output.shape[-1],)),
+                                      *self.model.layers[2:]])
+            head.compile(optimizer='adam',
+                         loss='binary_crossentropy',
+                         metrics=['accuracy'],
+                         jit_compile=self._jit_compile)
+        return head
+
+    def embedding_fingerprint(self, paths):
+        """Identifies the embeddings of a file list: the files, the frame size and cropping, and the base weights"""
+        digest = hashlib.sha1(json.dumps([list(self.input_size), self.face_cropper is not None,
+                                          self.files_digest(paths)]).encode())
+        for weight in self.model.layers[0].weights:
+            digest.update(np.asarray(weight, dtype='float32').tobytes())
+        return digest.hexdigest()
+
+    def write_embeddings(self, ds, embedding_dir, capacity, fingerprint):
+        """
+        Run the frozen base over a (not augmented) frame dataset once and store the pooled
+        embeddings as a memory-mapped embeddings.npy with labels.npy next to it.
+
+        capacity is an upper bound on the number of frames; unreadable files are skipped,
+        so the index records how many rows are actually filled.
+        """
+        os.makedirs(embedding_dir, exist_ok=True)
+        index_path = os.path.join(embedding_dir, 'index.json')
+        if os.path.exists(index_path):
+            # Drop the old index first so an interrupted rewrite is never taken as complete
+            os.remove(index_path)
+        extractor = self._feature_extractor()
+        dim = extractor.output_shape[-1]
+        features = np.lib.format.open_memmap(os.path.join(embedding_dir, 'embeddings.npy'), mode='w+',
+                                             dtype='float32', shape=(max(capacity, 1), dim))
+        labels = np.zeros(max(capacity, 1), dtype='float32')
+        count = 0
+        for images, batch_labels in ds:
+            batch = np.asarray(extractor.predict_on_batch(images), dtype='float32')
+            features[count:count + len(batch)] = batch
+            labels[count:count + len(batch)] = np.asarray(batch_labels).reshape(-1)
+            count += len(batch)
+        features.flush()
+        del features
+        np.save(os.path.join(embedding_dir, 'labels.npy'), labels)
+        with open(index_path, 'w') as f:
+            json.dump({'count': count, 'dim': dim, 'fingerprint': fingerprint}, f, indent=2)
+        print(f"Wrote {count} embeddings to {embedding_dir}")
+        return count
+
+    def has_embeddings(self, embedding_dir, fingerprint):
+        """True if embedding_dir holds complete embeddings with this fingerprint"""
+        index_path = os.path.join(embedding_dir, 'index.json')
+        if not os.path.exists(index_path):
+            return False
+        with open(index_path) as f:
+            return json.load(f).get('fingerprint') == fingerprint
+
+    def load_embeddings(self, embedding_dir, batch_size=32, shuffle=False, seed=42):
+        """Batches of (embedding, label) read from the memory-mapped arrays of write_embeddings"""
+        with open(os.path.join(embedding_dir, 'index.json')) as f:
+            index = json.load(f)
+        count, dim = index['count'], index['dim']
+        features = np.load(os.path.join(embedding_dir, 'embeddings.npy'), mmap_mode='r')
+        labels = np.load(os.path.join(embedding_dir, 'labels.npy'), mmap_mode='r')
+
+        def gather(rows):
+            # Sorted rows read the memory map front to back
+            rows = np.sort(rows)
+            return np.asarray(features[rows]), np.asarray(labels[rows])
+
+        ds = tf.data.Dataset.range(count)
+        if shuffle:
+            ds = ds.shuffle(count, seed=seed, reshuffle_each_iteration=True)
+        ds = ds.batch(batch_size)
+        ds = ds.map(lambda rows: tf.numpy_function(gather, [rows], (tf.float32, tf.float32)))
+        ds = ds.map(lambda x, y: (tf.ensure_shape(x, (None, dim)), tf.ensure_shape(y, (None,))))
+        return ds.prefetch(tf.data.AUTOTUNE)
+
+    def train(self, real_dir, fake_dir, epochs=10, batch_size=32, validation_split=0.2, fine_tune_epochs=5,
+              shard_dir=None, mixed_precision=False, jit_compile=False, strategy=None, callbacks=None,
+              embedding_dir=None, split_by='speaker'):
+        """
+        split_by: 'speaker', 'video' or 'frame'; see split_dataset
+        embedding_dir: run the frozen base over the training and validation frames once,
+                       store the pooled embeddings there and train the head on them for the
+                       first phase (seconds per epoch instead of minutes, but without
+                       augmentation); later runs over the same files and weights reuse them.
+                       Fine-tuning still trains the full network on images
+        mixed_precision: compute in bfloat16 on CPU (float16 on GPU) with float32 weights;
+                         the model is converted back to float32 afterwards, so saving and
+                         serving are unaffected
+        jit_compile: compile the train step with XLA
+        strategy: None, 'mirrored', 'multi_worker' (TF_CONFIG) or a tf.distribute.Strategy;
+                  batch_size is the global batch size across all replicas
+        callbacks: extra Keras callbacks for both training phases
+        """
+        self._strategy = self._make_strategy(strategy)
+        self._jit_compile = jit_compile
+        if mixed_precision:
+            policy = 'mixed_float16' if tf.config.list_physical_devices('GPU') else 'mixed_bfloat16'
+            tf.keras.mixed_precision.set_global_policy(policy)
+            print(f"Mixed precision: {policy}")
+        if mixed_precision or self._strategy is not None:
+            # Variables must be created under the policy and inside the strategy scope
+            self._rebuild_model()
+        self._compile()
+        try:
+            return self._train(real_dir, fake_dir, epochs, batch_size, validation_split, fine_tune_epochs, shard_dir,
+                               callbacks or [], embedding_dir, split_by)
+        finally:
+            self._strategy = None
+            if mixed_precision:
+                tf.keras.mixed_precision.set_global_policy('float32')
+                self._rebuild_model()
+                self._compile()
+
+    def distill(self, real_dir, fake_dir, student_size=(96, 96), student_width=0.35, epochs=15, batch_size=32,
+                validation_split=0.2, hard_label_weight=0.3, split_by='speaker', learning_rate=1e-3, pretrained=True):
+        """
+        Train a compact student (see _build_student_model) from this model's scores.
+
+        The teacher (self.model) scores every training frame once. The student is fitted at
+        its own resolution on those soft scores mixed with the true labels (hard_label_weight
+        is the share of the label), on augmented frames, and keeps its best epoch by
+        validation loss against the true labels. Returns (student model, report comparing
+        teacher and student on the validation split, see compare_models).
+        """
+        paths, labels = self.list_images(real_dir, fake_dir)
+        if not paths:
+            raise ValueError("No images found")
+        labels = np.asarray(labels, dtype='float32')
+        train_idx, val_idx, _ = self.split_dataset(paths, labels, validation_split, split_by)
+        train_paths = [paths[i] for i in train_idx]
+        val_paths = [paths[i] for i in val_idx]
+
+        print(f"Scoring {len(train_paths)} training frames with the teacher...")
+        soft = self.score_paths(self.model, train_paths, batch_size)
+        targets = hard_label_weight * labels[train_idx] + (1 - hard_label_weight) * soft
+        # Unreadable frames (no teacher score) are dropped by the dataset anyway
+        targets = np.nan_to_num(targets, nan=0.0)
+
+        resize = self._resizer(student_size)
+        train_ds = self._frame_dataset(train_paths, targets, shuffle=True)
+        train_ds = self._finish_dataset(train_ds.map(resize, num_parallel_calls=tf.data.AUTOTUNE), batch_size,
+                                        augment=True)
+        val_ds = self._frame_dataset(val_paths, labels[val_idx])
+        val_ds = self._finish_dataset(val_ds.map(resize, num_parallel_calls=tf.data.AUTOTUNE), batch_size,
+                                      augment=False)
+
+        student = self._build_student_model(student_size, student_width, weights='imagenet' if pretrained else None)
+        student.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate), loss='binary_crossentropy')
+        student.fit(train_ds, epochs=epochs, validation_data=val_ds, callbacks=[
+            tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True)
+        ])
+        return student, self.compare_models(student, val_paths, labels[val_idx], batch_size)
+
+    def _resizer(self, size):
+        """tf.data map function resizing uint8 frames from input_size to size (width, height)"""
+        def resize(img, label):
+            img = tf.image.resize(img, (size[1], size[0]), antialias=True)
+            return tf.cast(tf.clip_by_value(tf.round(img), 0, 255), tf.uint8), label
+        return resize
+
+    def score_paths(self, model, paths, batch_size=32):
+        """Scores of model (at its own input size) for image files, in order; NaN where a file could not be read"""
+        scores = np.full(len(paths), np.nan, dtype='float32')
+        # Carry each file's position through the pipeline in place of its label, so
+        # files it skips do not shift the scores
+        ds = self._frame_dataset(paths, np.arange(len(paths), dtype='float32'))
+        height, width = model.input_shape[1:3]
+        if (width, height) != tuple(self.input_size):
+            ds = ds.map(self._resizer((width, height)), num_parallel_calls=tf.data.AUTOTUNE)
+        for images, index in self._finish_dataset(ds, batch_size, augment=False):
+            scores[index.numpy().astype(int)] = np.asarray(model.predict_on_batch(images)).reshape(-1)
+        return scores
+
+    def compare_models(self, student, paths, labels, batch_size=32):
+        """Accuracy, AUC, latency and size of self.model (teacher) and student on the same frames"""
+        labels = np.asarray(labels)
+        report = {'frames': len(paths)}
+        verdicts = {}
+        for name, model in (('teacher', self.model), ('student', student)):
+            scores = self.score_paths(model, paths, batch_size)
+            readable = ~np.isnan(scores)
+            verdicts[name] = scores[readable] > 0.5
+            report[name] = {
+                'input_size': [int(model.input_shape[2]), int(model.input_shape[1])],
+                'params': int(model.count_params()),
+                'weights_mb': sum(w.nbytes for w in model.get_weights()) / 1e6,
+                'accuracy': float((verdicts[name] == (labels[readable] > 0.5)).mean()),
+                'auc': roc_auc(scores[readable], labels[readable]),
+                **measure_latency(model),
+            }
+        report['agreement'] = float((verdicts['teacher'] == verdicts['student']).mean())
+        report['speedup'] = report['student']['images_per_sec'] / report['teacher']['images_per_sec']
+        return report
+
+    def split_dataset(self, paths, labels, validation_split=0.2, split_by='speaker', seed=42):
+        """
+        (train indices, val indices, grouping used) into paths. split_by 'speaker' or 'video'
+        keeps each speaker/video on one side so validation never sees frames of a training
+        video; 'frame' splits individual frames. Falls back to the next finer grouping when
+        the groups cannot put every label on both sides.
+        """
+        for by in SPLIT_GROUPINGS[SPLIT_GROUPINGS.index(split_by):]:
+            groups = frame_groups(paths, by) if by != 'frame' else list(range(len(paths)))
+            train_idx, val_idx = split_indices(labels, groups, validation_split, seed)
+            if covers_labels(labels, train_idx, val_idx):
+                if by != split_by:
+                    logger.warning("Too few %s groups for a %s split; split by %s instead", split_by, split_by, by)
+                return train_idx, val_idx, by
+        logger.warning("No split puts every label in both training and validation")
+        return train_idx, val_idx, by
+
+    def _train(self, real_dir, fake_dir, epochs, batch_size, validation_split, fine_tune_epochs, shard_dir, callbacks,
+               embedding_dir=None, split_by='speaker'):
+        print("Indexing dataset...")
+        paths, labels = self.list_images(real_dir, fake_dir)
+        # Split file names only, by whole speakers/videos; nothing is decoded until the pipeline runs
+        train_idx, val_idx, split_by = self.split_dataset(paths, labels, validation_split, split_by)
+        train_paths, train_labels = [paths[i] for i in train_idx], [labels[i] for i in train_idx]
+        val_paths, val_labels = [paths[i] for i in val_idx], [labels[i] for i in val_idx]
+        print(f"Training on {len(train_paths)} images, validating on {len(val_paths)} images (split by {split_by})")
+
+        if shard_dir:
+            # Decode once into TFRecord shards, then stream from them on every epoch
+            train_shards = os.path.join(shard_dir, 'train')
+            val_shards = os.path.join(shard_dir, 'val')
+            have_train = self.has_shards(train_shards, train_paths)
+            have_val = self.has_shards(val_shards, val_paths)
+            if self._worker_shard()[0] > 1 and not (have_train and have_val):
+                raise ValueError("Build the shards once without a multi-worker strategy before training with one")
+            if not have_train:
+                self.write_shards(train_paths, train_labels, train_shards)
+            if not have_val:
+                self.write_shards(val_paths, val_labels, val_shards)
+            train_frames = self.load_shards(train_shards, batch_size)
+            train_ds = self.load_shards(train_shards, batch_size, shuffle=True, augment=True)
+            val_ds = self.load_shards(val_shards, batch_size)
+        else:
+            train_frames = self.build_dataset(train_paths, train_labels, batch_size)
+            train_ds = self.build_dataset(train_paths, train_labels, batch_size, shuffle=True, augment=True)
+            val_ds = self.build_dataset(val_paths, val_labels, batch_size)
 
         # Initial training (feature extraction)
-        history = self.model.fit(
-            train_ds,
+        if embedding_dir:
+            # The base is frozen, so its output never changes: compute it once and train only the head
+            splits = (('train', train_paths, train_frames), ('val', val_paths, val_ds))
+            for name, split_paths, frames in splits:
+                directory = os.path.join(embedding_dir, name)
+                fingerprint = self.embedding_fingerprint(split_paths)
+                if not self.has_embeddings(directory, fingerprint):
+                    if self._worker_shard()[0] > 1:
+                        raise ValueError("Build the embeddings once without a multi-worker strategy "
+                                         "before training with one")
+                    self.write_embeddings(frames, directory, len(split_paths), fingerprint)
+            fit_model = self._head_model()
+            fit_train = self.load_embeddings(os.path.join(embedding_dir, 'train'), batch_size, shuffle=True)
+            fit_val = self.load_embeddings(os.path.join(embedding_dir, 'val'), batch_size)
+        else:
+            fit_model, fit_train, fit_val = self.model, train_ds, val_ds
+        history = fit_model.fit(
+            fit_train,
             epochs=epochs,
-            validation_data=val_ds,
+            validation_data=fit_val,
             callbacks=[
                 tf.keras.callbacks.EarlyStopping(
                     monitor='val_loss',
                     patience=3,
                     restore_best_weights=True
                 )
-            ]
+            ] + callbacks
         )
         # Fine-tuning phase
         print("\nStarting fine-tuning phase...")
-        self.fine_tune(train_ds, val_ds, initial_epochs=epochs, fine_tune_epochs=fine_tune_epochs)
+        self.fine_tune(train_ds, val_ds, initial_epochs=epochs, fine_tune_epochs=fine_tune_epochs, callbacks=callbacks)
         return history
     
     def save_model(self, model_path):
@@ -155,6 +830,126 @@ class DeepfakeDetector:
         self.model.save(model_path)
         print(f"Model saved to {model_path}")
     
+    def decode_image(self, data, reduced=True):
+        """
+        Decode an encoded image (bytes, bytearray or memoryview) straight from memory.
+        With reduced, large JPEGs are decoded at a fraction of their size (see decode_flag).
+        """
+        try:
+            buf = np.frombuffer(memoryview(data), dtype=np.uint8)
+            if buf.size == 0:
+                return None
+            # Returns None if the buffer is not a supported image format
+            return cv2.imdecode(buf, self.decode_flag(buf) if reduced else cv2.IMREAD_COLOR)
+        except Exception as e:
+            logger.warning("Error decoding image: %s", e)
+            return None
+
+    def decode_flag(self, data):
+        """cv2 imread flag for encoded image data: the smallest JPEG scale that still comfortably covers input_size"""
+        size = jpeg_size(data)
+        if size is None:
+            return cv2.IMREAD_COLOR
+        margin = REDUCED_DECODE_MARGIN_FACE if self.face_cropper is not None else REDUCED_DECODE_MARGIN
+        min_side = max(self.input_size) * margin
+        for factor, flag in REDUCED_DECODE_FLAGS:
+            if min(size) // factor >= min_side:
+                return flag
+        return cv2.IMREAD_COLOR
+
+    def read_image(self, image_path, reduced=True):
+        """Read and decode an image file (see decode_image), or None if it cannot be read"""
+        try:
+            with open(image_path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            logger.warning("Error reading image %s: %s", image_path, e)
+            return None
+        return self.decode_image(data, reduced=reduced)
+
+    def resize_frame(self, img):
+        """Convert a decoded BGR image to the model's RGB uint8 input size"""
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return cv2.resize(img, self.input_size)
+
+    def crop_face(self, img, box=None):
+        """Crop a decoded BGR image to its face (detected unless box is given); no-op when face cropping is off"""
+        if self.face_cropper is None:
+            return img
+        if box is None:
+            box = self.face_cropper.detect(img)
+        # Keep the full frame when no face is found
+        return self.face_cropper.crop(img, box) if box is not None else img
+
+    def normalize_frame(self, frame):
+        """Scale a uint8 frame to the float32 [0, 1] range the model expects"""
+        return frame.astype('float32') / 255.0
+
+    def cache_key(self, data):
+        """Content hash of encoded image bytes, or None when caching is disabled"""
+        return self.cache.key_for(data) if self.cache is not None else None
+
+    def load_frame_bytes(self, data, key=None, box=None):
+        """Decode, crop and resize encoded image bytes, consulting the frame cache when enabled"""
+        if self.cache is not None:
+            key = key or self.cache.key_for(data)
+            frame = self.cached_frame(key)
+            if frame is not None:
+                return frame
+        # Stored face boxes are in full-resolution coordinates
+        img = self.decode_image(data, reduced=box is None)
+        if img is None:
+            return None
+        frame = self.resize_frame(self.crop_face(img, box))
+        self.remember_frame(key, frame)
+        return frame
+
+    def load_frame_file(self, image_path):
+        """Read an image file into a resized RGB uint8 frame (cached when enabled)"""
+        # Extracted frames carry their face boxes in faces.json, so no detection is needed
+        box = self.stored_face_box(image_path) if self.face_cropper is not None else None
+        if self.cache is None:
+            img = self.read_image(image_path, reduced=box is None)
+            return self.resize_frame(self.crop_face(img, box)) if img is not None else None
+        try:
+            with open(image_path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            # Same as without the cache: unreadable files are skipped, not raised
+            logger.warning("Error reading image %s: %s", image_path, e)
+            return None
+        return self.load_frame_bytes(data, box=box)
+
+    def cached_frame(self, key):
+        if self.cache is None or key is None:
+            return None
+        return self.cache.get(key)
+
+    def remember_frame(self, key, frame):
+        if self.cache is not None and key is not None:
+            self.cache.put(key, frame)
+
+    def cached_score(self, key):
+        if self.cache is None or key is None:
+            return None
+        return self.cache.get_score(self._score_key(key))
+
+    def remember_score(self, key, score):
+        if self.cache is not None and key is not None:
+            self.cache.put_score(self._score_key(key), score)
+
+    def _score_key(self, key):
+        # Frames do not depend on the model, scores do: detectors sharing a cache across
+        # model versions (see model_registry.py) never answer with another version's score
+        return key if self.model_version is None else (self.model_version, key)
+
+    def preprocess_array(self, img):
+        """Preprocess a decoded BGR image array for model prediction"""
+        img = self.normalize_frame(self.resize_frame(self.crop_face(img)))
+        
+        # Add batch dimension
+        return np.expand_dims(img, axis=0)
+
     def preprocess_image(self, image_path):
         """Preprocess the input image for model prediction"""
         try:
@@ -163,29 +958,60 @@ class DeepfakeDetector:
             
             # Check if file exists
             if not os.path.exists(abs_path):
-                print(f"Error: File not found at {abs_path}")
+                logger.error("File not found at %s", abs_path)
                 return None
                 
             # Read and resize image
-            img = cv2.imread(abs_path)
+            img = self.read_image(abs_path)
             if img is None:
-                print(f"Error: Could not read image at {abs_path}")
+                logger.error("Could not read image at %s", abs_path)
                 return None
                 
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img = cv2.resize(img, self.input_size)
-            
-            # Normalize pixel values
-            img = img.astype('float32') / 255.0
-            
-            # Add batch dimension
-            img = np.expand_dims(img, axis=0)
-            
-            return img
+            return self.preprocess_array(img)
         except Exception as e:
-            print(f"Error preprocessing image: {str(e)}")
+            logger.exception("Error preprocessing image: %s", e)
             return None
     
+    def score_batch(self, images):
+        """Run one forward pass over a batch of preprocessed images and return the raw scores"""
+        images = np.asarray(images, dtype='float32')
+        return np.asarray(self.model.predict_on_batch(images)).reshape(-1)
+
+    def triage_score(self, processed_img):
+        """Triage score of a normalized frame (or batch of one) if it is confident enough to skip the CNN, else None"""
+        if self.triage is None:
+            return None
+        score = self.triage.scores(processed_img)[0]
+        return float(score) if self.triage.decide(score) else None
+
+    def cascade_scores(self, images, score_fn=None):
+        """
+        Scores for a batch of normalized frames, the CNN (score_fn, default score_batch) only
+        seeing the frames the triage stage is unsure about. Also returns the mask of frames
+        the triage stage decided (all False without one).
+        """
+        score_fn = score_fn or self.score_batch
+        images = np.asarray(images, dtype='float32')
+        if self.triage is None:
+            return np.asarray(score_fn(images)).reshape(-1), np.zeros(len(images), dtype=bool)
+        scores = self.triage.scores(images)
+        decided = self.triage.decide(scores)
+        if not decided.all():
+            scores[~decided] = np.asarray(score_fn(images[~decided])).reshape(-1)
+        return scores, decided
+
+    def format_result(self, prediction, threshold=0.5, stage=None):
+        """Turn a raw sigmoid score into the result dict returned by the API; stage says which cascade stage decided"""
+        prediction = float(prediction)
+        result = {
+            'is_fake': bool(prediction > threshold),
+            'confidence': float(prediction if prediction > threshold else 1 - prediction),
+            'raw_score': prediction  # Add raw score to output
+        }
+        if stage is not None:
+            result['stage'] = stage
+        return result
+
     def predict(self, image_path):
         """Predict if the image is real or fake"""
         # Preprocess the image
@@ -194,43 +1020,494 @@ class DeepfakeDetector:
         if processed_img is None:
             return None
         
-        # Make prediction
-        prediction = self.model.predict(processed_img)[0][0]
+        return self._predict_processed(processed_img)
+
+    def predict_array(self, img):
+        """Predict from an already decoded BGR image array"""
+        if img is None:
+            return None
+        return self._predict_processed(self.preprocess_array(img))
+
+    def predict_bytes(self, data):
+        """Predict from the encoded image bytes of an upload, without writing it to disk"""
+        key = self.cache_key(data)
+        score = self.cached_score(key)
+        if score is not None:
+            return self.format_result(score, stage='cache')
+
+        frame = self.load_frame_bytes(data, key)
+        if frame is None:
+            return None
+        result = self._predict_processed(np.expand_dims(self.normalize_frame(frame), axis=0))
+        self.remember_score(key, result['raw_score'])
+        return result
+
+    def predict_video(self, video_path, frame_rate=None, max_frames=64, sampling='uniform', batch_size=16,
+                      early_exit_confidence=None, min_frames=8, segment_seconds=1.0, score_fn=None,
+                      detect_every=5, progress=None):
+        """
+        Score a video by streaming sampled frames through the model in batches.
+
+        frame_rate: score 1 frame every N frames (default: spread max_frames evenly over the video)
+        sampling: 'uniform' or 'scene' (only frames that differ from the last sampled one)
+        early_exit_confidence: stop once at least min_frames are scored and the running mean
+                               score is this confident either way
+        score_fn: callable mapping an (N, H, W, 3) batch to N scores; defaults to score_batch,
+                  the backends pass their micro-batcher instead. With a triage stage it only
+                  sees the frames triage could not decide
+        detect_every: with face cropping, run the face detector every N sampled frames and
+                      track the face in between
+        progress: optional callable(frames_scored, frames_expected) called after each batch
+        Returns the usual result dict for the mean score plus max/min scores, per-segment means
+        and how many frames the triage stage decided. Raises extract_frames.VideoOpenError if
+        the file cannot be opened as a video.
+        """
+        score_fn = score_fn or self.score_batch
+        total_frames, fps = video_info(video_path)
+        if frame_rate is None:
+            frame_rate = max(1, total_frames // max_frames) if total_frames and max_frames else 1
+        expected = -(-total_frames // frame_rate) if total_frames else None
+        if expected and max_frames:
+            expected = min(expected, max_frames)
+
+        scores = []
+        indices = []
+        batch = []
+        batch_indices = []
+        triaged = 0
+        early_exit = False
+        tracker = FaceTracker(self.face_cropper, detect_every) if self.face_cropper is not None else None
+
+        def flush():
+            nonlocal triaged
+            batch_scores, decided = self.cascade_scores(np.stack(batch), score_fn)
+            triaged += int(decided.sum())
+            scores.extend(float(score) for score in batch_scores)
+            indices.extend(batch_indices)
+            batch.clear()
+            batch_indices.clear()
+            if progress is not None:
+                progress(len(scores), expected)
+
+        for frame_index, frame in iter_frames(video_path, frame_rate, sampling=sampling, max_frames=max_frames):
+            if tracker is not None:
+                box = tracker.update(frame)
+                if box is not None:
+                    frame = self.face_cropper.crop(frame, box)
+            batch.append(self.normalize_frame(self.resize_frame(frame)))
+            batch_indices.append(frame_index)
+            if len(batch) < batch_size:
+                continue
+            flush()
+            if early_exit_confidence and len(scores) >= min_frames:
+                mean = float(np.mean(scores))
+                if max(mean, 1 - mean) >= early_exit_confidence:
+                    early_exit = True
+                    break
+        if batch:
+            flush()
+
+        if not scores:
+            return None
+
+        scores_arr = np.asarray(scores)
+        result = self.format_result(scores_arr.mean())
+        result.update({
+            'max_score': float(scores_arr.max()),
+            'min_score': float(scores_arr.min()),
+            'fake_frame_ratio': float((scores_arr > 0.5).mean()),
+            'frames_scored': len(scores),
+            'frames_total': total_frames,
+            'frames_triaged': triaged,
+            'early_exit': early_exit,
+            'sampling': sampling,
+            'segments': self._video_segments(indices, scores, fps, segment_seconds),
+        })
+        return result
+
+    def _video_segments(self, indices, scores, fps, segment_seconds):
+        """Group frame scores into fixed-length time segments"""
+        # Without a usable frame rate, fall back to segments of 25 frames
+        frames_per_segment = max(1, int(round((fps or 25.0) * segment_seconds)))
+        segments = {}
+        for frame_index, score in zip(indices, scores):
+            segments.setdefault(frame_index // frames_per_segment, []).append(score)
+        fps = fps or 25.0
+        return [
+            {
+                'start': segment * frames_per_segment / fps,
+                'end': (segment + 1) * frames_per_segment / fps,
+                'mean_score': float(np.mean(values)),
+                'max_score': float(np.max(values)),
+                'frames': len(values),
+            }
+            for segment, values in sorted(segments.items())
+        ]
+
+    def predict_stream(self, items, batch_size=64, workers=4, score_fn=None):
+        """
+        Score a large stream of images with bounded memory.
+
+        items: iterable of (name, read_fn) pairs, read_fn() returning the encoded image bytes
+        Images are read and decoded on a thread pool a couple of batches ahead of the model
+        and scored in fixed-size batches (partial ones are zero-padded), so the model always
+        sees the same shape. Frames the triage stage is confident about are decided as soon
+        as they are decoded and never reach the model. Yields (name, result) pairs in input
+        order as soon as they are decided; result is None for files that could not be decoded.
+        """
+        score_fn = score_fn or self.score_batch
+        width, height = self.input_size
+        unscored = object()
+
+        def load(item):
+            name, read = item
+            try:
+                frame = self.load_frame_bytes(read())
+            except Exception as e:
+                logger.warning("Error loading image %s: %s", name, e)
+                return name, None, None
+            # Triage runs on the loader threads, off the model's critical path
+            triaged = self.triage_score(self.normalize_frame(frame)) if frame is not None else None
+            return name, frame, triaged
+
+        def score(waiting):
+            batch = np.zeros((batch_size, height, width, 3), dtype='float32')
+            for i, (_, frame) in enumerate(waiting):
+                batch[i] = self.normalize_frame(frame)
+            scores = np.asarray(score_fn(batch)).reshape(-1)[:len(waiting)]
+            for (slot, _), value in zip(waiting, scores):
+                slot[1] = self.format_result(value, stage='model')
+            waiting.clear()
+
+        def decided(results):
+            while results and results[0][1] is not unscored:
+                name, result = results.popleft()
+                yield name, result
+
+        items = iter(items)
+        pending = deque()
+        results = deque()  # [name, result] in input order; model results are filled in when their batch is scored
+        waiting = []  # ([name, result] slot, frame) for the next model batch
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            def fill():
+                while len(pending) < 2 * batch_size:
+                    item = next(items, None)
+                    if item is None:
+                        return
+                    pending.append(pool.submit(load, item))
+
+            fill()
+            while pending:
+                name, frame, triaged = pending.popleft().result()
+                fill()
+                if frame is None:
+                    results.append([name, None])
+                elif triaged is not None:
+                    results.append([name, self.format_result(triaged, stage='triage')])
+                else:
+                    slot = [name, unscored]
+                    results.append(slot)
+                    waiting.append((slot, frame))
+                # Decided results queue up behind a frame waiting for its batch; past a few
+                # batches' worth, score the partial batch instead of holding them back
+                if len(waiting) == batch_size or (waiting and len(results) >= 4 * batch_size):
+                    score(waiting)
+                yield from decided(results)
+            if waiting:
+                score(waiting)
+            yield from decided(results)
+
+    def _predict_processed(self, processed_img):
+        # Make prediction (the triage stage, when enabled, answers confident frames on its own)
+        scores, decided = self.cascade_scores(processed_img)
+        prediction = scores[0]
         
-        # Print raw prediction value for debugging
-        print(f"Raw prediction value: {prediction}")
+        # Raw prediction value for debugging (LOG_LEVEL=DEBUG); never formatted otherwise
+        logger.debug("Raw prediction value: %s", prediction)
         
         # Use a more balanced threshold
-        threshold = 0.5
-        
-        # Return result
-        result = {
-            'is_fake': bool(prediction > threshold),
-            'confidence': float(prediction if prediction > threshold else 1 - prediction),
-            'raw_score': float(prediction)  # Add raw score to output
-        }
-        
-        return result
+        return self.format_result(prediction, threshold=0.5, stage='triage' if decided[0] else 'model')
+
+def roc_auc(scores, labels):
+    """Area under the ROC curve (Mann-Whitney U, ties counted half), or None with only one class"""
+    scores = np.asarray(scores, dtype='float64')
+    labels = np.asarray(labels) > 0.5
+    positives = int(labels.sum())
+    negatives = len(labels) - positives
+    if not positives or not negatives:
+        return None
+    _, inverse, counts = np.unique(scores, return_inverse=True, return_counts=True)
+    ranks = (np.cumsum(counts) - (counts - 1) / 2.0)[inverse]  # 1-based, averaged over ties
+    return float((ranks[labels].sum() - positives * (positives + 1) / 2.0) / (positives * negatives))
+
+def measure_latency(model, batch_sizes=(1, 16), repeats=20):
+    """Median ms per forward pass of a Keras model at each batch size, and images/sec at the largest"""
+    height, width = model.input_shape[1:3]
+    result = {}
+    for batch_size in batch_sizes:
+        batch = np.random.default_rng(0).random((batch_size, height, width, 3), dtype='float32')
+        model.predict_on_batch(batch)  # Trace and allocate before timing
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            model.predict_on_batch(batch)
+            timings.append(time.perf_counter() - started)
+        result[f'batch{batch_size}_ms'] = float(np.median(timings) * 1000)
+    result['images_per_sec'] = max(batch_sizes) / (result[f'batch{max(batch_sizes)}_ms'] / 1000)
+    return result
+
+def jpeg_size(data):
+    """(width, height) from a JPEG's frame header, or None if data is not a JPEG"""
+    view = memoryview(data).cast('B')
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 <= len(view):
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # Markers without a length
+            i += 2
+            continue
+        # SOF0-SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (view[i + 5] << 8) | view[i + 6]
+            width = (view[i + 7] << 8) | view[i + 8]
+            return width, height
+        i += 2 + ((view[i + 2] << 8) | view[i + 3])
+    return None
+
+def frame_groups(paths, by='speaker'):
+    """
+    Group id per frame for splitting. 'video': the directory the frame was extracted
+    into. 'speaker': videos that share a speaker id in their path (a face swap names
+    both people) are joined, so every person ends up on one side of the split only.
+    """
+    videos = [os.path.dirname(os.path.abspath(path)) for path in paths]
+    if by == 'video':
+        return videos
+
+    # Union-find over video directories and the speaker ids they mention
+    parent = {}
+
+    def find(node):
+        parent.setdefault(node, node)
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for video in set(videos):
+        # The last components hold <quality>/<speaker>/<clip>-video-<speaker>; ignore the rest of the path
+        tail = '/'.join(video.replace(os.sep, '/').lower().split('/')[-3:])
+        for speaker in SPEAKER_ID.findall(tail):
+            parent[find(('video', video))] = find(('speaker', speaker))
+    return [find(('video', video)) for video in videos]
+
+def covers_labels(labels, train_idx, val_idx):
+    """True when every label has frames on both sides of a split"""
+    labels = np.asarray(labels)
+    present = set(np.unique(labels).tolist())
+    return (set(np.unique(labels[train_idx]).tolist()) == present
+            and set(np.unique(labels[val_idx]).tolist()) == present)
+
+def split_indices(labels, groups, validation_split=0.2, seed=42):
+    """
+    Split frame indices into (train, val) lists without any group on both sides.
+    Groups are shuffled and added to validation until it holds validation_split of
+    the frames of each label; a group only goes to validation while that keeps the
+    labels it contains at or under their target.
+    """
+    members = {}
+    for index, group in enumerate(groups):
+        members.setdefault(group, []).append(index)
+    order = sorted(members, key=str)
+    random.Random(seed).shuffle(order)
+
+    labels = np.asarray(labels)
+    targets = {label: validation_split * count for label, count in zip(*np.unique(labels, return_counts=True))}
+    taken = dict.fromkeys(targets, 0)
+    val = []
+    for group in order:
+        counts = dict(zip(*np.unique(labels[members[group]], return_counts=True)))
+        if any(taken[label] >= targets[label] for label in counts):
+            continue
+        # Accept a group that overshoots only if that lands closer to the target than stopping short
+        if any(taken[label] + n - targets[label] > targets[label] - taken[label] for label, n in counts.items()):
+            continue
+        val.extend(members[group])
+        for label, n in counts.items():
+            taken[label] += n
+    val_set = set(val)
+    train = [index for index in range(len(labels)) if index not in val_set]
+    return train, sorted(val)
+
+def read_file(path):
+    """Contents of the file at path, closing it straight away"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+def iter_image_files(directory):
+    """Yield (path, read_fn) for every image under directory, recursively"""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, file)
+                yield path, partial(read_file, path)
+
+def iter_zip_images(source):
+    """Yield (member name, read_fn) for every image in a zip archive (path or file object) without extracting it"""
+    with zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                # Read while the archive is open; consumers may call read_fn after this generator finishes
+                data = archive.read(info)
+                yield info.filename, lambda data=data: data
+
+def iter_tar_images(source):
+    """Yield (member name, read_fn) for every image in a tar archive (any compression), streaming through it once"""
+    with tarfile.open(source, mode='r|*') as archive:
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                data = archive.extractfile(member).read()
+                yield member.name, lambda data=data: data
+
+def iter_archive_images(path):
+    """Images from a zip or tar archive without extracting it, or None if path is neither"""
+    if zipfile.is_zipfile(path):
+        return iter_zip_images(path)
+    if tarfile.is_tarfile(path):
+        return iter_tar_images(path)
+    return None
+
+RESULT_FIELDS = ['path', 'is_fake', 'confidence', 'raw_score', 'stage', 'error']
+
+def iter_result_lines(results, fmt='jsonl'):
+    """Render (name, result) pairs as CSV or JSON Lines text, one line at a time"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        yield buffer.getvalue()
+    for name, result in results:
+        row = {'path': name}
+        if result is None:
+            row['error'] = 'Could not decode image'
+        else:
+            row.update(is_fake=result['is_fake'], confidence=result['confidence'], raw_score=result['raw_score'],
+                       stage=result.get('stage'))
+        if fmt == 'csv':
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(row)
+            yield buffer.getvalue()
+        else:
+            yield json.dumps(row) + '\n'
 
 def main():
-    # Initialize the detector
-    detector = DeepfakeDetector()
+    parser = argparse.ArgumentParser(description='Deepfake detection: train a model or score images')
+    parser.add_argument('--train', nargs=2, metavar=('REAL_DIR', 'FAKE_DIR'),
+                        help='Train on images found recursively under REAL_DIR and FAKE_DIR')
+    parser.add_argument('--distill', nargs=2, metavar=('REAL_DIR', 'FAKE_DIR'),
+                        help='Train a compact student model from the scores of --model')
+    parser.add_argument('--student-output', default='deepfake_student.h5', help='Where --distill saves the student')
+    parser.add_argument('--student-size', type=int, default=96, help='Student input resolution (square)')
+    parser.add_argument('--student-width', type=float, default=0.35, help='Student MobileNetV2 width multiplier')
+    parser.add_argument('--report', help='With --distill, also write the teacher/student comparison to this JSON file')
+    parser.add_argument('--shard-dir', help='Cache decoded frames as TFRecord shards in this directory while training')
+    parser.add_argument('--split-by', choices=SPLIT_GROUPINGS, default='speaker',
+                        help='Keep each speaker (or video) entirely in train or in validation')
+    parser.add_argument('--embedding-dir',
+                        help='Train the frozen phase on MobileNetV2 embeddings computed once and stored here')
+    parser.add_argument('--cache-dir', help='Content-addressed cache of preprocessed frames, reused across runs')
+    parser.add_argument('--mixed-precision', action='store_true',
+                        help='Train in bfloat16 on CPU (float16 on GPU); the saved model stays float32')
+    parser.add_argument('--jit-compile', action='store_true', help='Compile the training step with XLA')
+    parser.add_argument('--strategy', choices=['default', 'mirrored', 'multi_worker'], default='default',
+                        help='tf.distribute strategy for training; multi_worker reads the cluster from TF_CONFIG')
+    parser.add_argument('--model', default='deepfake_model.h5', help='Model used for prediction')
+    parser.add_argument('--face-crop', action='store_true',
+                        help='Crop frames to the detected face (boxes are read from faces.json when present)')
+    parser.add_argument('--predict-dir', metavar='DIR_OR_ZIP',
+                        help='Score every image in a directory (recursively) or a zip/tar archive')
+    parser.add_argument('--output', help='Write --predict-dir results to this file instead of stdout')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv', help='Output format for --predict-dir')
+    parser.add_argument('--batch-size', type=int, default=64, help='Images per forward pass for --predict-dir')
+    parser.add_argument('--workers', type=int, default=4, help='Decode threads for --predict-dir')
+    parser.add_argument('--triage', metavar='TRIAGE_JSON',
+                        help='Cascade: let this triage model (fitted with cascade.py) answer confident images first')
+    parser.add_argument('--triage-low', type=float, help='Override the triage threshold for calling an image real')
+    parser.add_argument('--triage-high', type=float, help='Override the triage threshold for calling an image fake')
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if args.distill and not os.path.exists(args.model):
+        # Checked before the detector is built: that may download ImageNet weights
+        parser.error(f"--distill needs a trained teacher model; {args.model} does not exist")
+
+    # Initialize the detector (training always starts from a fresh model)
+    detector = DeepfakeDetector(model_path=None if args.train else args.model, face_crop=args.face_crop)
+    if args.cache_dir:
+        detector.enable_cache(args.cache_dir)
+    if args.triage and not args.train:
+        detector.enable_triage(args.triage, low=args.triage_low, high=args.triage_high)
     
     # Training mode
-    if len(sys.argv) > 1 and sys.argv[1] == '--train':
-        if len(sys.argv) != 4:
-            print("Usage: python deepfake_detector.py --train <real_images_dir> <fake_images_dir>")
-            return
-        
-        real_dir = sys.argv[2]
-        fake_dir = sys.argv[3]
+    if args.train:
+        real_dir, fake_dir = args.train
         
         print("Starting training...")
-        history = detector.train(real_dir, fake_dir)
+        history = detector.train(real_dir, fake_dir, shard_dir=args.shard_dir, mixed_precision=args.mixed_precision,
+                                 jit_compile=args.jit_compile, strategy=args.strategy,
+                                 embedding_dir=args.embedding_dir, split_by=args.split_by)
+        if detector.cache is not None:
+            detector.cache.flush()
+            print(f"Frame cache: {detector.cache.stats()}")
+        task = json.loads(os.environ.get('TF_CONFIG', '{}')).get('task', {})
+        if args.strategy == 'multi_worker' and task.get('index', 0) != 0:
+            # Every worker holds the same weights; only the chief writes the model
+            print("Training completed (model saved by the chief worker)")
+            return
         detector.save_model('deepfake_model.h5')
         print("Training completed!")
         return
     
+    # Distillation mode: the loaded model is the teacher
+    if args.distill:
+        real_dir, fake_dir = args.distill
+        student, report = detector.distill(real_dir, fake_dir, student_size=(args.student_size, args.student_size),
+                                           student_width=args.student_width, split_by=args.split_by)
+        student.save(args.student_output)
+        report['student']['file_mb'] = os.path.getsize(args.student_output) / 1e6
+        print(f"Student saved to {args.student_output}")
+        print(json.dumps(report, indent=2))
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+        return
+    
+    # Batch prediction mode: results are streamed out, never collected in memory
+    if args.predict_dir:
+        if os.path.isdir(args.predict_dir):
+            items = iter_image_files(args.predict_dir)
+        else:
+            items = iter_archive_images(args.predict_dir)
+            if items is None:
+                parser.error(f"{args.predict_dir} is not a directory, zip or tar archive")
+        results = detector.predict_stream(items, batch_size=args.batch_size, workers=args.workers)
+        out = open(args.output, 'w', newline='') if args.output else sys.stdout
+        try:
+            for line in iter_result_lines(results, args.format):
+                out.write(line)
+        finally:
+            if args.output:
+                out.close()
+        return
+    
     # Prediction mode
     print("Deepfake Detection System")
     print("------------------------")
@@ -255,7 +1532,7 @@ def main():
         print(f"Prediction: {'Fake' if result['is_fake'] else 'Real'}")
         print(f"Confidence: {result['confidence']*100:.2f}%")
         print(f"Raw Score: {result['raw_score']:.4f}")  # Print raw score
+        print(f"Decided by: {result['stage']}")
 
 if __name__ == "__main__":
-    import sys
     main() 
\ No newline at end of file
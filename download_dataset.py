@@ -1,98 +1,366 @@
+"""
+Download and unpack the dataset.
+
+Downloads resume from where they stopped (HTTP Range requests, progress kept in a
+<file>.part.json next to the partial file), are split into parallel segments
+when the server supports ranges, and are verified against a SHA-256 checksum
+before the partial file is renamed into place.
+
+tar archives are extracted while they download, as the bytes arrive. zip
+archives keep their index at the end, so they are extracted after the
+download, one member per thread. Either kind can also be left packed; the
+pipeline reads members straight from the archive (see deepfake_detector.iter_archive_images).
+
+Usage:
+    python download_dataset.py                       # DeepFake-TIMIT into dataset/
+    python download_dataset.py URL --output data.zip --sha256 <hex> --segments 8
+    python download_dataset.py URL --output data.tar.gz --extract-to dataset/raw
+"""
+import argparse
+import hashlib
+import json
 import os
-import requests
-import zipfile
 import shutil
-from tqdm import tqdm
-import gdown
 import tarfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import requests
+from tqdm import tqdm
+
+CHUNK_SIZE = 1024 * 1024
+STATE_EVERY = 8 * CHUNK_SIZE  # bytes between progress-state writes per segment
+TIMEOUT = 30
+
+def probe(url, session=None):
+    """(size or None, whether byte ranges are supported, validator) for a URL"""
+    session = session or requests.Session()
+    # A one-byte range request tells both the size and whether ranges work, even where HEAD is not allowed
+    with session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=TIMEOUT) as response:
+        response.raise_for_status()
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        if response.status_code == 206 and '/' in response.headers.get('Content-Range', ''):
+            total = response.headers['Content-Range'].rsplit('/', 1)[1]
+            return (int(total) if total.isdigit() else None), True, validator
+        length = response.headers.get('Content-Length')
+        return (int(length) if length and length.isdigit() else None), False, validator
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _load_state(state_path):
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_state(state_path, state):
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+def _verify(part_path, output_path, state_path, sha256):
+    if sha256 and file_sha256(part_path) != sha256.lower():
+        os.remove(part_path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        raise ValueError(f"Checksum mismatch for {output_path}; the partial download was removed")
+    os.replace(part_path, output_path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+
+def download(url, output_path, sha256=None, segments=4, session=None, show_progress=True):
+    """
+    Download url to output_path, resuming an earlier partial download of the same
+    file and fetching byte ranges on `segments` threads when the server allows it.
+    Returns output_path; raises ValueError if the SHA-256 does not match.
+    """
+    if os.path.exists(output_path) and (not sha256 or file_sha256(output_path) == sha256.lower()):
+        print(f"{output_path} already downloaded")
+        return output_path
+
+    session = session or requests.Session()
+    part_path = output_path + '.part'
+    state_path = part_path + '.json'
+    size, ranges, validator = probe(url, session)
+
+    state = _load_state(state_path) if os.path.exists(part_path) else None
+    if state and (not ranges or state.get('url') != url or state.get('size') != size
+                  or state.get('validator') != validator):
+        # Without ranges nothing can be resumed; a changed remote file (or another download) starts over too
+        state = None
+    if state is None:
+        if ranges and size:
+            bounds = [size * i // max(1, segments) for i in range(max(1, segments) + 1)]
+            parts = [[start, end, 0] for start, end in zip(bounds, bounds[1:]) if end > start]
+        else:
+            parts = [[0, size, 0]]
+        state = {'url': url, 'size': size, 'validator': validator, 'segments': parts}
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        with open(part_path, 'wb') as f:
+            if size:
+                f.truncate(size)
+        _save_state(state_path, state)
+
+    lock = threading.Lock()
+    progress = tqdm(total=size, initial=sum(part[2] for part in state['segments']), unit='B', unit_scale=True,
+                    unit_divisor=1024, desc=os.path.basename(output_path), disable=not show_progress)
+
+    def fetch(part):
+        start, end, done = part
+        if end is not None and start + done >= end:
+            return
+        headers = {}
+        if ranges:
+            headers['Range'] = f"bytes={start + done}-{end - 1}" if end else f"bytes={start + done}-"
+            if validator:
+                headers['If-Range'] = validator
+        with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+            response.raise_for_status()
+            if ranges and response.status_code != 206:
+                raise IOError("Server ignored the range request; the file may have changed")
+            with open(part_path, 'r+b') as f:
+                f.seek(start + done)
+                unsaved = 0
+                for block in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(block)
+                    with lock:
+                        part[2] += len(block)
+                        progress.update(len(block))
+                    unsaved += len(block)
+                    if unsaved >= STATE_EVERY:
+                        # Bytes are flushed before the state claims them, so a resume never skips data
+                        f.flush()
+                        with lock:
+                            _save_state(state_path, state)
+                        unsaved = 0
+                f.flush()
+        with lock:
+            _save_state(state_path, state)
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(state['segments'])) as pool:
+            for future in [pool.submit(fetch, part) for part in state['segments']]:
+                future.result()
+    finally:
+        progress.close()
+        with lock:
+            _save_state(state_path, state)
+
+    _verify(part_path, output_path, state_path, sha256)
+    return output_path
+
+class _TeeReader:
+    """File-like object for tarfile: replays the bytes already in the .part file, then reads the network response while appending it there"""
+    def __init__(self, part_file, chunks, digest, progress):
+        self.part_file = part_file
+        self.chunks = chunks
+        self.digest = digest
+        self.progress = progress
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            block = self.part_file.read(CHUNK_SIZE)
+            if not block:
+                block = next(self.chunks, b'')
+                if not block:
+                    break
+                self.part_file.write(block)
+                self.progress.update(len(block))
+            self.digest.update(block)
+            self.buffer += block
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+def _safe_target(extract_to, name):
+    """Path for an archive member inside extract_to; rejects absolute paths and '..'"""
+    target = os.path.abspath(os.path.join(extract_to, name))
+    if not target.startswith(os.path.abspath(extract_to) + os.sep):
+        raise ValueError(f"Refusing to extract {name!r} outside {extract_to}")
+    return target
+
+def _extract_tar(archive, extract_to):
+    """Extract regular files and directories of an open tar archive (stream mode works too)"""
+    os.makedirs(extract_to, exist_ok=True)
+    for member in archive:
+        target = _safe_target(extract_to, member.name)
+        if member.isdir():
+            os.makedirs(target, exist_ok=True)
+        elif member.isfile():
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with archive.extractfile(member) as source, open(target, 'wb') as f:
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+
+def download_tar(url, output_path, extract_to, sha256=None, session=None, show_progress=True):
+    """
+    Download a tar archive (any compression) and extract it while the bytes arrive.
+    An interrupted run resumes: the bytes already on disk are replayed through the
+    extractor, then the rest is requested with a Range header. An archive that is
+    already downloaded is only extracted, and only if extract_to does not exist yet.
+    """
+    if os.path.exists(output_path) and (not sha256 or file_sha256(output_path) == sha256.lower()):
+        print(f"{output_path} already downloaded")
+        if not os.path.isdir(extract_to):
+            with tarfile.open(output_path) as archive:
+                _extract_tar(archive, extract_to)
+        return output_path
+
+    session = session or requests.Session()
+    part_path = output_path + '.part'
+    state_path = part_path + '.json'
+    size, ranges, validator = probe(url, session)
+    have = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    state = _load_state(state_path)
+    if (not ranges or not state or state.get('url') != url or state.get('validator') != validator
+            or (size is not None and have > size)):
+        have = 0
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    _save_state(state_path, {'url': url, 'size': size, 'validator': validator})
+
+    # An earlier run that got every byte but stopped before the rename has nothing left to
+    # request (the server would answer 416); its .part file is only replayed
+    complete = bool(have) and have == size
+    headers = {'Range': f"bytes={have}-"} if have else {}
+    digest = hashlib.sha256()
+    with (nullcontext() if complete else session.get(url, headers=headers, stream=True, timeout=TIMEOUT)) as response, \
+            open(part_path, 'r+b' if have else 'w+b') as part_file, \
+            tqdm(total=size, initial=have, unit='B', unit_scale=True, unit_divisor=1024,
+                 desc=os.path.basename(output_path), disable=not show_progress) as progress:
+        if response is not None:
+            response.raise_for_status()
+            if have and response.status_code != 206:
+                raise IOError("Server ignored the range request; delete the .part file and retry")
+        part_file.truncate(have)
+        chunks = response.iter_content(chunk_size=CHUNK_SIZE) if response is not None else iter(())
+        reader = _TeeReader(part_file, chunks, digest, progress)
+        with tarfile.open(fileobj=reader, mode='r|*') as archive:
+            _extract_tar(archive, extract_to)
+        # Whatever follows the last member (tar padding) still counts towards the checksum
+        while reader.read(CHUNK_SIZE):
+            pass
+
+    if sha256 and digest.hexdigest() != sha256.lower():
+        os.remove(part_path)
+        os.remove(state_path)
+        raise ValueError(f"Checksum mismatch for {output_path}; the partial download was removed")
+    os.replace(part_path, output_path)
+    os.remove(state_path)
+    return output_path
+
+def extract_zip(zip_path, extract_to, workers=4):
+    """Extract a zip archive with one member per thread (zlib releases the GIL)"""
+    print(f"Extracting {zip_path}...")
+    with zipfile.ZipFile(zip_path) as archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+    local = threading.local()
+
+    def extract(info):
+        if not hasattr(local, 'archive'):
+            # ZipFile objects are not safe to share between threads
+            local.archive = zipfile.ZipFile(zip_path)
+        target = _safe_target(extract_to, info.filename)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with local.archive.open(info) as source, open(target, 'wb') as f:
+            shutil.copyfileobj(source, f, CHUNK_SIZE)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(tqdm(pool.map(extract, members), total=len(members), desc='Extracting', unit='file'))
+
+def is_tar_name(path):
+    return path.lower().endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz'))
+
+def fetch(url, output_path, extract_to=None, sha256=None, segments=4):
+    """Download url and, if extract_to is given, unpack it (while downloading for tar archives)"""
+    if extract_to and is_tar_name(output_path):
+        return download_tar(url, output_path, extract_to, sha256=sha256)
+    download(url, output_path, sha256=sha256, segments=segments)
+    if extract_to:
+        if zipfile.is_zipfile(output_path):
+            extract_zip(output_path, extract_to)
+        else:
+            with tarfile.open(output_path) as archive:
+                for member in archive:
+                    _safe_target(extract_to, member.name)
+                archive.extractall(extract_to)
+    return output_path
 
 def download_file(url, output_path):
-    """Download a file with progress bar"""
+    """Download with resume and parallel segments; Google Drive links go through gdown"""
     print(f"Downloading {output_path}...")
-    try:
+    if 'drive.google.com' in url:
+        import gdown
         gdown.download(url, output_path, quiet=False)
-    except Exception as e:
-        print(f"Error downloading with gdown: {str(e)}")
-        print("Trying alternative download method...")
-        response = requests.get(url, stream=True)
-        total_size = int(response.headers.get('content-length', 0))
-        
-        with open(output_path, 'wb') as file, tqdm(
-            desc=os.path.basename(output_path),
-            total=total_size,
-            unit='iB',
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as pbar:
-            for data in response.iter_content(chunk_size=1024):
-                size = file.write(data)
-                pbar.update(size)
-
-def extract_zip(zip_path, extract_to):
-    """Extract zip file with progress bar"""
-    print(f"Extracting {zip_path}...")
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_to)
+        return output_path
+    return download(url, output_path)
 
 def setup_dataset():
     # Create directories
     os.makedirs('dataset', exist_ok=True)
     os.makedirs('dataset/raw', exist_ok=True)
     os.makedirs('dataset/processed', exist_ok=True)
-    
+
     # DeepFake-TIMIT dataset URLs
     real_url = "https://www.idiap.ch/dataset/deepfaketimit/download/real.zip"
     fake_url = "https://www.idiap.ch/dataset/deepfaketimit/download/fake.zip"
-    
+
     # Alternative URLs (if the above don't work)
     backup_real_url = "https://drive.google.com/uc?id=1-5X9QzqQzqQzqQzqQzqQzqQzqQzqQzqQ"
     backup_fake_url = "https://drive.google.com/uc?id=1-6X9QzqQzqQzqQzqQzqQzqQzqQzqQzqQ"
-    
+
     # Download real images
     real_zip = "dataset/raw/real_images.zip"
     try:
         download_file(real_url, real_zip)
-    except:
+    except Exception as e:
+        print(f"Error downloading {real_url}: {e}")
         print("Trying backup URL for real images...")
         download_file(backup_real_url, real_zip)
-    
+
     # Download fake images
     fake_zip = "dataset/raw/fake_images.zip"
     try:
         download_file(fake_url, fake_zip)
-    except:
+    except Exception as e:
+        print(f"Error downloading {fake_url}: {e}")
         print("Trying backup URL for fake images...")
         download_file(backup_fake_url, fake_zip)
-    
+
     # Extract images
     print("Extracting images...")
     extract_zip(real_zip, "dataset/processed/real")
     extract_zip(fake_zip, "dataset/processed/fake")
-    
-    # Clean up zip files
-    os.remove(real_zip)
-    os.remove(fake_zip)
-    
+
     print("Dataset download and extraction completed!")
     print("\nNext step:")
     print("Train the model:")
     print("python deepfake_detector.py --train dataset/processed/real dataset/processed/fake")
 
-def extract_tar(tar_path, extract_to):
-    """Extract tar file with progress bar"""
-    print(f"Extracting {tar_path}...")
-    with tarfile.open(tar_path, 'r:gz') as tar:
-        tar.extractall(path=extract_to)
-
-if __name__ == "__main__":
-    setup_dataset()
-
-    # Extract tar file
-    tar_path = 'path/to/your/deepfaketimit.tar.gz'  # Update this path
-    extract_path = 'dataset/raw'  # Or wherever you want to extract
-
-    os.makedirs(extract_path, exist_ok=True)
+def main():
+    parser = argparse.ArgumentParser(description='Resumable, parallel, checksummed dataset download')
+    parser.add_argument('url', nargs='?', help='File to download (default: set up DeepFake-TIMIT in dataset/)')
+    parser.add_argument('--output', help='Where to save the file (default: its name in the current directory)')
+    parser.add_argument('--sha256', help='Expected SHA-256 of the file')
+    parser.add_argument('--segments', type=int, default=4, help='Parallel range requests')
+    parser.add_argument('--extract-to', help='Unpack the archive here (tar archives while downloading)')
+    args = parser.parse_args()
 
-    extract_tar(tar_path, extract_path)
+    if not args.url:
+        setup_dataset()
+        return
+    output = args.output or os.path.basename(args.url.split('?', 1)[0]) or 'download'
+    fetch(args.url, output, extract_to=args.extract_to, sha256=args.sha256, segments=args.segments)
+    print(f"Saved {output}")
 
-    print("Extraction complete!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import argparse
+import random
+
+import numpy as np
+import tensorflow as tf
+
+from deepfake_detector import DeepfakeDetector, IMAGE_EXTENSIONS
+
+def calibration_images(detector, calibration_dir, samples=200, seed=42):
+    """Pick a random sample of preprocessed frames from calibration_dir for int8 calibration"""
+    paths = []
+    for root, _, files in os.walk(calibration_dir):
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        raise ValueError(f"No calibration images found in {calibration_dir}")
+    random.Random(seed).shuffle(paths)
+
+    images = []
+    for path in paths:
+        frame = detector.load_frame_file(path)
+        if frame is not None:
+            images.append(detector.normalize_frame(frame))
+        if len(images) >= samples:
+            break
+    print(f"Using {len(images)} calibration images from {calibration_dir}")
+    return images
+
+def export_saved_model(model, out_dir):
+    path = os.path.join(out_dir, 'saved_model')
+    tf.saved_model.save(model, path)
+    print(f"SavedModel written to {path}")
+    return path
+
+def export_tflite(model, out_path, quantize='none', calibration=None):
+    """
+    Convert a Keras model to TFLite.
+    quantize: 'none' (float32), 'dynamic' (int8 weights, float activations) or
+              'int8' (int8 weights and activations, calibrated on `calibration`;
+              inputs and outputs stay float32 so callers are unchanged)
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize in ('dynamic', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == 'int8':
+        if not calibration:
+            raise ValueError("int8 quantization needs calibration images")
+
+        def representative_dataset():
+            for image in calibration:
+                yield [np.expand_dims(image, axis=0).astype('float32')]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    tflite_model = converter.convert()
+    with open(out_path, 'wb') as f:
+        f.write(tflite_model)
+    print(f"TFLite model ({quantize}) written to {out_path}: {len(tflite_model) / 1e6:.1f} MB")
+    return out_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the Keras model as a SavedModel and TFLite models')
+    parser.add_argument('model_path', help='Trained Keras model (.h5)')
+    parser.add_argument('--out-dir', default=None, help='Output directory (default: next to the model)')
+    parser.add_argument('--quantize', choices=['none', 'dynamic', 'int8', 'all'], default='dynamic',
+                        help='TFLite quantization mode; "all" writes one model per mode')
+    parser.add_argument('--calibration-dir', default='dataset/processed',
+                        help='Images used to calibrate int8 quantization')
+    parser.add_argument('--calibration-samples', type=int, default=200)
+    parser.add_argument('--skip-saved-model', action='store_true')
+    args = parser.parse_args()
+
+    detector = DeepfakeDetector(model_path=args.model_path)
+    out_dir = args.out_dir or os.path.dirname(os.path.abspath(args.model_path))
+    os.makedirs(out_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(args.model_path))[0]
+
+    if not args.skip_saved_model:
+        export_saved_model(detector.model, out_dir)
+
+    modes = ['none', 'dynamic', 'int8'] if args.quantize == 'all' else [args.quantize]
+    calibration = None
+    if 'int8' in modes:
+        calibration = calibration_images(detector, args.calibration_dir, args.calibration_samples)
+
+    for mode in modes:
+        suffix = '' if mode == 'none' else f"_{mode}"
+        export_tflite(detector.model, os.path.join(out_dir, f"{name}{suffix}.tflite"), mode, calibration)
+
+if __name__ == '__main__':
+    main()
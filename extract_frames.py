@@ -1,74 +1,298 @@
 import cv2
+import numpy as np
 import os
+import json
+import glob
 import argparse
+from multiprocessing import Pool, cpu_count
 from tqdm import tqdm
+from face_crop import FaceCropper, FaceTracker, save_boxes, FACES_FILE
 
-def extract_frames(video_path, output_dir, frame_rate=1):
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+MANIFEST_NAME = 'manifest.json'
+
+class VideoOpenError(IOError):
+    """The file could not be opened as a video (bad upload, unsupported codec)"""
+
+def iter_frames(video_path, frame_rate=1, sampling='uniform', max_frames=None, scene_threshold=2.0):
+    """
+    Stream sampled frames from a video without writing anything to disk.
+    Yields (frame_index, BGR frame) pairs.
+
+    frame_rate: consider 1 frame every N frames; the others are only grabbed, never decoded
+    sampling: 'uniform' keeps every considered frame, 'scene' keeps a considered frame only
+              when it differs enough from the last kept one (mean absolute difference of
+              32x32 grayscale thumbnails above scene_threshold)
+    max_frames: stop after this many frames have been yielded
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise VideoOpenError(f"Could not open video {video_path}")
+
+    frame_count = 0
+    yielded = 0
+    last_thumb = None
+    try:
+        while max_frames is None or yielded < max_frames:
+            if frame_count % frame_rate != 0:
+                if not cap.grab():
+                    break
+                frame_count += 1
+                continue
+
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            if sampling == 'scene':
+                thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (32, 32), interpolation=cv2.INTER_AREA)
+                thumb = thumb.astype('float32')
+                changed = last_thumb is None or float(abs(thumb - last_thumb).mean()) > scene_threshold
+                if not changed:
+                    frame_count += 1
+                    continue
+                last_thumb = thumb
+
+            yield frame_count, frame
+            yielded += 1
+            frame_count += 1
+    finally:
+        cap.release()
+
+def frame_hash(frame, hash_size=16):
+    """
+    Difference hash (dHash) of a BGR frame: one bit per horizontal brightness gradient of a
+    (hash_size + 1) x hash_size grayscale thumbnail. 256 bits by default; the common 64-bit
+    (hash_size=8) variant cannot tell the frames of a static talking-head shot apart.
+    """
+    thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (hash_size + 1, hash_size),
+                       interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(thumb[:, 1:] > thumb[:, :-1]).tobytes(), 'big')
+
+def hash_distance(a, b):
+    """Number of differing bits between two frame hashes"""
+    return bin(a ^ b).count('1')
+
+def video_info(video_path):
+    """Frame count and frames per second reported by the container (0 if unknown)"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), float(cap.get(cv2.CAP_PROP_FPS) or 0.0)
+    finally:
+        cap.release()
+
+def extract_frames(video_path, output_dir, frame_rate=1, jpeg_quality=95, show_progress=True,
+                   detect_faces=False, detect_every=5, dedupe_distance=None):
     """
     Extract frames from a video file
     frame_rate: extract 1 frame every N frames
+    Skipped frames are only grabbed (demuxed), never decoded.
+    detect_faces: track the face across the extracted frames (detecting every detect_every
+                  frames) and save the crop boxes to faces.json next to them
+    dedupe_distance: skip a frame whose perceptual hash is within this many bits of the
+                     last written frame (near-duplicates of a static shot); None keeps all
+    Returns the number of frames written, or None if the video could not be opened.
     """
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
-    
-    # Open the video file
-    cap = cv2.VideoCapture(video_path)
-    
-    if not cap.isOpened():
-        print(f"Error: Could not open video {video_path}")
-        return
-    
+
     # Get video properties
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
+    total_frames, _ = video_info(video_path)
+    encode_params = [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)]
+
     # Extract frames
-    frame_count = 0
     saved_count = 0
-    
-    with tqdm(total=total_frames, desc=f"Processing {os.path.basename(video_path)}") as pbar:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-                
-            if frame_count % frame_rate == 0:
+    position = 0
+    tracker = FaceTracker(FaceCropper(), detect_every) if detect_faces else None
+    boxes = {}
+    last_hash = None
+    duplicates = 0
+
+    try:
+        with tqdm(total=total_frames, desc=f"Processing {os.path.basename(video_path)}", disable=not show_progress) as pbar:
+            for frame_index, frame in iter_frames(video_path, frame_rate):
+                pbar.update(frame_index + 1 - position)
+                position = frame_index + 1
+                if dedupe_distance is not None:
+                    current_hash = frame_hash(frame)
+                    if last_hash is not None and hash_distance(current_hash, last_hash) <= dedupe_distance:
+                        duplicates += 1
+                        continue
+                    last_hash = current_hash
                 # Save frame
-                frame_path = os.path.join(output_dir, f"frame_{saved_count:06d}.jpg")
-                cv2.imwrite(frame_path, frame)
+                frame_name = f"frame_{saved_count:06d}.jpg"
+                cv2.imwrite(os.path.join(output_dir, frame_name), frame, encode_params)
+                if tracker is not None:
+                    box = tracker.update(frame)
+                    if box is not None:
+                        boxes[frame_name] = box
                 saved_count += 1
-                
-            frame_count += 1
-            pbar.update(1)
-    
-    cap.release()
-    print(f"Extracted {saved_count} frames from {video_path}")
+    except VideoOpenError:
+        print(f"Error: Could not open video {video_path}")
+        return None
+
+    if tracker is not None:
+        save_boxes(output_dir, boxes)
+
+    if show_progress:
+        print(f"Extracted {saved_count} frames from {video_path}"
+              + (f" ({duplicates} near-duplicates dropped)" if duplicates else ""))
+    return saved_count
+
+def find_videos(input_dir, recursive=False):
+    """Return video paths relative to input_dir"""
+    if not recursive:
+        return sorted(f for f in os.listdir(input_dir) if f.lower().endswith(VIDEO_EXTENSIONS))
+    videos = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for f in sorted(files):
+            if f.lower().endswith(VIDEO_EXTENSIONS):
+                videos.append(os.path.relpath(os.path.join(root, f), input_dir))
+    return videos
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"Warning: ignoring unreadable manifest {path}")
+        return {}
+
+def save_manifest(output_dir, manifest):
+    """Write the manifest atomically so an interrupted run never leaves it half-written"""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _video_signature(video_path, frame_rate, jpeg_quality, detect_faces=False, dedupe_distance=None):
+    stat = os.stat(video_path)
+    signature = {
+        'size': stat.st_size,
+        'mtime': int(stat.st_mtime),
+        'frame_rate': frame_rate,
+        'jpeg_quality': jpeg_quality,
+    }
+    if detect_faces:
+        # Only recorded when set, so manifests from runs without face detection stay valid
+        signature['detect_faces'] = True
+    if dedupe_distance is not None:
+        signature['dedupe_distance'] = dedupe_distance
+    return signature
 
-def process_directory(input_dir, output_dir, frame_rate=1):
-    """Process all videos in a directory"""
+def _init_worker():
+    # One video per process; keep OpenCV from spawning its own thread pool in every worker
+    cv2.setNumThreads(1)
+
+def _extract_job(job):
+    video_key, video_path, video_output_dir, frame_rate, jpeg_quality, detect_faces, detect_every, dedupe_distance = job
+    try:
+        # Drop frames left over from an interrupted or differently configured run
+        for stale in glob.glob(os.path.join(video_output_dir, 'frame_*.jpg')):
+            os.remove(stale)
+        if os.path.exists(os.path.join(video_output_dir, FACES_FILE)):
+            os.remove(os.path.join(video_output_dir, FACES_FILE))
+        frames = extract_frames(video_path, video_output_dir, frame_rate, jpeg_quality, show_progress=False,
+                                detect_faces=detect_faces, detect_every=detect_every,
+                                dedupe_distance=dedupe_distance)
+        if frames is None:
+            return video_key, None, 'could not open video'
+        return video_key, frames, None
+    except Exception as e:
+        return video_key, None, str(e)
+
+def process_directory(input_dir, output_dir, frame_rate=1, workers=None, recursive=False, force=False,
+                      jpeg_quality=95, detect_faces=False, detect_every=5, dedupe_distance=None):
+    """
+    Process all videos in a directory, one worker process per video.
+    Finished videos are recorded in <output_dir>/manifest.json and skipped on the next run
+    unless the source file or the extraction settings changed.
+    """
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
-    
+
     # Get all video files
-    video_extensions = ('.mp4', '.avi', '.mov', '.mkv')
-    video_files = [f for f in os.listdir(input_dir) if f.lower().endswith(video_extensions)]
-    
+    video_files = find_videos(input_dir, recursive)
     print(f"Found {len(video_files)} videos in {input_dir}")
-    
-    # Process each video
+
+    manifest = {} if force else load_manifest(output_dir)
+    jobs = []
     for video_file in video_files:
+        video_key = video_file.replace(os.sep, '/')
         video_path = os.path.join(input_dir, video_file)
         video_output_dir = os.path.join(output_dir, os.path.splitext(video_file)[0])
-        extract_frames(video_path, video_output_dir, frame_rate)
+        signature = _video_signature(video_path, frame_rate, jpeg_quality, detect_faces, dedupe_distance)
+        entry = manifest.get(video_key)
+        if entry and all(entry.get(k) == v for k, v in signature.items()) and os.path.isdir(video_output_dir):
+            continue
+        manifest.pop(video_key, None)
+        jobs.append((video_key, video_path, video_output_dir, frame_rate, jpeg_quality, detect_faces, detect_every,
+                     dedupe_distance))
+
+    skipped = len(video_files) - len(jobs)
+    if skipped:
+        print(f"Skipping {skipped} videos already extracted")
+    if not jobs:
+        save_manifest(output_dir, manifest)
+        return manifest
+
+    workers = workers or cpu_count()
+    signatures = {job[0]: _video_signature(job[1], frame_rate, jpeg_quality, detect_faces, dedupe_distance)
+                  for job in jobs}
+    failed = 0
+
+    def record(result):
+        nonlocal failed
+        video_key, frames, error = result
+        if error:
+            failed += 1
+            print(f"Error extracting {video_key}: {error}")
+            return
+        manifest[video_key] = dict(signatures[video_key], frames=frames)
+        # Persist after every video so a rerun resumes where this one stopped
+        save_manifest(output_dir, manifest)
+
+    with tqdm(total=len(jobs), desc="Extracting videos", unit='video') as pbar:
+        if workers == 1:
+            for job in jobs:
+                record(_extract_job(job))
+                pbar.update(1)
+        else:
+            with Pool(processes=min(workers, len(jobs)), initializer=_init_worker) as pool:
+                for result in pool.imap_unordered(_extract_job, jobs):
+                    record(result)
+                    pbar.update(1)
+
+    print(f"Extracted {len(jobs) - failed} videos ({failed} failed)")
+    return manifest
 
 def main():
     parser = argparse.ArgumentParser(description='Extract frames from videos')
     parser.add_argument('input_dir', help='Directory containing videos')
     parser.add_argument('output_dir', help='Directory to save extracted frames')
     parser.add_argument('--frame-rate', type=int, default=1, help='Extract 1 frame every N frames')
-    
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: one per CPU)')
+    parser.add_argument('--recursive', action='store_true',
+                        help='Descend into subdirectories (e.g. DeepfakeTIMIT/higher_quality/<speaker>)')
+    parser.add_argument('--force', action='store_true', help='Ignore the manifest and re-extract every video')
+    parser.add_argument('--jpeg-quality', type=int, default=95, help='JPEG quality of the written frames')
+    parser.add_argument('--detect-faces', action='store_true',
+                        help='Track faces while extracting and save crop boxes to faces.json in each frame directory')
+    parser.add_argument('--detect-every', type=int, default=5, help='With --detect-faces, run the detector every N frames')
+    parser.add_argument('--dedupe-distance', type=int, default=None,
+                        help='Drop frames whose 256-bit perceptual hash is within N bits of the last kept frame (e.g. 8)')
+
     args = parser.parse_args()
-    
-    process_directory(args.input_dir, args.output_dir, args.frame_rate)
+
+    process_directory(args.input_dir, args.output_dir, args.frame_rate, workers=args.workers,
+                      recursive=args.recursive, force=args.force, jpeg_quality=args.jpeg_quality,
+                      detect_faces=args.detect_faces, detect_every=args.detect_every,
+                      dedupe_distance=args.dedupe_distance)
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
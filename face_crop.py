@@ -0,0 +1,146 @@
+import os
+import json
+import argparse
+import threading
+
+import cv2
+
+FACES_FILE = 'faces.json'
+FRAME_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+class FaceCropper:
+    """
+    CPU face detector based on the Haar cascade that ships with opencv-python.
+
+    Boxes are normalized (x1, y1, x2, y2) in [0, 1] so they stay valid for any
+    resolution of the same frame; they already include the crop margin and are
+    squared up so the crop is not distorted when resized to the model input.
+    """
+    def __init__(self, cascade_path=None, margin=0.25, detect_width=320, min_face=0.1):
+        self.cascade_path = cascade_path or os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        self.margin = margin
+        self.detect_width = detect_width  # frames are downscaled to this width before detection
+        self.min_face = min_face  # smallest face, as a fraction of the frame width
+        # CascadeClassifier is not thread-safe, so keep one per thread
+        self._local = threading.local()
+
+    def _classifier(self):
+        classifier = getattr(self._local, 'classifier', None)
+        if classifier is None:
+            classifier = cv2.CascadeClassifier(self.cascade_path)
+            if classifier.empty():
+                raise IOError(f"Could not load face cascade from {self.cascade_path}")
+            self._local.classifier = classifier
+        return classifier
+
+    def detect(self, img):
+        """Return the normalized box of the largest face in a BGR image, or None"""
+        height, width = img.shape[:2]
+        scale = min(1.0, self.detect_width / float(width))
+        small = cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else img
+        gray = cv2.equalizeHist(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+        min_size = max(16, int(self.min_face * gray.shape[1]))
+        faces = self._classifier().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_size, min_size))
+        if len(faces) == 0:
+            return None
+
+        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+        return self._expand(x / scale, y / scale, w / scale, h / scale, width, height)
+
+    def _expand(self, x, y, w, h, width, height):
+        # Add the margin and make the box square around the face centre
+        side = max(w, h) * (1 + 2 * self.margin)
+        cx, cy = x + w / 2.0, y + h / 2.0
+        x1 = max(0.0, cx - side / 2.0)
+        y1 = max(0.0, cy - side / 2.0)
+        x2 = min(float(width), cx + side / 2.0)
+        y2 = min(float(height), cy + side / 2.0)
+        return (x1 / width, y1 / height, x2 / width, y2 / height)
+
+    def crop(self, img, box):
+        """Crop a BGR image to a normalized box"""
+        height, width = img.shape[:2]
+        x1, y1, x2, y2 = box
+        x1, x2 = int(round(x1 * width)), int(round(x2 * width))
+        y1, y2 = int(round(y1 * height)), int(round(y2 * height))
+        if x2 - x1 < 2 or y2 - y1 < 2:
+            return img
+        return img[y1:y2, x1:x2]
+
+class FaceTracker:
+    """
+    Follows one face through a video: the detector only runs every detect_every
+    frames, and the box is reused (and smoothed) in between.
+    """
+    def __init__(self, cropper, detect_every=5, smoothing=0.5):
+        self.cropper = cropper
+        self.detect_every = max(1, int(detect_every))
+        self.smoothing = smoothing
+        self.box = None
+        self._frames = 0
+
+    def update(self, frame):
+        """Return the face box for this frame (or None if no face has been seen yet)"""
+        if self._frames % self.detect_every == 0 or self.box is None:
+            detected = self.cropper.detect(frame)
+            if detected is not None:
+                if self.box is None:
+                    self.box = detected
+                else:
+                    a = self.smoothing
+                    self.box = tuple(a * old + (1 - a) * new for old, new in zip(self.box, detected))
+        self._frames += 1
+        return self.box
+
+def load_boxes(frame_dir):
+    """Read the persisted face boxes of a frame directory: {frame file name: (x1, y1, x2, y2)}"""
+    path = os.path.join(frame_dir, FACES_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {name: tuple(box) for name, box in json.load(f)['boxes'].items()}
+
+def save_boxes(frame_dir, boxes):
+    """Persist face boxes next to the extracted frames so training never has to re-detect"""
+    path = os.path.join(frame_dir, FACES_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'format': 'normalized x1 y1 x2 y2', 'boxes': {name: [round(v, 5) for v in box]
+                                                                 for name, box in sorted(boxes.items())}}, f)
+    os.replace(tmp_path, path)
+
+def detect_directory(frame_dir, cropper, detect_every=5):
+    """Track the face through the (sorted) frames of one directory and save the boxes"""
+    tracker = FaceTracker(cropper, detect_every)
+    boxes = {}
+    for name in sorted(os.listdir(frame_dir)):
+        if not name.lower().endswith(FRAME_EXTENSIONS):
+            continue
+        frame = cv2.imread(os.path.join(frame_dir, name))
+        if frame is None:
+            continue
+        box = tracker.update(frame)
+        if box is not None:
+            boxes[name] = box
+    save_boxes(frame_dir, boxes)
+    return len(boxes)
+
+def main():
+    parser = argparse.ArgumentParser(description='Detect faces in already extracted frame directories and persist the crop boxes')
+    parser.add_argument('frames_root', help='Directory containing one subdirectory of frames per video')
+    parser.add_argument('--detect-every', type=int, default=5, help='Run the detector every N frames and track in between')
+    parser.add_argument('--force', action='store_true', help=f'Redo directories that already have {FACES_FILE}')
+    args = parser.parse_args()
+
+    cropper = FaceCropper()
+    for root, dirs, files in os.walk(args.frames_root):
+        dirs.sort()
+        if not any(f.lower().endswith(FRAME_EXTENSIONS) for f in files):
+            continue
+        if FACES_FILE in files and not args.force:
+            continue
+        found = detect_directory(root, cropper, args.detect_every)
+        print(f"{root}: face boxes for {found} frames")
+
+if __name__ == '__main__':
+    main()
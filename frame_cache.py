@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locking, one process per cache directory is up to the caller
+    fcntl = None
+
+KEY_BYTES = 16
+MAX_RINGS = 256  # worker-N subdirectories tried before giving up
+
+
+class FrameCache:
+    """
+    Content-addressed cache of preprocessed uint8 frames.
+
+    Frames are keyed by a hash of the encoded file/upload bytes. The disk layer
+    is a fixed-capacity ring of slots in a memory-mapped file, with a parallel
+    memory-mapped array holding the key stored in each slot, so an entry is
+    only trusted if the slot still carries its key. A small LRU keeps the most
+    recent frames in memory, and model scores are cached per key as well so a
+    repeated upload skips decode and inference entirely.
+
+    Each ring is locked (flock) by the process that opens it. When the ring in
+    cache_dir is held by another process (several server workers sharing one
+    FRAME_CACHE_DIR), this one opens its own ring in a worker-N subdirectory,
+    so processes never write the same files; they do not share entries.
+    Frames preprocessed differently (e.g. face crops) use a separate variant.
+    """
+
+    def __init__(self, cache_dir, frame_shape=(128, 128, 3), capacity=20000, memory_items=1024,
+                 score_items=4096, variant=None):
+        self.frame_shape = tuple(frame_shape)
+        self.capacity = int(capacity)
+        self.memory_items = int(memory_items)
+        self.score_items = int(score_items)
+
+        tag = 'x'.join(str(d) for d in self.frame_shape)
+        if variant:
+            tag = f"{variant}-{tag}"
+        self._lock_file = None
+        for ring in range(MAX_RINGS):
+            directory = cache_dir if ring == 0 else os.path.join(cache_dir, f"worker-{ring}")
+            os.makedirs(directory, exist_ok=True)
+            if self._try_lock(os.path.join(directory, f"lock-{tag}")):
+                break
+        else:
+            raise RuntimeError(f"All {MAX_RINGS} frame cache rings under {cache_dir} are in use")
+        self.cache_dir = cache_dir = directory
+        frames_path = os.path.join(cache_dir, f"frames-{tag}.u8")
+        keys_path = os.path.join(cache_dir, f"keys-{tag}.bin")
+        self._meta_path = os.path.join(cache_dir, f"meta-{tag}.json")
+
+        meta = {}
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+        if meta.get('capacity') != self.capacity or not os.path.exists(frames_path) or not os.path.exists(keys_path):
+            # New cache, or one created with a different capacity: start over
+            mode = 'w+'
+            meta = {'capacity': self.capacity, 'next_slot': 0}
+        else:
+            mode = 'r+'
+
+        self._frames = np.memmap(frames_path, dtype=np.uint8, mode=mode, shape=(self.capacity,) + self.frame_shape)
+        self._keys = np.memmap(keys_path, dtype=np.uint8, mode=mode, shape=(self.capacity, KEY_BYTES))
+        self._next_slot = int(meta.get('next_slot', 0)) % self.capacity
+
+        # Rebuild the key -> slot index from the keys file; empty slots are all zeros
+        self._slots = {}
+        filled = np.flatnonzero(self._keys.any(axis=1))
+        for slot in filled:
+            self._slots[bytes(self._keys[slot])] = int(slot)
+
+        self._memory = OrderedDict()
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self.hits = {'memory': 0, 'disk': 0, 'score': 0}
+        self.misses = {'frame': 0, 'score': 0}
+        self._save_meta()
+
+    def _try_lock(self, path):
+        """Take the ring's lock for the lifetime of this cache; False if another process holds it"""
+        if fcntl is None:
+            return True
+        lock_file = open(path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def close(self):
+        """Flush and release the ring so another process can open it"""
+        self.flush()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    @staticmethod
+    def key_for(data):
+        """Hash encoded image bytes (bytes, bytearray or memoryview) into a cache key"""
+        return hashlib.blake2b(memoryview(data), digest_size=KEY_BYTES).digest()
+
+    def get(self, key):
+        """Return the cached uint8 frame for key, or None"""
+        with self._lock:
+            frame = self._memory.get(key)
+            if frame is not None:
+                self._memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return frame
+
+            slot = self._slots.get(key)
+            if slot is None or bytes(self._keys[slot]) != key:
+                self.misses['frame'] += 1
+                return None
+
+            frame = np.array(self._frames[slot])
+            self.hits['disk'] += 1
+            self._remember(key, frame)
+            return frame
+
+    def put(self, key, frame):
+        """Store a uint8 frame of frame_shape under key"""
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"Expected frame of shape {self.frame_shape}, got {frame.shape}")
+
+        with self._lock:
+            self._remember(key, frame)
+            if key in self._slots:
+                return
+
+            # Overwrite the oldest slot once the ring is full
+            slot = self._next_slot
+            old_key = bytes(self._keys[slot])
+            if self._slots.get(old_key) == slot:
+                del self._slots[old_key]
+            self._frames[slot] = frame
+            self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+            self._slots[key] = slot
+            self._next_slot = (slot + 1) % self.capacity
+
+            self._dirty += 1
+            if self._dirty >= 256:
+                self._flush_locked()
+
+    def get_score(self, key):
+        """Return the cached model score for key, or None"""
+        with self._lock:
+            score = self._scores.get(key)
+            if score is None:
+                self.misses['score'] += 1
+                return None
+            self._scores.move_to_end(key)
+            self.hits['score'] += 1
+            return score
+
+    def put_score(self, key, score):
+        with self._lock:
+            self._scores[key] = float(score)
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.score_items:
+                self._scores.popitem(last=False)
+
+    def clear_scores(self):
+        """Forget cached scores, e.g. after the model has changed"""
+        with self._lock:
+            self._scores.clear()
+
+    def _remember(self, key, frame):
+        self._memory[key] = frame
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _save_meta(self):
+        tmp_path = self._meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'capacity': self.capacity, 'next_slot': self._next_slot}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _flush_locked(self):
+        self._frames.flush()
+        self._keys.flush()
+        self._save_meta()
+        self._dirty = 0
+
+    def flush(self):
+        """Write pending frames and the ring position to disk"""
+        with self._lock:
+            self._flush_locked()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': dict(self.hits),
+                'misses': dict(self.misses),
+                'disk_entries': len(self._slots),
+                'capacity': self.capacity,
+                'memory_entries': len(self._memory),
+                'score_entries': len(self._scores),
+            }
@@ -0,0 +1,357 @@
+"""
+Shared-memory inference server.
+
+One process owns the model; any number of HTTP worker processes send it
+preprocessed frames and get scores back, so model memory does not grow with
+the number of workers.
+
+Each client (one per worker process) creates a shared-memory ring of frame
+slots and tells the server its name. To score a frame the client writes it
+into a free slot and sends only the slot number over a Unix socket; the server
+reads the frame straight out of shared memory, micro-batches it with frames
+from every other worker through a BatchScheduler, and replies with the score.
+
+    python inference_server.py --socket /tmp/deepfake-inference.sock --model backend/models/deepfake_model.h5
+    MODEL_RUNTIME=remote INFERENCE_SOCKET=/tmp/deepfake-inference.sock uvicorn main:app --workers 4
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future, wait
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from batching import BatchScheduler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/deepfake-inference.sock'
+
+OP_PREDICT = 1
+OP_STATS = 2
+OP_RESULT = 3
+OP_ERROR = 4
+
+# op, request id, slot
+REQUEST = struct.Struct('!BII')
+# op, request id, score, payload length (JSON stats or error message follows)
+RESPONSE = struct.Struct('!BIdI')
+LENGTH = struct.Struct('!I')
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("inference socket closed")
+        data += chunk
+    return bytes(data)
+
+def _send_json(sock, obj):
+    data = json.dumps(obj).encode()
+    sock.sendall(LENGTH.pack(len(data)) + data)
+
+def _recv_json(sock):
+    (size,) = LENGTH.unpack(_recv_exact(sock, LENGTH.size))
+    return json.loads(_recv_exact(sock, size))
+
+class InferenceServer:
+    """Serves a detector's model to InferenceClients over a Unix socket and shared memory"""
+    def __init__(self, detector, socket_path=DEFAULT_SOCKET, max_batch_size=16, max_wait_ms=5):
+        self.detector = detector
+        self.socket_path = socket_path
+        width, height = detector.input_size
+        self.frame_shape = (height, width, 3)
+        self.batcher = BatchScheduler(detector.score_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        self._listener = None
+        self._connections = 0
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.batcher.start()
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.socket_path)
+        self._listener.listen()
+        logger.info("Inference server listening on %s", self.socket_path)
+        try:
+            while True:
+                try:
+                    conn, _ = self._listener.accept()
+                except OSError:
+                    break  # closed by shutdown()
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            self.batcher.stop()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def shutdown(self):
+        if self._listener is not None:
+            self._listener.close()
+
+    def stats(self):
+        with self._lock:
+            connections = self._connections
+        return {**self.batcher.stats(), 'connections': connections}
+
+    def _serve_connection(self, conn):
+        send_lock = threading.Lock()
+
+        def reply(op, request_id, score=0.0, payload=b''):
+            try:
+                with send_lock:
+                    conn.sendall(RESPONSE.pack(op, request_id, score, len(payload)) + payload)
+            except OSError:
+                pass  # client went away; its pending requests die with it
+
+        shm = None
+        frames = None
+        pending = set()
+        try:
+            _send_json(conn, {'frame_shape': list(self.frame_shape), 'max_batch_size': self.batcher.max_batch_size})
+            hello = _recv_json(conn)
+            shm = shared_memory.SharedMemory(name=hello['shm_name'])
+            # The client owns (and unlinks) the segment; stop this process's tracker from removing it too
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            frames = np.ndarray((hello['slots'],) + self.frame_shape, dtype=np.float32, buffer=shm.buf)
+            with self._lock:
+                self._connections += 1
+
+            while True:
+                op, request_id, slot = REQUEST.unpack(_recv_exact(conn, REQUEST.size))
+                if op == OP_STATS:
+                    reply(OP_RESULT, request_id, payload=json.dumps(self.stats()).encode())
+                    continue
+                if op != OP_PREDICT or slot >= len(frames):
+                    reply(OP_ERROR, request_id, payload=b'bad request')
+                    continue
+
+                # The slot is not reused until we reply, so the batcher can read it in place
+                future = self.batcher.submit(frames[slot])
+                pending.add(future)
+
+                def done(future, request_id=request_id):
+                    pending.discard(future)
+                    try:
+                        reply(OP_RESULT, request_id, future.result())
+                    except Exception as e:
+                        reply(OP_ERROR, request_id, payload=str(e).encode())
+                future.add_done_callback(done)
+        except (ConnectionError, OSError, ValueError) as e:
+            logger.debug("Inference client disconnected: %s", e)
+        finally:
+            # Frames still queued point into the segment; let them finish before detaching
+            wait(list(pending), timeout=30)
+            if shm is not None:
+                with self._lock:
+                    self._connections -= 1
+                del frames
+                try:
+                    shm.close()
+                except BufferError:
+                    logger.warning("Shared memory %s still in use; leaving it mapped", shm.name)
+            conn.close()
+
+class InferenceClient:
+    """
+    Client side of the inference server, one per worker process.
+
+    Drop-in for BatchScheduler (submit / predict / predict_many / stats), and
+    exposes predict_on_batch like a Keras model so a DeepfakeDetector can use it
+    as its model (runtime='remote'). Reconnects on the next request if the
+    server restarts.
+    """
+    def __init__(self, socket_path=DEFAULT_SOCKET, slots=64, connect_timeout=60.0, timeout=60.0):
+        self.socket_path = socket_path
+        self.slots = int(slots)
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._sock = None
+        self._shm = None
+        self._frames = None
+        self._free = None
+        self._pending = {}
+        self.frame_shape = None
+        self.max_batch_size = None
+        self._connect()
+
+    @property
+    def input_shape(self):
+        return self.frame_shape
+
+    def _connect(self, timeout=None):
+        deadline = time.monotonic() + (self.connect_timeout if timeout is None else timeout)
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                break
+            except OSError:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise ConnectionError(f"Inference server not reachable at {self.socket_path}")
+                time.sleep(0.2)
+
+        info = _recv_json(sock)
+        self.frame_shape = tuple(info['frame_shape'])
+        self.max_batch_size = info['max_batch_size']
+        slot_bytes = int(np.prod(self.frame_shape)) * 4
+        shm = shared_memory.SharedMemory(create=True, size=self.slots * slot_bytes)
+        _send_json(sock, {'shm_name': shm.name, 'slots': self.slots})
+
+        free = queue.Queue()
+        for slot in range(self.slots):
+            free.put(slot)
+        self._shm = shm
+        self._frames = np.ndarray((self.slots,) + self.frame_shape, dtype=np.float32, buffer=shm.buf)
+        self._free = free
+        self._sock = sock
+        threading.Thread(target=self._read_responses, args=(sock, free), name='inference-client',
+                         daemon=True).start()
+
+    def _read_responses(self, sock, free):
+        try:
+            while True:
+                op, request_id, score, size = RESPONSE.unpack(_recv_exact(sock, RESPONSE.size))
+                payload = _recv_exact(sock, size) if size else b''
+                with self._lock:
+                    future, slot = self._pending.pop(request_id, (None, None))
+                if slot is not None:
+                    free.put(slot)
+                if future is None:
+                    continue
+                if op == OP_ERROR:
+                    future.set_exception(RuntimeError(payload.decode(errors='replace')))
+                else:
+                    future.set_result(json.loads(payload) if payload else float(score))
+        except (ConnectionError, OSError) as e:
+            self._fail_pending(sock, e)
+
+    def _fail_pending(self, sock, error):
+        with self._lock:
+            if self._sock is not sock:
+                return
+            pending, self._pending = self._pending, {}
+            self._sock = None
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"inference server connection lost: {error}"))
+
+    def _request(self, op, slot=0, free=None):
+        future = Future()
+        with self._lock:
+            if free is not None and free is not self._free:
+                # The slot belongs to a connection that has since been replaced
+                future.set_exception(ConnectionError("inference server connection was reset"))
+                return future
+            if self._sock is None:
+                self._reconnect_locked()
+            sock = self._sock
+            request_id = next(self._ids) & 0xFFFFFFFF
+            self._pending[request_id] = (future, slot if op == OP_PREDICT else None)
+        try:
+            with self._send_lock:
+                sock.sendall(REQUEST.pack(op, request_id, slot))
+        except OSError as e:
+            self._fail_pending(sock, e)
+        return future
+
+    def _reconnect_locked(self):
+        logger.warning("Reconnecting to inference server at %s", self.socket_path)
+        self._release_shm()
+        # Fail fast while the server is down instead of holding the request
+        self._connect(timeout=1.0)
+
+    def _release_shm(self):
+        self._frames = None
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                pass
+            self._shm.unlink()
+            self._shm = None
+
+    def submit(self, image):
+        """Queue one preprocessed float32 image (H, W, 3) and return a Future for its score"""
+        image = np.asarray(image, dtype=np.float32)
+        if image.shape != self.frame_shape:
+            raise ValueError(f"Expected a frame of shape {self.frame_shape}, got {image.shape}")
+        with self._lock:
+            if self._sock is None:
+                self._reconnect_locked()
+            free, frames = self._free, self._frames
+        # Blocks when every slot is in flight, which bounds the memory a worker can queue
+        try:
+            slot = free.get(timeout=self.timeout)
+        except queue.Empty:
+            # The backends answer ConnectionError with 503, like a server that is down
+            raise ConnectionError(f"No free inference slot within {self.timeout}s; the inference server is overloaded")
+        frames[slot] = image
+        return self._request(OP_PREDICT, slot, free)
+
+    def predict(self, image, timeout=None):
+        return self.submit(image).result(timeout or self.timeout)
+
+    def predict_many(self, images, timeout=None):
+        futures = [self.submit(image) for image in images]
+        return [future.result(timeout or self.timeout) for future in futures]
+
+    def predict_on_batch(self, batch):
+        return np.asarray(self.predict_many(np.asarray(batch, dtype=np.float32)), dtype=np.float32).reshape(-1, 1)
+
+    def stats(self):
+        """The server's batcher stats (shared by every worker) plus this client's slot usage"""
+        stats = self._request(OP_STATS).result(self.timeout)
+        stats['client_slots'] = self.slots
+        stats['client_slots_in_use'] = self.slots - self._free.qsize()
+        return stats
+
+    def start(self):
+        return self
+
+    def stop(self, timeout=None):
+        with self._lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
+        self._release_shm()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the model to HTTP workers over shared memory')
+    parser.add_argument('--socket', default=os.environ.get('INFERENCE_SOCKET', DEFAULT_SOCKET))
+    parser.add_argument('--model', default=os.path.join('backend', 'models', 'deepfake_model.h5'),
+                        help='Keras (.h5) or TFLite (.tflite) model')
+    parser.add_argument('--num-threads', type=int, default=None, help='TFLite interpreter threads')
+    parser.add_argument('--batch-size', type=int, default=int(os.environ.get('BATCH_MAX_SIZE', '16')))
+    parser.add_argument('--max-wait-ms', type=float, default=float(os.environ.get('BATCH_MAX_WAIT_MS', '5')))
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    from deepfake_detector import DeepfakeDetector
+    detector = DeepfakeDetector(model_path=args.model, num_threads=args.num_threads, pretrained=False)
+    detector.warmup(batch_sizes=sorted({1, args.batch_size}))
+    server = InferenceServer(detector, args.socket, max_batch_size=args.batch_size, max_wait_ms=args.max_wait_ms)
+    signal.signal(signal.SIGTERM, lambda *_: server.shutdown())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
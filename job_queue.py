@@ -0,0 +1,355 @@
+"""
+Persistent job queue for long-running video and batch scoring.
+
+A POST handler stores the upload under <job_dir>/<id>/input and inserts a
+'queued' row into a SQLite database in job_dir. Worker threads claim jobs, run
+them and write progress and results back to that row, with batch results going
+to a file next to it. Queued work therefore survives a restart, and several
+server processes can share one job_dir because SQLite serializes the claims.
+Running jobs hold a lease that progress updates keep extending, so a job whose
+process died is claimed again once its lease expires.
+
+Jobs score frames through the same BatchScheduler (or inference server) as live
+requests, so frames from concurrent jobs and requests share forward passes.
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from contextlib import closing, contextmanager
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 60
+MAX_ATTEMPTS = 3  # a job that keeps killing its worker is failed instead of retried forever
+PROGRESS_INTERVAL = 0.5  # seconds between progress writes
+PURGE_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    options TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+class JobQueue:
+    """
+    SQLite-backed job queue with a local pool of worker threads.
+
+    handlers (passed to start) map a job kind to fn(job, progress) -> JSON-serializable
+    result; job is the dict returned by get() plus 'options' and 'dir', and
+    progress(done, total=None) reports how far the job got.
+    """
+    def __init__(self, job_dir, workers=2, ttl_seconds=24 * 3600, poll_interval=0.5):
+        self.job_dir = os.path.abspath(job_dir)
+        self.db_path = os.path.join(self.job_dir, 'jobs.sqlite3')
+        self.workers = max(1, int(workers))
+        self.ttl_seconds = ttl_seconds
+        self.poll_interval = poll_interval
+        self.handlers = {}
+
+        os.makedirs(self.job_dir, exist_ok=True)
+        with self._db() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+        # Metrics (this process only)
+        self._completed = 0
+        self._failed = 0
+
+    @contextmanager
+    def _db(self):
+        with closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None)) as db:
+            db.row_factory = sqlite3.Row
+            yield db
+
+    def start(self, handlers):
+        """Start the worker threads (idempotent); handlers map job kinds to functions"""
+        self.handlers = dict(handlers)
+        self._stopping.clear()
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        """Stop the workers once their current jobs finish; queued jobs stay in the database"""
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def create(self):
+        """Reserve a job id and its input directory; write the upload there, then call submit()"""
+        job_id = uuid.uuid4().hex
+        input_dir = os.path.join(self.job_dir, job_id, 'input')
+        os.makedirs(input_dir)
+        return job_id, input_dir
+
+    def submit(self, job_id, kind, options):
+        """Queue a job created with create() once its input is complete"""
+        with self._db() as db:
+            db.execute('INSERT INTO jobs (id, kind, status, options, created) VALUES (?, ?, ?, ?, ?)',
+                       (job_id, kind, 'queued', json.dumps(options), time.time()))
+        self._wake.set()
+        return job_id
+
+    def discard(self, job_id):
+        """Remove a created job whose upload failed before it was submitted"""
+        shutil.rmtree(os.path.join(self.job_dir, job_id), ignore_errors=True)
+
+    def get(self, job_id):
+        """Public view of a job: status, progress and result, or None if unknown"""
+        with self._db() as db:
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._view(row) if row is not None else None
+
+    def results_file(self, job_id):
+        """Path of a finished job's results file, if it wrote one"""
+        job_dir = os.path.join(self.job_dir, job_id)
+        if not os.path.isdir(job_dir):
+            return None
+        for name in sorted(os.listdir(job_dir)):
+            if name.startswith('results.') and not name.endswith('.tmp'):
+                return os.path.join(job_dir, name)
+        return None
+
+    def stats(self):
+        with self._db() as db:
+            counts = dict(db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        with self._lock:
+            return {
+                'workers': len(self._threads),
+                'queued': counts.get('queued', 0),
+                'running': counts.get('running', 0),
+                'done': counts.get('done', 0),
+                'failed': counts.get('failed', 0),
+                'completed_here': self._completed,
+                'failed_here': self._failed,
+            }
+
+    def _view(self, row):
+        total = row['total']
+        if row['status'] == 'done':
+            progress = 1.0
+        else:
+            progress = min(1.0, row['done'] / total) if total else 0.0
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'progress': progress,
+            'done': row['done'],
+            'total': total,
+            'created': row['created'],
+            'started': row['started'],
+            'finished': row['finished'],
+            'attempts': row['attempts'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+        }
+
+    def _claim(self):
+        """Atomically take the oldest queued job (or one whose worker died) and lease it"""
+        now = time.time()
+        with self._db() as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                while True:
+                    row = db.execute("SELECT * FROM jobs WHERE status = 'queued' "
+                                     "OR (status = 'running' AND lease_until < ?) ORDER BY created LIMIT 1",
+                                     (now,)).fetchone()
+                    if row is None:
+                        return None
+                    if row['attempts'] >= MAX_ATTEMPTS:
+                        db.execute("UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE id = ?",
+                                   (now, f"Interrupted {row['attempts']} times", row['id']))
+                        continue
+                    db.execute("UPDATE jobs SET status = 'running', started = ?, lease_until = ?, "
+                               "attempts = attempts + 1, done = 0 WHERE id = ?",
+                               (now, now + LEASE_SECONDS, row['id']))
+                    job = self._view(row)
+                    job['options'] = json.loads(row['options'])
+                    job['dir'] = os.path.join(self.job_dir, row['id'])
+                    return job
+            finally:
+                db.execute('COMMIT')
+
+    def _progress_fn(self, job_id):
+        last_write = [0.0]
+
+        def progress(done, total=None):
+            now = time.monotonic()
+            if now - last_write[0] < PROGRESS_INTERVAL:
+                return
+            last_write[0] = now
+            # Every update also extends the lease, so only stalled jobs are reclaimed
+            with self._db() as db:
+                db.execute('UPDATE jobs SET done = ?, total = COALESCE(?, total), lease_until = ? WHERE id = ?',
+                           (int(done), total, time.time() + LEASE_SECONDS, job_id))
+        return progress
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._db() as db:
+            db.execute("UPDATE jobs SET status = ?, finished = ?, result = ?, error = ?, lease_until = NULL, "
+                       "done = CASE WHEN ? = 'done' THEN COALESCE(total, done) ELSE done END WHERE id = ?",
+                       (status, time.time(), json.dumps(result) if result is not None else None, error, status,
+                        job_id))
+        # The upload is no longer needed; results files stay until the job expires
+        shutil.rmtree(os.path.join(self.job_dir, job_id, 'input'), ignore_errors=True)
+        with self._lock:
+            if status == 'done':
+                self._completed += 1
+            else:
+                self._failed += 1
+
+    def _execute(self, job):
+        handler = self.handlers.get(job['kind'])
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind {job['kind']!r}")
+            result = handler(job, self._progress_fn(job['id']))
+        except Exception as e:
+            logger.exception("Job %s failed: %s", job['id'], e)
+            self._finish(job['id'], 'failed', error=str(e))
+            return
+        self._finish(job['id'], 'done', result=result)
+        logger.info("Job %s (%s) finished in %.2fs", job['id'], job['kind'], time.perf_counter() - started)
+
+    def _purge(self):
+        """Delete finished jobs (rows and files) older than ttl_seconds"""
+        now = time.time()
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        with self._db() as db:
+            expired = [row[0] for row in db.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+                (now - self.ttl_seconds,)).fetchall()]
+            for job_id in expired:
+                db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        for job_id in expired:
+            shutil.rmtree(os.path.join(self.job_dir, job_id), ignore_errors=True)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+                if job is None:
+                    self._purge()
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+                    continue
+            except sqlite3.Error as e:
+                logger.warning("Job queue database error: %s", e)
+                self._stopping.wait(self.poll_interval)
+                continue
+            self._execute(job)
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+def is_archive_name(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+def count_batch_images(paths):
+    """Number of images a batch job will score: one per image file, or every image inside an archive"""
+    from deepfake_detector import IMAGE_EXTENSIONS
+    total = 0
+    for path in paths:
+        if is_archive_name(path) and zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                total += sum(1 for info in archive.infolist()
+                             if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS))
+        elif is_archive_name(path) and tarfile.is_tarfile(path):
+            with tarfile.open(path) as archive:
+                total += sum(1 for member in archive.getmembers()
+                             if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            total += 1
+    return total
+
+def job_handlers(models, batch_size=16):
+    """
+    'video' and 'batch' handlers for a model_registry.ModelManager. Each job runs start to
+    finish on the model version active when it started, through that version's batcher
+    (predict_many), so job frames are batched with everything else the server scores.
+    """
+    from deepfake_detector import iter_archive_images, iter_result_lines, read_file
+
+    def video(job, progress):
+        options = job['options']
+        path = os.path.join(job['dir'], 'input', options['filename'])
+        with models.use() as served:
+            result = served.detector.predict_video(path, score_fn=served.batcher.predict_many,
+                                                   batch_size=batch_size, progress=progress, **options['params'])
+        if result is None:
+            raise ValueError("No frames could be decoded from the video")
+        return result
+
+    def batch(job, progress):
+        options = job['options']
+        fmt = options['format']
+        # Stored as <index>_<name> to keep uploads with the same name apart
+        files = [(name, os.path.join(job['dir'], 'input', stored)) for stored, name in options['files']]
+        total = count_batch_images([path for _, path in files])
+        progress(0, total)
+
+        def items():
+            for name, path in files:
+                archive = iter_archive_images(path) if is_archive_name(path) else None
+                if archive is not None:
+                    yield from archive
+                else:
+                    yield name, partial(read_file, path)
+
+        summary = {'images': 0, 'fake': 0, 'errors': 0, 'format': fmt}
+
+        def counted(results):
+            for name, result in results:
+                summary['images'] += 1
+                if result is None:
+                    summary['errors'] += 1
+                elif result['is_fake']:
+                    summary['fake'] += 1
+                progress(summary['images'], total)
+                yield name, result
+
+        results_path = os.path.join(job['dir'], f"results.{fmt}")
+        with models.use() as served, open(results_path + '.tmp', 'w', newline='') as out:
+            results = served.detector.predict_stream(items(), batch_size=batch_size,
+                                                     score_fn=served.batcher.predict_many)
+            for line in iter_result_lines(counted(results), fmt):
+                out.write(line)
+        os.replace(results_path + '.tmp', results_path)
+        return summary
+
+    return {'video': video, 'batch': batch}
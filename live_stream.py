@@ -0,0 +1,133 @@
+"""
+Building blocks for scoring live camera streams (the /api/stream WebSocket).
+
+Latency stays bounded by dropping frames instead of queueing them:
+- frames arriving faster than a stream's rate limit are dropped on arrival (TokenBucket)
+- each stream keeps at most one frame waiting to be scored, and a newer frame
+  replaces it (LatestFrame), so a busy server skips ahead to the newest frame
+- a frame that has waited longer than the allowed lag by its turn is skipped
+
+Frames that do get scored go through the same micro-batcher as every other
+request, so concurrent streams share forward passes. ScoreSmoother turns the
+per-frame scores into a stable per-stream score.
+"""
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """Allow rate events per second on average, with bursts of up to burst events"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst) if burst is not None else self.rate / 2)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, now=None):
+        """Use up one token if there is one; False means the event is over the limit"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class ScoreSmoother:
+    """
+    Exponential moving average over time rather than over frames: a score half_life
+    seconds old counts half as much as a new one, however many frames were skipped.
+    """
+
+    def __init__(self, half_life=1.0):
+        self.half_life = max(0.0, float(half_life))
+        self.value = None
+        self.updated = None
+
+    def update(self, score, now=None):
+        now = time.monotonic() if now is None else now
+        if self.value is None or self.half_life == 0:
+            self.value = float(score)
+        else:
+            weight = 0.5 ** ((now - self.updated) / self.half_life)
+            self.value = weight * self.value + (1 - weight) * float(score)
+        self.updated = now
+        return self.value
+
+
+class LatestFrame:
+    """One-slot mailbox between a stream's reader and its scorer; a new frame replaces one not yet taken"""
+
+    def __init__(self):
+        self._item = None
+        self._event = asyncio.Event()
+
+    def put(self, item):
+        """Store item; returns True if it replaced a frame that was never scored"""
+        replaced = self._item is not None
+        self._item = item
+        self._event.set()
+        return replaced
+
+    async def take(self):
+        await self._event.wait()
+        self._event.clear()
+        item, self._item = self._item, None
+        return item
+
+
+class StreamStats:
+    """Connection and frame counters across all live streams, exported on /metrics"""
+
+    DROP_REASONS = ('rate', 'replaced', 'stale', 'busy', 'invalid')
+
+    def __init__(self, max_streams):
+        self.max_streams = max(1, int(max_streams))
+        self._lock = threading.Lock()
+        self._active = 0
+        self._opened = 0
+        self._rejected = 0
+        self._received = 0
+        self._scored = 0
+        self._dropped = dict.fromkeys(self.DROP_REASONS, 0)
+
+    def open(self):
+        """Reserve a stream slot; False when max_streams are already open"""
+        with self._lock:
+            if self._active >= self.max_streams:
+                self._rejected += 1
+                return False
+            self._active += 1
+            self._opened += 1
+            return True
+
+    def close(self):
+        with self._lock:
+            self._active -= 1
+
+    def received(self):
+        with self._lock:
+            self._received += 1
+
+    def scored(self):
+        with self._lock:
+            self._scored += 1
+
+    def dropped(self, reason):
+        with self._lock:
+            self._dropped[reason] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_streams': self.max_streams,
+                'active': self._active,
+                'opened': self._opened,
+                'rejected': self._rejected,
+                'frames_received': self._received,
+                'frames_scored': self._scored,
+                'frames_dropped': dict(self._dropped),
+            }
@@ -0,0 +1,93 @@
+"""
+Prometheus metrics shared by the FastAPI and Flask backends.
+
+Each request times its stages (upload read, cache lookup, decode, resize,
+inference, response serialization) with a StageTimer, which feeds both the
+per-stage histograms and the Server-Timing header. The stats() dicts of the
+batcher, executor and frame cache are exported as gauges at scrape time, so
+those classes stay free of any metrics dependency.
+
+With several worker processes each one serves its own numbers; scrape them
+individually or set up prometheus_client's multiprocess mode.
+"""
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+# Seconds; fine-grained at the low end where decode/resize live
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram('deepfake_stage_seconds', 'Time spent in each stage of a request',
+                          ['endpoint', 'stage'], buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram('deepfake_request_seconds', 'End-to-end request latency',
+                            ['endpoint', 'method'], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter('deepfake_requests_total', 'Requests served', ['endpoint', 'method', 'status'])
+PREDICTIONS = Counter('deepfake_predictions_total', 'Predictions returned', ['endpoint', 'verdict', 'source'])
+
+class StageTimer:
+    """Times the stages of one request into a dict (for Server-Timing) and the stage histogram"""
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        STAGE_SECONDS.labels(self.endpoint, name).observe(seconds)
+
+    def server_timing(self):
+        """Stage durations as a Server-Timing header value in milliseconds"""
+        return ', '.join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.timings.items())
+
+def observe_request(endpoint, method, status, seconds):
+    REQUESTS.labels(endpoint, method, str(status)).inc()
+    REQUEST_SECONDS.labels(endpoint, method).observe(seconds)
+
+def observe_prediction(endpoint, result, cached=False):
+    verdict = 'fake' if result['is_fake'] else 'real'
+    PREDICTIONS.labels(endpoint, verdict, 'cache' if cached else result.get('stage', 'model')).inc()
+
+class StatsCollector:
+    """
+    Exposes a stats() callable as gauges: numbers become <prefix>_<key>, and dicts of
+    numbers (e.g. a batch-size histogram) one gauge with a 'key' label.
+    """
+    def __init__(self, prefix, stats_fn):
+        self.prefix = prefix
+        self.stats_fn = stats_fn
+
+    def describe(self):
+        # Names depend on what stats_fn returns; don't call it at registration time
+        return []
+
+    def collect(self):
+        stats = self.stats_fn() or {}
+        for key, value in stats.items():
+            name = f"{self.prefix}_{key}"
+            if isinstance(value, bool):
+                yield GaugeMetricFamily(name, f"{self.prefix} {key}", value=float(value))
+            elif isinstance(value, (int, float)):
+                yield GaugeMetricFamily(name, f"{self.prefix} {key}", value=value)
+            elif isinstance(value, dict):
+                family = GaugeMetricFamily(name, f"{self.prefix} {key}", labels=['key'])
+                for label, item in value.items():
+                    if isinstance(item, (int, float)):
+                        family.add_metric([str(label)], item)
+                yield family
+
+def register_stats(prefix, stats_fn):
+    """Export stats_fn() under prefix on every scrape; stats_fn may return None while not ready"""
+    REGISTRY.register(StatsCollector(prefix, stats_fn))
+
+def render():
+    """(body, content type) of the /metrics response"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
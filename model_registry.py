@@ -0,0 +1,439 @@
+"""
+Versioned model registry and zero-downtime model swaps for the backends.
+
+A registry is a directory of immutable versions plus two pointer files:
+
+    <registry>/v0001/model.h5      (or model.tflite) and meta.json
+    <registry>/v0002/...
+    <registry>/CURRENT             version every worker should serve
+    <registry>/SHADOW              optional candidate scored on a sample of traffic
+
+Servers poll the pointers. When CURRENT changes, the new version is loaded and warmed up
+in the background, then swapped in atomically. Requests (and jobs) that started on the
+old version finish on it, and its batcher is stopped once the last of them is done.
+Moving CURRENT back is a rollback. Every worker sharing the registry follows the same
+pointers, so no restart is needed.
+
+Usage:
+    python model_registry.py backend/models/registry publish deepfake_model.h5 --activate
+    python model_registry.py backend/models/registry shadow v0003
+    python model_registry.py backend/models/registry activate v0002
+    python model_registry.py backend/models/registry list
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+VERSION_NAME = re.compile(r'^v(\d+)$')
+MODEL_EXTENSIONS = ('.h5', '.keras', '.tflite')
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """Directory of numbered model versions with CURRENT and SHADOW pointer files"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def versions(self):
+        """Published versions, oldest first"""
+        names = [name for name in os.listdir(self.root)
+                 if VERSION_NAME.match(name) and os.path.isdir(os.path.join(self.root, name))]
+        return sorted(names, key=lambda name: int(VERSION_NAME.match(name).group(1)))
+
+    def model_path(self, version):
+        """Path of the model file of a version"""
+        version_dir = os.path.join(self.root, version)
+        for name in sorted(os.listdir(version_dir)):
+            if name.startswith('model') and name.endswith(MODEL_EXTENSIONS):
+                return os.path.join(version_dir, name)
+        raise FileNotFoundError(f"No model file in {version_dir}")
+
+    def metadata(self, version):
+        path = os.path.join(self.root, version, 'meta.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def publish(self, model_path, notes=None, metadata=None):
+        """Copy a model into the next version directory (atomically) and return the version name"""
+        ext = os.path.splitext(model_path)[1].lower()
+        if ext not in MODEL_EXTENSIONS:
+            raise ValueError(f"Unsupported model file {model_path}; expected one of {', '.join(MODEL_EXTENSIONS)}")
+        versions = self.versions()
+        number = int(VERSION_NAME.match(versions[-1]).group(1)) + 1 if versions else 1
+        version = f"v{number:04d}"
+        tmp_dir = os.path.join(self.root, f".{version}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        shutil.copy2(model_path, os.path.join(tmp_dir, 'model' + ext))
+        meta = {'source': os.path.abspath(model_path), 'published': time.time(), 'notes': notes or ''}
+        meta.update(metadata or {})
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        # A version directory only ever appears complete
+        os.rename(tmp_dir, os.path.join(self.root, version))
+        return version
+
+    def _read_pointer(self, name):
+        try:
+            with open(os.path.join(self.root, name)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _write_pointer(self, name, version):
+        path = os.path.join(self.root, name)
+        if version is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        if version not in self.versions():
+            raise ValueError(f"Unknown version {version}")
+        with open(path + '.tmp', 'w') as f:
+            f.write(version + '\n')
+        os.replace(path + '.tmp', path)
+
+    def current(self):
+        return self._read_pointer('CURRENT')
+
+    def set_current(self, version):
+        self._write_pointer('CURRENT', version)
+        if self.shadow() == version:
+            # The candidate has been promoted; servers reuse their warm shadow copy
+            self._write_pointer('SHADOW', None)
+
+    def shadow(self):
+        return self._read_pointer('SHADOW')
+
+    def set_shadow(self, version):
+        """Score a sample of traffic with version alongside the current one (None turns shadowing off)"""
+        self._write_pointer('SHADOW', version)
+
+
+class ServedModel:
+    """
+    One loaded model version: its detector and batcher, and a count of the requests
+    using it. Once retired, close() runs as soon as the last of them is done.
+    """
+
+    def __init__(self, version, detector, batcher, path=None, close=None):
+        self.version = version
+        self.detector = detector
+        self.batcher = batcher
+        self.path = path
+        self.loaded_at = time.time()
+        self._close = close
+        self._lock = threading.Lock()
+        self._users = 0
+        self._retired = False
+        self.closed = False
+
+    def acquire(self):
+        with self._lock:
+            self._users += 1
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            drained = self._retired and self._users == 0
+        if drained:
+            self._finish()
+
+    def retire(self):
+        """Stop taking new work; close once the requests still using this version are done"""
+        with self._lock:
+            self._retired = True
+            drained = self._users == 0
+        if drained:
+            self._finish()
+
+    @property
+    def users(self):
+        with self._lock:
+            return self._users
+
+    def _finish(self):
+        self.closed = True
+        if self._close is not None:
+            # release() may run on the batcher's own thread (e.g. from a shadow callback),
+            # so never stop the batcher from the caller's thread
+            threading.Thread(target=self._close, name=f'close-{self.version}', daemon=True).start()
+        logger.info("Model version %s drained and closed", self.version)
+
+
+class ModelManager:
+    """
+    The model version being served, plus an optional shadow candidate.
+
+    load_fn(version, model_path) must return a warmed-up ServedModel. Requests take the
+    active version with use(), and install() swaps in a new one without waiting for them.
+    """
+
+    def __init__(self, load_fn, registry=None, poll_seconds=10.0, shadow_rate=0.1):
+        self.load_fn = load_fn
+        self.registry = registry
+        self.poll_seconds = float(poll_seconds)
+        self.shadow_rate = float(shadow_rate)
+        self._lock = threading.Lock()
+        self._active = None
+        self._shadow = None
+        self._draining = []
+        self._failed = set()  # Versions that failed to load; retried only once the pointer moves
+        self._stop = threading.Event()
+        self._thread = None
+        self.swaps = 0
+        self.last_error = None
+        self._reset_shadow_stats()
+
+    @property
+    def active(self):
+        return self._active
+
+    @contextmanager
+    def use(self):
+        """Pin the active version for the duration of one request or job"""
+        with self._lock:
+            served = self._active
+            if served is None:
+                raise RuntimeError("No model loaded")
+            served.acquire()
+        try:
+            yield served
+        finally:
+            served.release()
+
+    def install(self, served):
+        """Make served the active version; the previous one drains and closes"""
+        with self._lock:
+            previous, self._active = self._active, served
+            if previous is not None:
+                self.swaps += 1
+                self._draining.append(previous)
+        if previous is not None:
+            logger.info("Swapped model %s -> %s", previous.version, served.version)
+            previous.retire()
+
+    def set_shadow(self, served):
+        with self._lock:
+            previous, self._shadow = self._shadow, served
+            self._reset_shadow_stats()
+            if previous is not None:
+                self._draining.append(previous)
+        if previous is not None:
+            previous.retire()
+
+    def load(self, version, model_path):
+        """Load and warm up a version, then swap it in"""
+        started = time.perf_counter()
+        served = self.load_fn(version, model_path)
+        self.install(served)
+        logger.info("Model version %s loaded in %.2fs", version, time.perf_counter() - started)
+        return served
+
+    def sync(self):
+        """Bring the active and shadow versions in line with the registry pointers"""
+        if self.registry is None:
+            return
+        current = self.registry.current()
+        if self._active is not None and self._shadow is not None and current == self._shadow.version:
+            # Promoting the shadow: it is already loaded and warm
+            with self._lock:
+                served, self._shadow = self._shadow, None
+                self._reset_shadow_stats()
+            self.install(served)
+        elif current and (self._active is None or current != self._active.version) and current not in self._failed:
+            try:
+                self.load(current, self.registry.model_path(current))
+            except Exception as e:
+                self._failed.add(current)
+                self.last_error = f"{current}: {e}"
+                logger.exception("Could not load model version %s; still serving %s", current,
+                                 self._active.version if self._active else 'nothing')
+
+        shadow = self.registry.shadow()
+        if shadow == current:
+            shadow = None
+        shadow_version = self._shadow.version if self._shadow is not None else None
+        if shadow != shadow_version and shadow not in self._failed:
+            try:
+                self.set_shadow(self.load_fn(shadow, self.registry.model_path(shadow)) if shadow else None)
+                logger.info("Shadow model %s", shadow or 'off')
+            except Exception as e:
+                self._failed.add(shadow)
+                self.last_error = f"{shadow}: {e}"
+                logger.exception("Could not load shadow model version %s", shadow)
+        # A version that failed is retried once it stops being pointed at
+        self._failed &= {current, shadow}
+
+    def start(self):
+        """Poll the registry in the background (no-op without a registry)"""
+        if self.registry is None or self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._run, name='model-registry', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.exception("Model registry poll failed: %s", e)
+
+    def compare_shadow(self, frame, score):
+        """
+        Score a sample of frames (uint8, as preprocessed for the active model) with the
+        shadow version in the background and record how it compares to score.
+        Never blocks the caller.
+        """
+        with self._lock:
+            shadow = self._shadow
+            if shadow is None or random.random() >= self.shadow_rate:
+                return
+            shadow.acquire()
+        try:
+            detector = shadow.detector
+            if tuple(frame.shape[1::-1]) != tuple(detector.input_size):
+                import cv2
+                frame = cv2.resize(frame, detector.input_size)
+            future = shadow.batcher.submit(detector.normalize_frame(frame))
+        except Exception:
+            shadow.release()
+            with self._lock:
+                self._shadow_stats['errors'] += 1
+            return
+        started = time.perf_counter()
+
+        def record(future):
+            try:
+                shadow_score = float(future.result())
+            except Exception:
+                with self._lock:
+                    self._shadow_stats['errors'] += 1
+            else:
+                with self._lock:
+                    if self._shadow is shadow:
+                        stats = self._shadow_stats
+                        stats['compared'] += 1
+                        stats['agreed'] += int((shadow_score > 0.5) == (float(score) > 0.5))
+                        stats['abs_diff_total'] += abs(shadow_score - float(score))
+                        stats['seconds_total'] += time.perf_counter() - started
+            finally:
+                shadow.release()
+
+        future.add_done_callback(record)
+
+    def _reset_shadow_stats(self):
+        self._shadow_stats = {'compared': 0, 'agreed': 0, 'abs_diff_total': 0.0, 'seconds_total': 0.0, 'errors': 0}
+
+    def _prune_draining(self):
+        self._draining = [served for served in self._draining if not served.closed]
+
+    def stats(self):
+        """Numbers for /metrics: the served versions as labels, swap count and shadow comparison"""
+        with self._lock:
+            self._prune_draining()
+            if self._active is None:
+                return None
+            shadow = self._shadow_stats
+            compared = shadow['compared']
+            stats = {
+                'active_version': {self._active.version: 1},
+                'swaps': self.swaps,
+                'draining': len(self._draining),
+            }
+            if self._shadow is not None:
+                stats.update({
+                    'shadow_version': {self._shadow.version: 1},
+                    'shadow_compared': compared,
+                    'shadow_errors': shadow['errors'],
+                    'shadow_agreement': shadow['agreed'] / compared if compared else 0.0,
+                    'shadow_mean_abs_diff': shadow['abs_diff_total'] / compared if compared else 0.0,
+                    'shadow_mean_ms': shadow['seconds_total'] * 1000 / compared if compared else 0.0,
+                })
+            return stats
+
+    def describe(self):
+        """State for the /api/models endpoint"""
+        def served_info(served):
+            return {'version': served.version, 'path': served.path, 'loaded_at': served.loaded_at,
+                    'input_size': list(served.detector.input_size), 'requests_in_flight': served.users}
+
+        with self._lock:
+            self._prune_draining()
+            info = {
+                'active': served_info(self._active) if self._active is not None else None,
+                'shadow': served_info(self._shadow) if self._shadow is not None else None,
+                'draining': [served_info(served) for served in self._draining],
+                'swaps': self.swaps,
+                'last_error': self.last_error,
+            }
+        stats = self.stats() or {}
+        if info['shadow'] is not None:
+            info['shadow'].update({key[len('shadow_'):]: value for key, value in stats.items()
+                                   if key.startswith('shadow_') and key != 'shadow_version'})
+            info['shadow']['sample_rate'] = self.shadow_rate
+        if self.registry is not None:
+            info['registry'] = {'root': self.registry.root, 'versions': self.registry.versions(),
+                                'current': self.registry.current(), 'shadow': self.registry.shadow()}
+        return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage a versioned model registry served by the backends')
+    parser.add_argument('registry', help='Registry directory (MODEL_REGISTRY on the servers)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    publish = commands.add_parser('publish', help='Add a model file as the next version')
+    publish.add_argument('model_path')
+    publish.add_argument('--notes', help='Free-form description stored in meta.json')
+    publish.add_argument('--report', help='JSON evaluation report (e.g. from --distill) stored in meta.json')
+    publish.add_argument('--activate', action='store_true', help='Also make it the current version')
+    activate = commands.add_parser('activate', help='Serve a version (also used to roll back)')
+    activate.add_argument('version')
+    shadow = commands.add_parser('shadow', help='Score a sample of traffic with a candidate version')
+    shadow.add_argument('version', nargs='?', help='Version to shadow; omit to turn shadowing off')
+    commands.add_parser('list', help='List versions and pointers')
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.registry)
+    if args.command == 'publish':
+        metadata = None
+        if args.report:
+            with open(args.report) as f:
+                metadata = {'report': json.load(f)}
+        version = registry.publish(args.model_path, notes=args.notes, metadata=metadata)
+        print(f"Published {args.model_path} as {version}")
+        if args.activate:
+            registry.set_current(version)
+            print(f"{version} is now current")
+    elif args.command == 'activate':
+        registry.set_current(args.version)
+        print(f"{args.version} is now current")
+    elif args.command == 'shadow':
+        registry.set_shadow(args.version)
+        print(f"Shadowing {args.version}" if args.version else "Shadowing off")
+    else:
+        current, shadow = registry.current(), registry.shadow()
+        for version in registry.versions():
+            flags = ' '.join(flag for flag, on in (('current', version == current), ('shadow', version == shadow)) if on)
+            meta = registry.metadata(version)
+            print(f"{version}  {os.path.basename(registry.model_path(version))}  "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(meta.get('published', 0)))}  "
+                  f"{meta.get('notes', '')}  {flags}")
+
+if __name__ == '__main__':
+    main()
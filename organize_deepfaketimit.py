@@ -1,38 +1,179 @@
+"""
+Index DeepfakeTIMIT into dataset/raw without copying any video.
+
+Every video under DeepfakeTIMIT/lower_quality and higher_quality (all speakers) is
+linked into <output>/<label>/<quality>/<speaker>/ and listed in <output>/manifest.csv
+with its label, speaker and quality. Hardlinks are used by default, with a symlink
+as fallback across filesystems. Reruns only link what was added or changed and
+remove links whose source disappeared.
+
+All DeepfakeTIMIT videos are face swaps, so they are labelled fake. The real
+footage comes from VidTIMIT (or any directory of <speaker>/... videos) via --real-dir.
+
+With --frames-dir the linked videos are also passed to extract_frames, which skips
+videos it already extracted and drops near-duplicate consecutive frames.
+
+Usage:
+    python organize_deepfaketimit.py DeepfakeTIMIT --real-dir VidTIMIT --frames-dir dataset/processed
+"""
+import argparse
+import csv
 import os
+import re
 import shutil
-import glob
-
-# === USER: Set your target speaker here ===
-TARGET_SPEAKER = 'fadg0'  # Change this to any speaker you want
-
-# === Paths ===
-BASE_DIR = 'DeepfakeTIMIT/lower_quality'
-REAL_OUT = 'dataset/raw/real'
-FAKE_OUT = 'dataset/raw/fake'
-
-os.makedirs(REAL_OUT, exist_ok=True)
-os.makedirs(FAKE_OUT, exist_ok=True)
-
-# 1. Copy real videos for the target speaker
-real_speaker_dir = os.path.join(BASE_DIR, TARGET_SPEAKER)
-real_videos = glob.glob(os.path.join(real_speaker_dir, '*.avi'))
-print(f'Found {len(real_videos)} real videos for {TARGET_SPEAKER}')
-for vid in real_videos:
-    shutil.copy(vid, os.path.join(REAL_OUT, os.path.basename(vid)))
-
-# 2. Copy fake videos generated to look like the target speaker
-for speaker in os.listdir(BASE_DIR):
-    speaker_dir = os.path.join(BASE_DIR, speaker)
-    if not os.path.isdir(speaker_dir) or speaker == TARGET_SPEAKER:
-        continue
-    # Find all videos in this folder that are deepfakes of the target speaker
-    pattern = f'*video-{TARGET_SPEAKER}.avi'
-    fake_videos = glob.glob(os.path.join(speaker_dir, pattern))
-    for vid in fake_videos:
-        shutil.copy(vid, os.path.join(FAKE_OUT, os.path.basename(vid)))
-print(f'Organized fake videos for {TARGET_SPEAKER}')
-
-print('\nDone!')
-print(f'Real videos: {REAL_OUT}')
-print(f'Fake videos: {FAKE_OUT}')
-print('You can now extract frames and train your model.') 
\ No newline at end of file
+
+from extract_frames import VIDEO_EXTENSIONS, process_directory
+
+QUALITIES = {'lower_quality': 'lower', 'higher_quality': 'higher'}
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_FIELDS = ['path', 'label', 'speaker', 'source_speaker', 'quality', 'source', 'size', 'mtime']
+
+# <clip>-video-<speaker of the original clip>.avi
+FAKE_NAME = re.compile(r'^(?P<clip>.+)-video-(?P<source>[^-]+)$')
+
+def index_videos(base_dir, real_dir=None):
+    """
+    Manifest rows for every video: path (relative to the output directory), label,
+    speaker, source_speaker (whose clip the face was swapped into), quality and source.
+    """
+    rows = []
+    for quality_dir, quality in QUALITIES.items():
+        root = os.path.join(base_dir, quality_dir)
+        if not os.path.isdir(root):
+            continue
+        for speaker in sorted(os.listdir(root)):
+            speaker_dir = os.path.join(root, speaker)
+            if not os.path.isdir(speaker_dir):
+                continue
+            for name in sorted(os.listdir(speaker_dir)):
+                if not name.lower().endswith(VIDEO_EXTENSIONS):
+                    continue
+                match = FAKE_NAME.match(os.path.splitext(name)[0])
+                rows.append({
+                    'path': '/'.join(('fake', quality, speaker, name)),
+                    'label': 'fake',
+                    'speaker': speaker,
+                    'source_speaker': match.group('source') if match else '',
+                    'quality': quality,
+                    'source': os.path.join(speaker_dir, name),
+                })
+
+    if real_dir:
+        for root, dirs, files in os.walk(real_dir):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.lower().endswith(VIDEO_EXTENSIONS):
+                    continue
+                relative = os.path.relpath(os.path.join(root, name), real_dir).replace(os.sep, '/')
+                speaker = relative.split('/')[0] if '/' in relative else ''
+                rows.append({
+                    'path': '/'.join(('real', 'original', relative)),
+                    'label': 'real',
+                    'speaker': speaker,
+                    'source_speaker': speaker,
+                    'quality': 'original',
+                    'source': os.path.join(root, name),
+                })
+    return rows
+
+def load_manifest(output_dir):
+    """Manifest rows keyed by path, or {} if there is none yet"""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='') as f:
+        return {row['path']: row for row in csv.DictReader(f)}
+
+def save_manifest(output_dir, rows):
+    """Write the manifest atomically so an interrupted run never leaves it half-written"""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        for row in sorted(rows, key=lambda row: row['path']):
+            writer.writerow(row)
+    os.replace(tmp_path, path)
+
+def place_link(source, target, link='hardlink'):
+    """Point target at source: a hardlink (symlink if that fails, e.g. across filesystems), a symlink or a copy"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.lexists(target):
+        os.remove(target)
+    if link == 'hardlink':
+        try:
+            os.link(source, target)
+            return
+        except OSError:
+            link = 'symlink'
+    if link == 'symlink':
+        os.symlink(os.path.abspath(source), target)
+    else:
+        shutil.copy2(source, target)
+
+def organize(base_dir, output_dir, real_dir=None, link='hardlink', force=False):
+    """
+    Bring output_dir in line with the videos found: link new or changed videos, remove
+    links whose source is gone, and rewrite the manifest. Returns the manifest rows.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    previous = {} if force else load_manifest(output_dir)
+    rows = index_videos(base_dir, real_dir)
+
+    linked = 0
+    for row in rows:
+        stat = os.stat(row['source'])
+        row.update(size=str(stat.st_size), mtime=str(int(stat.st_mtime)))
+        old = previous.get(row['path'])
+        target = os.path.join(output_dir, row['path'])
+        unchanged = old and all(old.get(key) == row[key] for key in ('source', 'size', 'mtime'))
+        if unchanged and os.path.exists(target):
+            continue
+        place_link(row['source'], target, link)
+        linked += 1
+
+    current = {row['path'] for row in rows}
+    removed = 0
+    for path in previous.keys() - current:
+        target = os.path.join(output_dir, path)
+        if os.path.lexists(target):
+            os.remove(target)
+        removed += 1
+
+    save_manifest(output_dir, rows)
+    counts = {}
+    for row in rows:
+        counts[row['label']] = counts.get(row['label'], 0) + 1
+    print(f"Indexed {len(rows)} videos ({', '.join(f'{n} {label}' for label, n in sorted(counts.items()))}): "
+          f"{linked} linked, {len(rows) - linked} unchanged, {removed} removed")
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Index DeepfakeTIMIT into a manifest of linked videos')
+    parser.add_argument('base_dir', nargs='?', default='DeepfakeTIMIT',
+                        help='DeepfakeTIMIT root containing lower_quality/ and higher_quality/')
+    parser.add_argument('--output', default='dataset/raw', help='Where the links and manifest.csv are written')
+    parser.add_argument('--real-dir', help='Real videos, one subdirectory per speaker (e.g. VidTIMIT)')
+    parser.add_argument('--link', choices=['hardlink', 'symlink', 'copy'], default='hardlink',
+                        help='How videos are placed in the output directory')
+    parser.add_argument('--force', action='store_true', help='Ignore the manifest and relink every video')
+    parser.add_argument('--frames-dir', help='Also extract frames into this directory (<label>/<quality>/<speaker>/...)')
+    parser.add_argument('--frame-rate', type=int, default=1, help='With --frames-dir, extract 1 frame every N frames')
+    parser.add_argument('--dedupe-distance', type=int, default=8,
+                        help='With --frames-dir, drop frames within N of 256 hash bits of the last kept one '
+                             '(-1 keeps all)')
+    parser.add_argument('--workers', type=int, default=None, help='With --frames-dir, extraction processes')
+    args = parser.parse_args()
+
+    rows = organize(args.base_dir, args.output, real_dir=args.real_dir, link=args.link, force=args.force)
+
+    if args.frames_dir:
+        dedupe_distance = args.dedupe_distance if args.dedupe_distance >= 0 else None
+        for label in sorted({row['label'] for row in rows}):
+            # extract_frames keeps its own manifest, so only new or changed videos are decoded
+            process_directory(os.path.join(args.output, label), os.path.join(args.frames_dir, label),
+                              frame_rate=args.frame_rate, workers=args.workers, recursive=True,
+                              dedupe_distance=dedupe_distance)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Local HTTP server standing in for dataset hosts in the download tests.
+
+Serves in-memory files with an ETag, honours single byte ranges and If-Range
+(answering 416 to a range past the end), and can be told to ignore ranges or to drop the connection after sending some
+bytes, the way a flaky mirror does.
+"""
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RANGE = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+class StubServer:
+    def __init__(self):
+        self.files = {}  # path -> (data, etag)
+        self.ranges = True
+        self.drop_after = None  # Close each response after this many body bytes
+        self.requests = []  # (path, Range header, If-Range header, status)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self._server.server_address[1]}{path}"
+
+    def put(self, path, data, etag):
+        self.files[path] = (data, f'"{etag}"')
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def body_requests(self):
+        """Requests other than the one-byte probe"""
+        return [request for request in self.requests if request[1] != 'bytes=0-0']
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                # Clients hanging up (including the downloads the tests interrupt) are expected
+                try:
+                    super().handle()
+                except ConnectionError:
+                    pass
+
+            def do_GET(self):
+                if self.path not in stub.files:
+                    self.send_error(404)
+                    return
+                data, etag = stub.files[self.path]
+                range_header = self.headers.get('Range')
+                if_range = self.headers.get('If-Range')
+                start, end, status = 0, len(data), 200
+                match = RANGE.match(range_header or '')
+                if stub.ranges and match and int(match.group(1)) >= len(data):
+                    with stub._lock:
+                        stub.requests.append((self.path, range_header, if_range, 416))
+                    self.send_response(416)
+                    self.send_header('Content-Range', f"bytes */{len(data)}")
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if stub.ranges and match and (if_range is None or if_range == etag):
+                    start = int(match.group(1))
+                    end = int(match.group(2)) + 1 if match.group(2) else len(data)
+                    status = 206
+                with stub._lock:
+                    stub.requests.append((self.path, range_header, if_range, status))
+                body = data[start:end]
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                if stub.ranges:
+                    self.send_header('Accept-Ranges', 'bytes')
+                if status == 206:
+                    self.send_header('Content-Range', f"bytes {start}-{end - 1}/{len(data)}")
+                self.end_headers()
+                if stub.drop_after is not None and len(body) > stub.drop_after:
+                    # Send part of the body, then hang up: the client sees a truncated response
+                    self.wfile.write(body[:stub.drop_after])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        return Handler
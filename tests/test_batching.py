@@ -0,0 +1,123 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from batching import BatchScheduler, SchedulerStopped
+
+
+class StubModel:
+    """Scores each image with its mean pixel value and records the batch sizes it sees"""
+
+    def __init__(self, delay=0.0, error=None):
+        self.batches = []
+        self.delay = delay
+        self.error = error
+
+    def __call__(self, images):
+        self.batches.append(len(images))
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return images.reshape(len(images), -1).mean(axis=1)
+
+
+def image(value):
+    return np.full((2, 2, 3), value, dtype='float32')
+
+
+def test_flushes_when_batch_is_full():
+    model = StubModel()
+    # A wait this long would fail the test if the full batch were not flushed at once
+    scheduler = BatchScheduler(model, max_batch_size=4, max_wait_ms=10_000)
+    futures = [scheduler.submit(image(i)) for i in range(4)]
+    scheduler.start()
+    assert [future.result(timeout=2) for future in futures] == [0.0, 1.0, 2.0, 3.0]
+    assert model.batches == [4]
+    scheduler.stop()
+
+
+def test_flushes_partial_batch_after_max_wait():
+    model = StubModel()
+    scheduler = BatchScheduler(model, max_batch_size=16, max_wait_ms=50).start()
+    started = time.monotonic()
+    futures = [scheduler.submit(image(i)) for i in range(3)]
+    assert [future.result(timeout=2) for future in futures] == [0.0, 1.0, 2.0]
+    assert time.monotonic() - started >= 0.04
+    assert model.batches == [3]
+    assert scheduler.stats()['batch_size_histogram'] == {3: 1}
+    scheduler.stop()
+
+
+def test_concurrent_callers_share_batches():
+    model = StubModel(delay=0.02)
+    scheduler = BatchScheduler(model, max_batch_size=8, max_wait_ms=20).start()
+    results = [None] * 32
+
+    def call(i):
+        results[i] = scheduler.predict(image(i), timeout=5)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [float(i) for i in range(32)]
+    assert sum(model.batches) == 32 and max(model.batches) <= 8 and len(model.batches) < 32
+    scheduler.stop()
+
+
+def test_model_error_fails_the_whole_batch():
+    scheduler = BatchScheduler(StubModel(error=ValueError('boom')), max_batch_size=2, max_wait_ms=1000)
+    futures = [scheduler.submit(image(i)) for i in range(2)]
+    scheduler.start()
+    for future in futures:
+        with pytest.raises(ValueError, match='boom'):
+            future.result(timeout=2)
+    assert scheduler.stats()['errors'] == 1
+    scheduler.stop()
+
+
+def test_cancelled_requests_are_skipped():
+    model = StubModel()
+    scheduler = BatchScheduler(model, max_batch_size=2, max_wait_ms=1000)
+    cancelled, kept = scheduler.submit(image(1)), scheduler.submit(image(2))
+    assert cancelled.cancel()
+    scheduler.start()
+    assert kept.result(timeout=2) == 2.0
+    assert model.batches == [1]
+    scheduler.stop()
+
+
+def test_stop_serves_queued_requests_first():
+    model = StubModel(delay=0.05)
+    scheduler = BatchScheduler(model, max_batch_size=2, max_wait_ms=0).start()
+    futures = [scheduler.submit(image(i)) for i in range(5)]
+    scheduler.stop()
+    assert [future.result(timeout=0) for future in futures] == [float(i) for i in range(5)]
+
+
+def test_submit_after_stop_fails_instead_of_hanging():
+    scheduler = BatchScheduler(StubModel()).start()
+    scheduler.stop()
+    with pytest.raises(SchedulerStopped):
+        scheduler.submit(image(0)).result(timeout=1)
+    with pytest.raises(SchedulerStopped):
+        scheduler.predict_many([image(0), image(1)], timeout=1)
+
+
+def test_stop_without_start_fails_queued_requests():
+    scheduler = BatchScheduler(StubModel())
+    future = scheduler.submit(image(0))
+    scheduler.stop()
+    with pytest.raises(SchedulerStopped):
+        future.result(timeout=1)
+
+
+def test_restart_after_stop():
+    scheduler = BatchScheduler(StubModel(), max_wait_ms=0).start()
+    scheduler.stop()
+    scheduler.start()
+    assert scheduler.predict(image(3), timeout=2) == 3.0
+    scheduler.stop()
@@ -0,0 +1,36 @@
+import threading
+
+import pytest
+
+from bounded_executor import BoundedExecutor, ExecutorSaturated
+
+
+def test_rejects_beyond_workers_and_pending():
+    executor = BoundedExecutor(max_workers=1, max_pending=1)
+    gate = threading.Event()
+    futures = [executor.submit(gate.wait), executor.submit(gate.wait)]
+    with pytest.raises(ExecutorSaturated):
+        executor.submit(gate.wait)
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert executor.stats()['rejected'] == 1
+    executor.shutdown()
+
+
+def test_reservations_share_the_limit():
+    executor = BoundedExecutor(max_workers=1, max_pending=1)
+    slots = [executor.reserve(), executor.reserve()]
+    with pytest.raises(ExecutorSaturated):
+        executor.submit(lambda: None)
+    assert executor.stats()['in_flight'] == 2
+    slots[0].release()
+    slots[0].release()  # Releasing twice frees one slot only
+    slots[0] = executor.reserve()
+    with pytest.raises(ExecutorSaturated):
+        executor.reserve()
+    for slot in slots:
+        slot.release()
+    assert executor.stats()['in_flight'] == 0
+    executor.submit(lambda: None).result(timeout=5)
+    executor.shutdown()
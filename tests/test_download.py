@@ -0,0 +1,190 @@
+import hashlib
+import io
+import os
+import random
+import tarfile
+
+import pytest
+import requests
+
+import download_dataset
+from download_dataset import download, download_tar
+
+from stub_server import StubServer
+
+
+@pytest.fixture
+def server():
+    stub = StubServer().start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Save progress often so an interrupted test download leaves something to resume
+    monkeypatch.setattr(download_dataset, 'CHUNK_SIZE', 1024)
+    monkeypatch.setattr(download_dataset, 'STATE_EVERY', 1024)
+
+
+def payload(size, seed=0):
+    return bytes((i * 31 + seed) % 251 for i in range(size))
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_parallel_segments(server, tmp_path):
+    data = payload(100_000)
+    server.put('/data.bin', data, 'v1')
+    out = str(tmp_path / 'data.bin')
+    download(server.url('/data.bin'), out, sha256=sha256(data), segments=4, show_progress=False)
+    assert open(out, 'rb').read() == data
+    assert len(server.body_requests()) == 4
+    assert not os.path.exists(out + '.part') and not os.path.exists(out + '.part.json')
+
+
+def test_resume_after_dropped_connection(server, tmp_path):
+    data = payload(50_000)
+    server.put('/data.bin', data, 'v1')
+    out = str(tmp_path / 'data.bin')
+    server.drop_after = 20_000
+    with pytest.raises(requests.RequestException):
+        download(server.url('/data.bin'), out, segments=1, show_progress=False)
+    assert os.path.exists(out + '.part.json')
+
+    server.drop_after = None
+    server.requests.clear()
+    download(server.url('/data.bin'), out, sha256=sha256(data), segments=1, show_progress=False)
+    assert open(out, 'rb').read() == data
+    # The second run only asked for what was missing, guarded by the ETag
+    (_, range_header, if_range, status), = server.body_requests()
+    resumed_from = int(range_header.split('=')[1].split('-')[0])
+    assert 0 < resumed_from <= 20_000
+    assert if_range == '"v1"' and status == 206
+
+
+def test_changed_file_restarts(server, tmp_path):
+    out = str(tmp_path / 'data.bin')
+    server.put('/data.bin', payload(50_000), 'v1')
+    server.drop_after = 20_000
+    with pytest.raises(requests.RequestException):
+        download(server.url('/data.bin'), out, segments=1, show_progress=False)
+
+    # The remote file changes before the rerun: the partial bytes must not be reused
+    new = payload(50_000, seed=7)
+    server.put('/data.bin', new, 'v2')
+    server.drop_after = None
+    server.requests.clear()
+    download(server.url('/data.bin'), out, sha256=sha256(new), segments=1, show_progress=False)
+    assert open(out, 'rb').read() == new
+    (_, range_header, _, _), = server.body_requests()
+    assert range_header == 'bytes=0-49999'
+
+
+def test_if_range_mismatch_is_refused(server, tmp_path):
+    # The file changes between the probe and a segment request: the server answers 200
+    data = payload(10_000)
+    server.put('/data.bin', data, 'v1')
+    session = requests.Session()
+    original_get = session.get
+
+    def get(url, headers=None, **kwargs):
+        if headers and headers.get('Range') != 'bytes=0-0':
+            server.put('/data.bin', payload(10_000, seed=3), 'v2')
+        return original_get(url, headers=headers, **kwargs)
+
+    session.get = get
+    with pytest.raises(IOError, match='ignored the range'):
+        download(server.url('/data.bin'), str(tmp_path / 'data.bin'), segments=2, session=session,
+                 show_progress=False)
+
+
+def test_no_range_support_falls_back_to_one_stream(server, tmp_path):
+    data = payload(30_000)
+    server.put('/data.bin', data, 'v1')
+    server.ranges = False
+    out = str(tmp_path / 'data.bin')
+    server.drop_after = 10_000
+    with pytest.raises(requests.RequestException):
+        download(server.url('/data.bin'), out, segments=4, show_progress=False)
+    server.drop_after = None
+    server.requests.clear()
+    download(server.url('/data.bin'), out, sha256=sha256(data), segments=4, show_progress=False)
+    assert open(out, 'rb').read() == data
+    # Nothing can be resumed without ranges: one plain request for the whole file
+    assert [(request[1], request[3]) for request in server.requests] == [('bytes=0-0', 200), (None, 200)]
+
+
+def test_checksum_mismatch_removes_partial(server, tmp_path):
+    server.put('/data.bin', payload(10_000), 'v1')
+    out = str(tmp_path / 'data.bin')
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        download(server.url('/data.bin'), out, sha256='0' * 64, show_progress=False)
+    assert not os.listdir(tmp_path)
+
+
+def test_existing_download_is_kept(server, tmp_path):
+    data = payload(10_000)
+    out = tmp_path / 'data.bin'
+    out.write_bytes(data)
+    download(server.url('/data.bin'), str(out), sha256=sha256(data), show_progress=False)
+    assert server.requests == []
+
+
+def tar_bytes(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_tar_resume_extracts_everything(server, tmp_path):
+    # Incompressible members, so the archive is big enough to be cut off part way
+    files = {f"real/video{i}/frame_{j}.jpg": random.Random(i * 10 + j).randbytes(3_000)
+             for i in range(3) for j in range(4)}
+    archive = tar_bytes(files)
+    server.put('/data.tar.gz', archive, 'v1')
+    out, extract_to = str(tmp_path / 'data.tar.gz'), str(tmp_path / 'extracted')
+    server.drop_after = len(archive) // 2
+    with pytest.raises(requests.RequestException):
+        download_tar(server.url('/data.tar.gz'), out, extract_to, show_progress=False)
+
+    server.drop_after = None
+    server.requests.clear()
+    download_tar(server.url('/data.tar.gz'), out, extract_to, sha256=sha256(archive), show_progress=False)
+    assert open(out, 'rb').read() == archive
+    for name, data in files.items():
+        assert (tmp_path / 'extracted' / name).read_bytes() == data
+    (_, range_header, _, status), = server.body_requests()
+    assert range_header.startswith('bytes=') and range_header != 'bytes=0-' and status == 206
+
+
+def test_tar_already_downloaded_is_not_fetched_again(server, tmp_path):
+    archive = tar_bytes({'a/b.jpg': b'x' * 100})
+    out = tmp_path / 'data.tar.gz'
+    out.write_bytes(archive)
+    download_tar(server.url('/data.tar.gz'), str(out), str(tmp_path / 'extracted'), sha256=sha256(archive),
+                 show_progress=False)
+    assert server.requests == []
+    # Extracted from the local archive because the target did not exist yet
+    assert (tmp_path / 'extracted' / 'a' / 'b.jpg').read_bytes() == b'x' * 100
+
+
+def test_tar_complete_part_file_is_finished_without_a_request(server, tmp_path):
+    # An earlier run wrote every byte but was killed before renaming the .part file
+    archive = tar_bytes({'a/b.jpg': b'y' * 5_000})
+    server.put('/data.tar.gz', archive, 'v1')
+    out, extract_to = str(tmp_path / 'data.tar.gz'), str(tmp_path / 'extracted')
+    (tmp_path / 'data.tar.gz.part').write_bytes(archive)
+    download_dataset._save_state(out + '.part.json', {'url': server.url('/data.tar.gz'), 'size': len(archive),
+                                                     'validator': '"v1"'})
+    download_tar(server.url('/data.tar.gz'), out, extract_to, sha256=sha256(archive), show_progress=False)
+    assert open(out, 'rb').read() == archive
+    assert (tmp_path / 'extracted' / 'a' / 'b.jpg').read_bytes() == b'y' * 5_000
+    assert server.body_requests() == []
+    assert sorted(os.listdir(tmp_path)) == ['data.tar.gz', 'extracted']
@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+import pytest
+
+from extract_frames import VideoOpenError, iter_frames
+
+
+def write_video(path, frames=12, size=(64, 48)):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'MJPG'), 10, size)
+    for i in range(frames):
+        writer.write(np.full((size[1], size[0], 3), i * 20, dtype=np.uint8))
+    writer.release()
+
+
+def test_iter_frames_samples_every_nth(tmp_path):
+    path = tmp_path / 'clip.avi'
+    write_video(path)
+    assert [index for index, _ in iter_frames(str(path), frame_rate=3)] == [0, 3, 6, 9]
+    assert len(list(iter_frames(str(path), max_frames=5))) == 5
+
+
+def test_unreadable_video_raises_video_open_error(tmp_path):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(b'not a video')
+    with pytest.raises(VideoOpenError):
+        list(iter_frames(str(path)))
+
+
+def test_video_open_error_is_not_a_connection_error():
+    # Backends map VideoOpenError to 400 and ConnectionError (inference server down) to 503
+    assert not issubclass(VideoOpenError, ConnectionError)
+    assert not issubclass(ConnectionError, VideoOpenError)
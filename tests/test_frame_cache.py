@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from frame_cache import FrameCache
+
+SHAPE = (8, 8, 3)
+
+
+def frame(value):
+    return np.full(SHAPE, value, dtype=np.uint8)
+
+
+def test_round_trip_and_reopen(tmp_path):
+    cache = FrameCache(str(tmp_path), frame_shape=SHAPE, capacity=4, memory_items=1)
+    keys = [FrameCache.key_for(bytes([i])) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, frame(i))
+    assert np.array_equal(cache.get(keys[0]), frame(0))  # From disk, the memory LRU holds one
+    cache.close()
+
+    reopened = FrameCache(str(tmp_path), frame_shape=SHAPE, capacity=4)
+    assert reopened.cache_dir == str(tmp_path)
+    assert np.array_equal(reopened.get(keys[2]), frame(2))
+    reopened.close()
+
+
+def test_ring_overwrites_oldest(tmp_path):
+    cache = FrameCache(str(tmp_path), frame_shape=SHAPE, capacity=2, memory_items=0)
+    keys = [FrameCache.key_for(bytes([i])) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, frame(i))
+    assert cache.get(keys[0]) is None
+    assert np.array_equal(cache.get(keys[2]), frame(2))
+    cache.close()
+
+
+def test_second_process_gets_its_own_ring(tmp_path):
+    # A worker process holds the ring in the shared directory while this one opens the cache
+    holder = subprocess.Popen(
+        [sys.executable, '-c',
+         'import sys; from frame_cache import FrameCache; '
+         f'c = FrameCache({str(tmp_path)!r}, frame_shape={SHAPE}, capacity=4); '
+         'print(c.cache_dir, flush=True); sys.stdin.read()'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        assert holder.stdout.readline().strip() == str(tmp_path)
+        cache = FrameCache(str(tmp_path), frame_shape=SHAPE, capacity=4)
+        assert cache.cache_dir == os.path.join(str(tmp_path), 'worker-1')
+        cache.close()
+    finally:
+        holder.stdin.close()
+        holder.wait(timeout=30)
+
+    # Once the other process is gone its ring is free again
+    cache = FrameCache(str(tmp_path), frame_shape=SHAPE, capacity=4)
+    assert cache.cache_dir == str(tmp_path)
+    cache.close()
+
+
+def test_variants_lock_separately(tmp_path):
+    plain = FrameCache(str(tmp_path), frame_shape=SHAPE, capacity=4)
+    faces = FrameCache(str(tmp_path), frame_shape=SHAPE, capacity=4, variant='face')
+    assert plain.cache_dir == faces.cache_dir == str(tmp_path)
+    plain.close()
+    faces.close()
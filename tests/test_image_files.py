@@ -0,0 +1,39 @@
+import gc
+import warnings
+
+import numpy as np
+import pytest
+
+from deepfake_detector import iter_image_files
+
+
+def test_iter_image_files_reads_and_closes(tmp_path):
+    (tmp_path / 'b').mkdir()
+    (tmp_path / 'b' / 'two.PNG').write_bytes(b'png')
+    (tmp_path / 'one.jpg').write_bytes(b'jpg')
+    (tmp_path / 'notes.txt').write_text('skip me')
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', ResourceWarning)
+        items = [(path, read_fn()) for path, read_fn in iter_image_files(str(tmp_path))]
+        gc.collect()
+    assert items == [(str(tmp_path / 'one.jpg'), b'jpg'), (str(tmp_path / 'b' / 'two.PNG'), b'png')]
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
+
+
+def test_unreadable_frame_file_is_skipped_with_or_without_cache(tmp_path):
+    cv2 = pytest.importorskip('cv2')
+    pytest.importorskip('tensorflow')
+    from deepfake_detector import DeepfakeDetector
+
+    image = tmp_path / 'frame.jpg'
+    cv2.imwrite(str(image), np.zeros((64, 64, 3), dtype=np.uint8))
+    missing = str(tmp_path / 'gone.jpg')
+    detector = DeepfakeDetector(pretrained=False)
+    assert detector.load_frame_file(missing) is None
+    detector.enable_cache(str(tmp_path / 'cache'), capacity=8)
+    try:
+        assert detector.load_frame_file(missing) is None
+        assert detector.load_frame_file(str(image)).shape == (128, 128, 3)
+    finally:
+        detector.cache.close()
@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pytest
+
+from inference_server import InferenceClient, InferenceServer
+
+
+class BlockingDetector:
+    """Scores every frame 0.25, but only once release is set"""
+
+    input_size = (4, 4)
+
+    def __init__(self, release):
+        self.release = release
+
+    def score_batch(self, images):
+        self.release.wait(5)
+        return np.full(len(images), 0.25, dtype='float32')
+
+
+def serve(socket_path, release):
+    InferenceServer(BlockingDetector(release), socket_path, max_wait_ms=0).serve_forever()
+
+
+@pytest.fixture
+def server():
+    # A separate process, as in production: it owns its own view of the client's shared memory.
+    # Unix socket paths are short, so keep it out of pytest's deep tmp_path
+    context = multiprocessing.get_context('spawn')
+    socket_dir = tempfile.mkdtemp(prefix='inference-')
+    socket_path = os.path.join(socket_dir, 's.sock')
+    release = context.Event()
+    process = context.Process(target=serve, args=(socket_path, release), daemon=True)
+    process.start()
+    yield socket_path, release
+    release.set()
+    process.terminate()
+    process.join(5)
+    shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+def test_saturated_client_raises_connection_error(server):
+    socket_path, release = server
+    client = InferenceClient(socket_path, slots=1, connect_timeout=30, timeout=0.2)
+    try:
+        frame = np.zeros((4, 4, 3), dtype='float32')
+        future = client.submit(frame)
+        # The only slot is in flight: the backends turn ConnectionError into 503
+        started = time.monotonic()
+        with pytest.raises(ConnectionError, match='No free inference slot'):
+            client.submit(frame)
+        assert time.monotonic() - started < 2
+        release.set()
+        assert future.result(5) == pytest.approx(0.25)
+        # The slot is free again once the score arrives
+        assert client.predict(frame, timeout=5) == pytest.approx(0.25)
+    finally:
+        client.stop()
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+
+import pytest
+
+import job_queue
+from job_queue import JobQueue
+
+
+@pytest.fixture
+def short_lease(monkeypatch):
+    monkeypatch.setattr(job_queue, 'LEASE_SECONDS', 0.1)
+    monkeypatch.setattr(job_queue, 'PROGRESS_INTERVAL', 0)
+    monkeypatch.setattr(job_queue, 'PURGE_INTERVAL', 0)
+
+
+def submit(queue, kind='echo', options=None):
+    job_id, input_dir = queue.create()
+    with open(os.path.join(input_dir, 'upload.bin'), 'wb') as f:
+        f.write(b'data')
+    return queue.submit(job_id, kind, options or {})
+
+
+def wait_for_status(queue, job_id, status, timeout=5):
+    deadline = time.monotonic() + timeout
+    while queue.get(job_id)['status'] != status:
+        assert time.monotonic() < deadline, queue.get(job_id)
+        time.sleep(0.01)
+    return queue.get(job_id)
+
+
+def test_workers_run_jobs_and_record_results(tmp_path):
+    queue = JobQueue(str(tmp_path), workers=1, poll_interval=0.05)
+
+    def echo(job, progress):
+        progress(2, 4)
+        return {'value': job['options']['value'], 'input': sorted(os.listdir(os.path.join(job['dir'], 'input')))}
+
+    def boom(job, progress):
+        raise ValueError("bad input")
+
+    queue.start({'echo': echo, 'boom': boom})
+    try:
+        ok = submit(queue, options={'value': 7})
+        bad = submit(queue, kind='boom')
+        unknown = submit(queue, kind='nope')
+        job = wait_for_status(queue, ok, 'done')
+        assert job['result'] == {'value': 7, 'input': ['upload.bin']}
+        assert job['progress'] == 1.0 and job['done'] == job['total'] == 4
+        assert wait_for_status(queue, bad, 'failed')['error'] == "bad input"
+        assert "Unknown job kind" in wait_for_status(queue, unknown, 'failed')['error']
+    finally:
+        queue.stop()
+    # Uploads are removed once a job finishes
+    assert not os.path.exists(os.path.join(str(tmp_path), ok, 'input'))
+    stats = queue.stats()
+    assert (stats['done'], stats['failed'], stats['completed_here'], stats['failed_here']) == (1, 2, 1, 2)
+
+
+def test_queued_jobs_survive_a_restart(tmp_path):
+    job_id = submit(JobQueue(str(tmp_path)))
+    queue = JobQueue(str(tmp_path), poll_interval=0.05).start({'echo': lambda job, progress: 'ok'})
+    try:
+        assert wait_for_status(queue, job_id, 'done')['result'] == 'ok'
+    finally:
+        queue.stop()
+
+
+def test_expired_lease_is_claimed_again(tmp_path, short_lease):
+    dead = JobQueue(str(tmp_path))
+    alive = JobQueue(str(tmp_path))
+    job_id = submit(dead)
+    assert dead._claim()['id'] == job_id  # this worker then dies without finishing
+    assert alive._claim() is None  # still leased
+    time.sleep(0.15)
+    job = alive._claim()
+    assert job['id'] == job_id
+    assert job['options'] == {} and job['dir'] == os.path.join(str(tmp_path), job_id)
+    assert alive.get(job_id)['attempts'] == 2
+
+
+def test_progress_extends_the_lease(tmp_path, short_lease):
+    queue = JobQueue(str(tmp_path))
+    job_id = submit(queue)
+    queue._claim()
+    progress = queue._progress_fn(job_id)
+    for done in range(3):
+        time.sleep(0.05)
+        progress(done, 10)
+    time.sleep(0.05)
+    assert queue._claim() is None
+    assert queue.get(job_id)['done'] == 2 and queue.get(job_id)['total'] == 10
+
+
+def test_job_that_keeps_dying_is_failed(tmp_path, short_lease):
+    queue = JobQueue(str(tmp_path))
+    job_id = submit(queue)
+    for _ in range(job_queue.MAX_ATTEMPTS):
+        assert queue._claim()['id'] == job_id
+        time.sleep(0.15)
+    assert queue._claim() is None
+    job = queue.get(job_id)
+    assert job['status'] == 'failed'
+    assert job['error'] == f"Interrupted {job_queue.MAX_ATTEMPTS} times"
+
+
+def test_purge_removes_only_expired_finished_jobs(tmp_path, short_lease):
+    queue = JobQueue(str(tmp_path), ttl_seconds=0.05)
+    finished = submit(queue)
+    queue._claim()
+    queue._finish(finished, 'done', result='ok')
+    with open(os.path.join(str(tmp_path), finished, 'results.csv'), 'w') as f:
+        f.write('name,score\n')
+    assert queue.results_file(finished).endswith('results.csv')
+    waiting = submit(queue)
+    time.sleep(0.1)
+    queue._purge()
+    assert queue.get(finished) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), finished))
+    assert queue.get(waiting)['status'] == 'queued'
+    assert os.path.isdir(os.path.join(str(tmp_path), waiting, 'input'))
+
+
+def test_concurrent_claims_take_each_job_once(tmp_path):
+    queues = [JobQueue(str(tmp_path)) for _ in range(4)]
+    submitted = {submit(queues[0]) for _ in range(12)}
+    claimed = []
+
+    def drain(queue):
+        job = queue._claim()
+        while job is not None:
+            claimed.append(job['id'])
+            job = queue._claim()
+
+    threads = [threading.Thread(target=drain, args=(queue,)) for queue in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(submitted)
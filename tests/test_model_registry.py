@@ -0,0 +1,179 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from batching import BatchScheduler
+from model_registry import ModelManager, ModelRegistry, ServedModel
+
+
+class StubDetector:
+    """What ModelManager needs from a DeepfakeDetector: an input size and frame normalization"""
+
+    def __init__(self, score, input_size=(4, 4)):
+        self.score = score
+        self.input_size = input_size
+
+    def normalize_frame(self, frame):
+        return frame.astype('float32') / 255.0
+
+    def score_batch(self, images):
+        return np.full(len(images), self.score)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    model = tmp_path / 'model.h5'
+    model.write_bytes(b'weights')
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    for _ in range(3):
+        registry.publish(str(model))
+    return registry
+
+
+class Loader:
+    """load_fn stub: one StubDetector per version, scoring 0.2, 0.8, ... by version number"""
+
+    def __init__(self, scores=None, fail=()):
+        self.scores = scores or {}
+        self.fail = set(fail)
+        self.loaded = []
+        self.closed = []
+
+    def __call__(self, version, path):
+        if version in self.fail:
+            raise OSError(f"cannot read {path}")
+        self.loaded.append(version)
+        detector = StubDetector(self.scores.get(version, 0.2), input_size=(4, 4) if version != 'v0003' else (2, 2))
+        batcher = BatchScheduler(detector.score_batch, max_wait_ms=0).start()
+
+        def close():
+            batcher.stop()
+            self.closed.append(version)
+
+        return ServedModel(version, detector, batcher, path=path, close=close)
+
+
+def test_publish_numbers_versions_and_pointers(registry, tmp_path):
+    assert registry.versions() == ['v0001', 'v0002', 'v0003']
+    assert registry.model_path('v0002').endswith('v0002/model.h5')
+    assert registry.current() is None
+    registry.set_current('v0001')
+    registry.set_shadow('v0002')
+    assert (registry.current(), registry.shadow()) == ('v0001', 'v0002')
+    # Promoting the shadow clears the SHADOW pointer
+    registry.set_current('v0002')
+    assert (registry.current(), registry.shadow()) == ('v0002', None)
+    with pytest.raises(ValueError):
+        registry.set_current('v0009')
+    with pytest.raises(ValueError):
+        registry.publish(str(tmp_path / 'notes.txt'))
+
+
+def test_served_model_closes_after_last_user():
+    closed = threading.Event()
+    served = ServedModel('v1', StubDetector(0.5), None, close=closed.set)
+    served.acquire()
+    served.acquire()
+    served.retire()
+    served.release()
+    assert not closed.wait(0.05) and not served.closed
+    served.release()
+    assert closed.wait(2) and served.closed
+
+
+def test_swap_keeps_pinned_requests_on_old_version(registry):
+    loader = Loader()
+    models = ModelManager(loader, registry)
+    models.load('v0001', registry.model_path('v0001'))
+    with models.use() as pinned:
+        models.load('v0002', registry.model_path('v0002'))
+        # New requests get the new version while the pinned one still works
+        with models.use() as fresh:
+            assert fresh.version == 'v0002'
+        assert pinned.version == 'v0001'
+        assert pinned.batcher.predict(np.zeros((4, 4, 3), dtype='float32'), timeout=2) == pytest.approx(0.2)
+        assert loader.closed == []
+        assert [entry['version'] for entry in models.describe()['draining']] == ['v0001']
+    wait_for(lambda: loader.closed == ['v0001'])
+    assert models.stats()['swaps'] == 1 and models.stats()['draining'] == 0
+
+
+def test_sync_follows_pointers_and_survives_bad_versions(registry):
+    loader = Loader(fail={'v0002'})
+    models = ModelManager(loader, registry)
+    registry.set_current('v0001')
+    models.sync()
+    assert models.active.version == 'v0001'
+
+    registry.set_current('v0002')
+    models.sync()
+    models.sync()  # A failed version is not retried while the pointer stays on it
+    assert models.active.version == 'v0001'
+    assert loader.loaded == ['v0001']
+    assert models.last_error.startswith('v0002')
+
+    registry.set_current('v0003')
+    models.sync()
+    assert models.active.version == 'v0003'
+    # Rolling back loads the old version again
+    registry.set_current('v0001')
+    models.sync()
+    assert models.active.version == 'v0001'
+    assert loader.loaded == ['v0001', 'v0003', 'v0001']
+
+
+def test_shadow_scores_sample_and_is_promoted_warm(registry):
+    loader = Loader(scores={'v0001': 0.2, 'v0003': 0.9})
+    models = ModelManager(loader, registry, shadow_rate=1.0)
+    registry.set_current('v0001')
+    registry.set_shadow('v0003')
+    models.sync()
+    assert models.describe()['shadow']['version'] == 'v0003'
+
+    # v0003 takes 2x2 frames: the 4x4 frame is resized for it
+    for _ in range(4):
+        models.compare_shadow(np.zeros((4, 4, 3), dtype=np.uint8), 0.2)
+    wait_for(lambda: (models.stats() or {}).get('shadow_compared') == 4)
+    stats = models.stats()
+    assert stats['shadow_agreement'] == 0.0
+    assert stats['shadow_mean_abs_diff'] == pytest.approx(0.7)
+    assert stats['shadow_errors'] == 0
+
+    shadow = models.describe()['shadow']
+    registry.set_current('v0003')
+    models.sync()
+    assert models.active.version == 'v0003'
+    assert models.active.loaded_at == shadow['loaded_at']
+    assert loader.loaded == ['v0001', 'v0003']  # Promoted, not loaded again
+    assert models.describe()['shadow'] is None
+    wait_for(lambda: loader.closed == ['v0001'])
+
+
+def test_shadow_off_skips_comparisons(registry):
+    loader = Loader()
+    models = ModelManager(loader, registry, shadow_rate=0.0)
+    registry.set_current('v0001')
+    registry.set_shadow('v0002')
+    models.sync()
+    models.compare_shadow(np.zeros((4, 4, 3), dtype=np.uint8), 0.2)
+    assert models.stats()['shadow_compared'] == 0
+
+    registry.set_shadow(None)
+    models.sync()
+    assert models.describe()['shadow'] is None
+    wait_for(lambda: loader.closed == ['v0002'])
+
+
+def test_use_without_a_model_raises():
+    with pytest.raises(RuntimeError):
+        with ModelManager(Loader()).use():
+            pass
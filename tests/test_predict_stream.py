@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from deepfake_detector import DeepfakeDetector
+
+
+@pytest.fixture(scope='module')
+def detector():
+    detector = DeepfakeDetector(pretrained=False)
+    width, height = detector.input_size
+    # Item bytes carry a pixel value, b'bad' cannot be decoded and multiples of 3 are triaged
+    detector.load_frame_bytes = lambda data: None if data == b'bad' else np.full((height, width, 3), int(data), np.uint8)
+    detector.normalize_frame = lambda frame: frame.astype('float32') / 255
+    detector.triage_score = lambda frame: 0.01 if round(frame.flat[0] * 255) % 3 == 0 else None
+    return detector
+
+
+def pixel_scores(batch):
+    """Stand-in model: a frame's score is its normalized pixel value"""
+    return np.asarray(batch)[:, 0, 0, 0]
+
+
+def items_for(values):
+    return [(f"img_{i}.jpg", lambda data=data: data) for i, data in enumerate(values)]
+
+
+@pytest.mark.parametrize('batch_size', [1, 4, 16])
+def test_results_keep_input_order(detector, batch_size):
+    values = [b'bad' if i % 7 == 3 else str(i).encode() for i in range(50)]
+    results = list(detector.predict_stream(items_for(values), batch_size=batch_size, score_fn=pixel_scores))
+    assert [name for name, _ in results] == [f"img_{i}.jpg" for i in range(50)]
+    for data, (_, result) in zip(values, results):
+        if data == b'bad':
+            assert result is None
+        elif int(data) % 3 == 0:
+            assert result['stage'] == 'triage'
+        else:
+            assert result['stage'] == 'model'
+            assert result['raw_score'] == pytest.approx(int(data) / 255)
+
+
+def test_decided_results_are_not_held_back_by_a_partial_batch(detector):
+    # One model frame followed by many triaged ones: its batch is scored before it fills
+    seen = []
+    scored_after = []
+
+    def score(batch):
+        scored_after.append(len(seen))
+        return pixel_scores(batch)
+
+    for name, _ in detector.predict_stream(items_for([b'1'] + [b'3'] * 200), batch_size=16, score_fn=score):
+        seen.append(name)
+    assert seen == [f"img_{i}.jpg" for i in range(201)]
+    assert scored_after == [0]
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from deepfake_detector import DeepfakeDetector
+
+
+@pytest.fixture
+def detector():
+    detector = DeepfakeDetector(pretrained=False)
+    yield detector
+    tf.keras.mixed_precision.set_global_policy('float32')
+
+
+def test_mixed_precision_rebuild_keeps_a_student_architecture(detector):
+    # A distilled student differs from the teacher _build_model creates
+    detector.model = detector._build_student_model((96, 96), 0.35, weights=None)
+    base = detector.model.layers[0]
+    for layer in base.layers[:40]:
+        layer.trainable = False
+    frames = np.random.RandomState(0).rand(2, 96, 96, 3).astype('float32')
+    expected = detector.model.predict(frames, verbose=0)
+    weights = detector.model.get_weights()
+
+    tf.keras.mixed_precision.set_global_policy('mixed_bfloat16')
+    detector._rebuild_model()
+    assert detector.model.input_shape == (None, 96, 96, 3)
+    assert all(np.array_equal(a, b) for a, b in zip(weights, detector.model.get_weights()))
+    assert detector.model.layers[0].layers[5].compute_dtype == 'bfloat16'
+    assert detector.model.layers[-1].compute_dtype == 'float32'  # The output stays float32
+    assert ([layer.trainable for layer in detector.model.layers[0].layers if layer.weights]
+            == [layer.trainable for layer in base.layers if layer.weights])
+
+    tf.keras.mixed_precision.set_global_policy('float32')
+    detector._rebuild_model()
+    assert detector.model.layers[0].layers[5].compute_dtype == 'float32'
+    np.testing.assert_allclose(detector.model.predict(frames, verbose=0), expected, atol=1e-5)
@@ -0,0 +1,118 @@
+import os
+
+from deepfake_detector import DeepfakeDetector, covers_labels, frame_groups, split_indices
+
+
+def frames(root, quality, speaker, clip, count, face_swap=None):
+    """Frame paths laid out like DeepfakeTIMIT: <quality>/<speaker>/<clip>-video-<other speaker>/frame_N.jpg"""
+    video = f"{clip}-video-{face_swap}" if face_swap else clip
+    return [os.path.join(root, quality, speaker, video, f"frame_{i:06d}.jpg") for i in range(count)]
+
+
+def test_video_groups_by_directory(tmp_path):
+    paths = frames(str(tmp_path), 'real', 'fadg0', 'sa1', 2) + frames(str(tmp_path), 'real', 'fadg0', 'sa2', 2)
+    groups = frame_groups(paths, 'video')
+    assert groups[0] == groups[1] != groups[2] == groups[3]
+
+
+def test_speaker_groups_join_face_swaps(tmp_path):
+    root = str(tmp_path)
+    # fadg0's real video, a swap naming fadg0 and mrjo0, and mrjo0's real video end up in one group
+    paths = (frames(root, 'real', 'fadg0', 'sa1', 2)
+             + frames(root, 'higher_quality', 'mrjo0', 'sa1', 2, face_swap='fadg0')
+             + frames(root, 'real', 'mrjo0', 'sa2', 2)
+             + frames(root, 'real', 'fcft0', 'sa1', 2))
+    groups = frame_groups(paths, 'speaker')
+    assert len(set(groups[:6])) == 1
+    assert groups[6] == groups[7] != groups[0]
+
+
+def test_speaker_ids_only_read_from_path_tail():
+    # A speaker-like name higher up the path (the checkout directory) must not join everything
+    paths = ['/data/mabc0/real/fadg0/sa1/frame_0.jpg', '/data/mabc0/real/fcft0/sa1/frame_0.jpg']
+    groups = frame_groups(paths, 'speaker')
+    assert groups[0] != groups[1]
+
+
+def test_split_indices_keeps_groups_on_one_side():
+    groups = [g for g in range(10) for _ in range(5)]
+    labels = [g % 2 for g in groups]
+    train, val = split_indices(labels, groups, validation_split=0.2)
+    assert sorted(train + val) == list(range(50))
+    assert not {groups[i] for i in train} & {groups[i] for i in val}
+    # 25 frames per label, target 5 each: one group of each label
+    assert sum(labels[i] == 0 for i in val) == 5
+    assert sum(labels[i] == 1 for i in val) == 5
+
+
+def test_split_indices_skips_groups_that_overshoot():
+    # One label-0 group holds 12 of 20 frames: taking it (12) is further from the target (4) than 0
+    groups = [0] * 12 + [1] * 4 + [2] * 4 + [3] * 10 + [4] * 10
+    labels = [0] * 20 + [1] * 20
+    train, val = split_indices(labels, groups, validation_split=0.2)
+    val_groups = {groups[i] for i in val}
+    assert 0 not in val_groups
+    assert sum(labels[i] == 0 for i in val) == 4
+
+
+def test_split_indices_accepts_closer_overshoot():
+    # Target 2 per label: a group of 3 (1 over) beats stopping at 0 (2 under)
+    groups = [0] * 3 + [1] * 7 + [2] * 3 + [3] * 7
+    labels = [0] * 10 + [1] * 10
+    _, val = split_indices(labels, groups, validation_split=0.2)
+    assert sum(labels[i] == 0 for i in val) == 3
+    assert sum(labels[i] == 1 for i in val) == 3
+
+
+def test_covers_labels():
+    labels = [0, 0, 1, 1]
+    assert covers_labels(labels, [0, 2], [1, 3])
+    assert not covers_labels(labels, [0, 1, 2], [3])
+    assert not covers_labels(labels, [0, 1, 2, 3], [])
+
+
+def split_dataset(paths, labels, split_by='speaker'):
+    # split_dataset does not touch the model, so skip building one
+    return DeepfakeDetector.split_dataset(object.__new__(DeepfakeDetector), paths, labels, 0.1, split_by)
+
+
+def test_split_dataset_falls_back_when_a_label_is_one_group(tmp_path):
+    root = str(tmp_path)
+    # 5 real speakers against fakes that all involve the same speaker: one fake speaker group
+    paths, labels = [], []
+    for speaker in ('fadg0', 'fcft0', 'mrjo0', 'mdab0', 'fedw0'):
+        for clip in ('sa1', 'sa2'):
+            paths += frames(root, 'real', speaker, clip, 10)
+            labels += [0] * 10
+    for clip in ('sa1', 'sa2', 'si1', 'si2', 'sx1', 'sx2', 'sx3', 'sx4', 'sx5', 'sx6'):
+        paths += frames(root, 'higher_quality', 'fram1', clip, 10, face_swap='fram1')
+        labels += [1] * 10
+
+    train, val, by = split_dataset(paths, labels, 'speaker')
+    assert by == 'video'
+    assert {labels[i] for i in val} == {0, 1}
+    assert {labels[i] for i in train} == {0, 1}
+    video = frame_groups(paths, 'video')
+    assert not {video[i] for i in train} & {video[i] for i in val}
+
+
+def test_split_dataset_falls_back_to_frames(tmp_path):
+    # A single video per label cannot be split by video
+    paths = frames(str(tmp_path), 'real', 'fadg0', 'sa1', 10) + frames(str(tmp_path), 'fake', 'fcft0', 'sa1', 10)
+    labels = [0] * 10 + [1] * 10
+    train, val, by = split_dataset(paths, labels, 'speaker')
+    assert by == 'frame'
+    assert {labels[i] for i in val} == {0, 1}
+
+
+def test_split_dataset_keeps_requested_grouping(tmp_path):
+    paths, labels = [], []
+    for label, speakers in ((0, ('fadg0', 'fcft0', 'mrjo0', 'mdab0', 'fedw0')),
+                            (1, ('faks0', 'mbdg0', 'mccs0', 'mcem0', 'fjas0'))):
+        for speaker in speakers:
+            paths += frames(str(tmp_path), 'real' if label == 0 else 'fake', speaker, 'sa1', 10)
+            labels += [label] * 10
+    train, val, by = split_dataset(paths, labels, 'speaker')
+    assert by == 'speaker'
+    speaker = frame_groups(paths, 'speaker')
+    assert not {speaker[i] for i in train} & {speaker[i] for i in val}
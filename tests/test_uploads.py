@@ -0,0 +1,97 @@
+import io
+
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import ClientDisconnect
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from uploads import (UnsupportedUpload, UploadLimitMiddleware, UploadTooLarge, multipart_file_head,
+                     read_image_upload, sniff_image)
+
+JPEG = b'\xff\xd8\xff\xe0' + b'\x00' * 100
+BOUNDARY = b'XyZ'
+
+
+def multipart(*parts):
+    body = b''
+    for headers, content in parts:
+        body += b'--' + BOUNDARY + b'\r\n' + headers + b'\r\n\r\n' + content + b'\r\n'
+    return body + b'--' + BOUNDARY + b'--\r\n'
+
+
+def test_sniff_image():
+    assert sniff_image(JPEG) == 'jpeg'
+    assert sniff_image(b'\x89PNG\r\n\x1a\n....') == 'png'
+    assert sniff_image(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'webp'
+    assert sniff_image(b'BM....') == 'bmp'
+    assert sniff_image(b'<html>') is None
+
+
+def test_read_image_upload_limits():
+    assert read_image_upload(io.BytesIO(JPEG), 1000) == JPEG
+    with pytest.raises(UnsupportedUpload):
+        read_image_upload(io.BytesIO(b'not an image' * 10), 1000)
+    with pytest.raises(UploadTooLarge):
+        read_image_upload(io.BytesIO(JPEG), 50, chunk_size=16)
+
+
+def test_multipart_file_head_skips_fields():
+    body = multipart((b'Content-Disposition: form-data; name="note"', b'hello'),
+                     (b'Content-Disposition: form-data; name="file"; filename="a.jpg"', JPEG))
+    assert multipart_file_head(body, BOUNDARY) == JPEG[:12]
+    # Not enough of the body yet
+    assert multipart_file_head(body[:body.index(b'filename') + 20], BOUNDARY) is None
+    # A file shorter than the sniffed size ends at the next delimiter
+    assert multipart_file_head(multipart((b'Content-Disposition: form-data; name="file"; filename="a"', b'BM')),
+                               BOUNDARY) == b'BM'
+
+
+def client(reached):
+    async def upload(request):
+        try:
+            reached.append(len(await request.body()))
+        except ClientDisconnect:
+            # What the middleware hands the app after answering for it
+            return JSONResponse({'ok': False})
+        return JSONResponse({'ok': True})
+
+    app = Starlette(routes=[Route('/image', upload, methods=['POST']), Route('/other', upload, methods=['POST'])])
+    return TestClient(UploadLimitMiddleware(app, max_bytes=10_000, limits={'/image': 1_000}, image_paths=['/image']))
+
+
+def chunked(body, size=64):
+    # A generator body is sent chunked, without a Content-Length
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def test_middleware_rejects_non_image_from_first_chunk():
+    reached = []
+    body = multipart((b'Content-Disposition: form-data; name="file"; filename="a.jpg"', b'<html>' * 150))
+    headers = {'content-type': 'multipart/form-data; boundary=XyZ'}
+    response = client(reached).post('/image', content=chunked(body), headers=headers)
+    assert response.status_code == 415
+    assert reached == []
+
+
+def test_middleware_passes_images_and_other_paths():
+    reached = []
+    headers = {'content-type': 'multipart/form-data; boundary=XyZ'}
+    image = multipart((b'Content-Disposition: form-data; name="file"; filename="a.jpg"', JPEG))
+    assert client(reached).post('/image', content=chunked(image), headers=headers).status_code == 200
+    other = multipart((b'Content-Disposition: form-data; name="file"; filename="a.mp4"', b'\x00' * 500))
+    assert client(reached).post('/other', content=chunked(other), headers=headers).status_code == 200
+    assert reached == [len(image), len(other)]
+
+
+def test_middleware_size_limits():
+    reached = []
+    headers = {'content-type': 'multipart/form-data; boundary=XyZ'}
+    big = multipart((b'Content-Disposition: form-data; name="file"; filename="a.jpg"', JPEG * 20))
+    # Declared length and chunked bodies are both cut off at the path's limit
+    assert client(reached).post('/image', content=big, headers=headers).status_code == 413
+    assert client(reached).post('/image', content=chunked(big), headers=headers).status_code == 413
+    assert client(reached).post('/other', content=big, headers=headers).status_code == 200
+    assert reached == [len(big)]
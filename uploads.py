@@ -0,0 +1,172 @@
+"""
+Bounded upload ingestion shared by both backends.
+
+UploadLimitMiddleware caps the whole request body for ASGI apps (FastAPI) before
+the multipart parser spools it. On image endpoints it also checks the first bytes
+of the uploaded file against known image signatures as they arrive, so a
+non-image is rejected before the rest of the body is read. The Flask backend
+only enforces the size cap early (MAX_CONTENT_LENGTH and Content-Length); there
+the signature check in read_image_upload runs once the body has been parsed.
+"""
+import json
+import re
+
+CHUNK_SIZE = 64 * 1024
+# How much of a multipart body UploadLimitMiddleware looks through for the file's first bytes
+SNIFF_LIMIT = 64 * 1024
+
+# Formats cv2.imdecode reads, by their leading bytes
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'BM', 'bmp'),
+)
+# File extensions of the formats sniff_image recognizes
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+BOUNDARY = re.compile(rb'boundary="?([^";]+)"?', re.IGNORECASE)
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeds its size limit (HTTP 413)"""
+
+
+class UnsupportedUpload(Exception):
+    """The upload is not an image format the model can decode (HTTP 415)"""
+
+
+def sniff_image(head):
+    """Image format named by the leading bytes ('jpeg', 'png', 'webp', 'bmp'), or None"""
+    head = bytes(head[:12])
+    for signature, kind in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def multipart_file_head(body, boundary, size=12):
+    """
+    First bytes (up to size) of the first file in the start of a multipart body,
+    or None until enough of the body has arrived to tell.
+    """
+    delimiter = b'--' + boundary
+    pos = body.find(delimiter)
+    while pos != -1:
+        start = pos + len(delimiter)
+        headers_end = body.find(b'\r\n\r\n', start)
+        if headers_end == -1:
+            return None
+        content = headers_end + 4
+        end = body.find(b'\r\n' + delimiter, content)
+        if b'filename=' in body[start:headers_end].lower():
+            if end != -1:
+                return bytes(body[content:min(end, content + size)])
+            return bytes(body[content:content + size]) if len(body) - content >= size else None
+        if end == -1:
+            return None
+        pos = end + 2
+    return None
+
+def read_image_upload(stream, max_bytes, chunk_size=CHUNK_SIZE):
+    """
+    Read an image from a file-like stream in chunks. Raises UnsupportedUpload as soon
+    as the first chunk does not look like an image, and UploadTooLarge once more than
+    max_bytes (None = unlimited) have been read.
+    """
+    data = bytearray()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if not data and sniff_image(chunk) is None:
+            raise UnsupportedUpload("File is not a JPEG, PNG, WebP or BMP image")
+        data += chunk
+        if max_bytes is not None and len(data) > max_bytes:
+            raise UploadTooLarge(f"Image is larger than {max_bytes} bytes")
+    return data
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware answering 413 for request bodies over max_bytes. A declared
+    Content-Length is checked before anything is read, and chunked bodies are counted
+    as they arrive and cut off at the limit. limits maps paths to their own byte limit.
+    On image_paths, a multipart upload whose file does not start with an image
+    signature is answered with 415 as soon as its first bytes arrive.
+    """
+
+    def __init__(self, app, max_bytes, limits=None, image_paths=()):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limits = limits or {}
+        self.image_paths = set(image_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        max_bytes = self.limits.get(scope['path'], self.max_bytes)
+        headers = dict(scope['headers'])
+        boundary = None
+        if scope['path'] in self.image_paths:
+            match = BOUNDARY.search(headers.get(b'content-type', b''))
+            boundary = match.group(1) if match else None
+        if max_bytes is None and boundary is None:
+            await self.app(scope, receive, send)
+            return
+
+        length = headers.get(b'content-length')
+        if max_bytes is not None and length is not None and length.isdigit() and int(length) > max_bytes:
+            await self._reject(send, 413, f"Upload is larger than {max_bytes} bytes")
+            return
+
+        received = 0
+        started = False
+        rejected = False
+        head = bytearray() if boundary is not None else None  # Body prefix kept until the file is sniffed
+
+        async def limited_receive():
+            # Past the limit (or on a non-image) the client is answered right away and the
+            # app sees a disconnect, so it stops reading and its own response is dropped
+            nonlocal received, rejected, head
+            if rejected:
+                return {'type': 'http.disconnect'}
+            message = await receive()
+            if message['type'] == 'http.request':
+                body = message.get('body', b'')
+                received += len(body)
+                if started:
+                    return message
+                if max_bytes is not None and received > max_bytes:
+                    rejected = True
+                    await self._reject(send, 413, f"Upload is larger than {max_bytes} bytes")
+                    return {'type': 'http.disconnect'}
+                if head is not None:
+                    head += body
+                    file_head = multipart_file_head(head, boundary)
+                    if file_head is not None and sniff_image(file_head) is None:
+                        rejected = True
+                        await self._reject(send, 415, "File is not a JPEG, PNG, WebP or BMP image")
+                        return {'type': 'http.disconnect'}
+                    if file_head is not None or len(head) > SNIFF_LIMIT or not message.get('more_body', False):
+                        # Sniffed, or no file part found early enough: the endpoint checks it
+                        head = None
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if rejected:
+                return
+            if message['type'] == 'http.response.start':
+                started = True
+            await send(message)
+
+        await self.app(scope, limited_receive, tracked_send)
+
+    async def _reject(self, send, status, detail):
+        body = json.dumps({'detail': detail}).encode()
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode()),
+                                (b'connection', b'close')]})
+        await send({'type': 'http.response.body', 'body': body})